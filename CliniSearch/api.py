@@ -2,7 +2,10 @@
 # Converted from Streamlit app to FastAPI for serverless deployment
 
 import os
+import time
 import asyncio
+import logging
+import hashlib
 import tempfile
 import shutil
 import base64
@@ -11,24 +14,53 @@ from pathlib import Path
 import json
 from io import BytesIO
 
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, Request
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response
 from pydantic import BaseModel
 from PIL import Image
 import numpy as np
-import torch
-from open_clip import create_model_from_pretrained, get_tokenizer
 
 # Import our utility modules
 from utils.api_clients import gemini_client
-from utils.rag_processing import VectorStore, perform_rag, parse_pdf, EMBEDDING_MODEL
-from utils.model_inference import diagnose_and_visualize, analyze_with_gemini, disease_labels
+from utils.lazy_resources import register_resource, start_background_loading, resource_status, ResourceUnavailable
+from utils.runtime_config import configure_runtime, runtime_diagnostics
+from utils.executors import run_cpu, run_io, run_in_executor, bulkhead, executor_status, BulkheadRejected
+from utils.rag_processing import VectorStore, perform_rag, parse_pdf, EMBEDDING_MODEL, EMBEDDING_DIMENSION
+from utils.image_ingest import DecodedImage, ingest_image, open_image, INGEST_POOL
+from utils.inference_service import InferenceClient, RemoteEmbedder
+from utils.xray_detection import XrayDetector, load_xray_detector
+from utils.diagnosis import disease_labels, HEATMAP_BLEND_PARAMETERS, RENDER_POOL, model_version, resolve_model_path
+from utils.gemini_analysis import (
+    get_pubmed_for_disease, analyze_individual_disease_with_pubmed, get_concise_conclusion_from_gemini,
+    get_comprehensive_conclusion_from_gemini, PROMPT_VERSION
+)
+from utils.pipeline import Pipeline
+from utils.degradation import TIER_PLANS, TIER_LATENCY, DEGRADE_QUEUE_REDUCED, DEGRADE_QUEUE_MINIMAL, select_tier
+from utils.response_cache import ResponseCache, cache_key
+from utils.telemetry import ServerTimingMiddleware, metrics_payload, stage_timer, PROMETHEUS_AVAILABLE
+from utils.profiling import ProfilingMiddleware, ARTIFACTS, artifact_path, authorized, profiling_enabled
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# With INFERENCE_SERVICE_SOCKET set, the classifier, GradCAM, BiomedCLIP and the
+# sentence-transformer run in separate inference service processes
+# (python -m utils.inference_service) and are never loaded here
+INFERENCE_SERVICE = InferenceClient()
+
+# Size torch/faiss/OpenCV thread pools to this worker's share of the cores before any model runs
+configure_runtime(torch_threads=not INFERENCE_SERVICE.enabled)
+
+# The in-process models; importing model_inference loads torch, which API workers in
+# front of an inference service never do
+if not INFERENCE_SERVICE.enabled:
+    from utils.model_inference import diagnose_and_visualize, classify_image, CLASSIFIER_MODEL
+
 # Initialize FastAPI app
 app = FastAPI(
     title="CliniSearch AI Medical System API",
@@ -43,26 +75,90 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Per-stage timings as Server-Timing response headers and Prometheus histograms (GET /metrics)
+app.add_middleware(ServerTimingMiddleware, route_app=app)
+
+# On-demand profiling of single requests (X-Profile: <PROFILING_TOKEN>); without a
+# token the middleware is not installed at all
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
+
+# Document and query embeddings, computed by the inference service when one is configured
+EMBEDDER = RemoteEmbedder(INFERENCE_SERVICE) if INFERENCE_SERVICE.enabled else EMBEDDING_MODEL
+
 # Global vector stores (in production, use proper database/Redis)
-embedding_dim = EMBEDDING_MODEL.get_sentence_embedding_dimension()
-research_vector_store = VectorStore(dimension=embedding_dim)
-radiology_vector_store = VectorStore(dimension=embedding_dim)
-
-# Initialize BiomedCLIP model for X-ray detection
-try:
-    model_id = "hf-hub:microsoft/BiomedCLIP-PubMedBERT_256-vit_base_patch16_224"
-    xray_model, xray_preprocess = create_model_from_pretrained(model_id)
-    xray_tokenizer = get_tokenizer(model_id)
-    xray_model.eval()
-    BIOMEDCLIP_AVAILABLE = True
-except Exception as e:
-    print(f"Warning: BiomedCLIP model not available: {e}")
-    xray_model = None
-    xray_preprocess = None
-    xray_tokenizer = None
-    BIOMEDCLIP_AVAILABLE = False
+research_vector_store = VectorStore(dimension=EMBEDDING_DIMENSION, embedder=EMBEDDER)
+radiology_vector_store = VectorStore(dimension=EMBEDDING_DIMENSION, embedder=EMBEDDER)
+
+# BiomedCLIP for X-ray detection (label text features are encoded once when it loads)
+XRAY_DETECTOR = register_resource("biomedclip", load_xray_detector)
+
+# Heavy models load in background threads once the server starts, so importing this
+# module (worker start, --reload) stays fast; endpoints await only what they use
+PRELOAD_RESOURCES = os.getenv("PRELOAD_RESOURCES", "true").lower() == "true"
+
+@app.on_event("startup")
+async def start_resource_loading():
+    if INFERENCE_SERVICE.enabled:
+        await INFERENCE_SERVICE.connect()
+    elif PRELOAD_RESOURCES:
+        start_background_loading()
+
+@app.on_event("shutdown")
+async def close_inference_service():
+    INFERENCE_SERVICE.close()
+
+# Per-endpoint-class concurrency limits (BULKHEAD_<NAME>_LIMIT); health and status
+# endpoints are never gated
+ANALYSIS_BULKHEAD = bulkhead("analysis", 2)
+XRAY_BULKHEAD = bulkhead("xray", 8)
+DOCUMENTS_BULKHEAD = bulkhead("documents", 4)
+
+# Admission control for whole analysis requests: at most LIMIT run at once, at most QUEUE
+# wait (more are rejected with 429) and none waits longer than MAX_WAIT seconds (503).
+# Bounds the GradCAM graphs, overlays and Gemini calls held in memory during a burst
+RADIOLOGY_ADMISSION = bulkhead("radiology_analyze", 4, max_queue=8, max_wait=30)
+TEST_ANALYSIS_ADMISSION = bulkhead("test_analyze", 1, max_queue=2, max_wait=30)
+
+@app.exception_handler(BulkheadRejected)
+async def bulkhead_rejected_handler(request: Request, exc: BulkheadRejected):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": {
+            "error": "overloaded",
+            "message": f"Server is busy ({exc.reason}); retry after {exc.retry_after}s",
+            "bulkhead": exc.bulkhead_name,
+            "retry_after": exc.retry_after
+        }},
+        headers={"Retry-After": str(exc.retry_after), "Cache-Control": "no-store"}
+    )
+
+def check_model_path(model_path: Optional[str]) -> None:
+    """Reject (400) request-supplied weights outside MODEL_DIRS before anything is loaded."""
+    try:
+        resolve_model_path(model_path)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def wait_for_classifier(model_path: Optional[str]) -> None:
+    """Wait for the default classifier to finish its background load before using it."""
+    if model_path or INFERENCE_SERVICE.enabled:
+        return
+    try:
+        await CLASSIFIER_MODEL.wait()
+    except RuntimeError:
+        # diagnose_and_visualize retries the load and reports the failure itself
+        pass
+
+async def get_xray_detector() -> Optional[XrayDetector]:
+    """Wait for BiomedCLIP to finish loading; None if it could not be loaded."""
+    try:
+        return await XRAY_DETECTOR.wait()
+    except RuntimeError:
+        return None
 
 # Pydantic models for request/response
 class ResearchQuery(BaseModel):
@@ -87,14 +183,27 @@ class DiseasePrediction(BaseModel):
     disease: str
     confidence: float
 
+class HeatmapGrid(BaseModel):
+    shape: List[int]
+    dtype: str
+    data: str  # Base64-encoded little-endian array bytes
+
 class RadiologyAnalysisResponse(BaseModel):
     predicted_diseases: List[DiseasePrediction]
     top_5_diseases: List[DiseasePrediction]
+    probabilities: Optional[Dict[str, float]] = None
     gradcam_analyses: Dict[str, str]
     attention_map: Optional[str] = None
     individual_analyses: Dict[str, str]
     concise_conclusion: str
     comprehensive_analysis: Optional[str] = None
+    heatmap_mode: str = "image"
+    gradcam_grids: Optional[Dict[str, HeatmapGrid]] = None
+    attention_grid: Optional[HeatmapGrid] = None
+    blend_parameters: Optional[Dict] = None
+    pipeline_report: Optional[Dict] = None
+    degradation_tier: str = "full"
+    skipped_stages: List[str] = []
 
 class TestSampleInfo(BaseModel):
     image_name: str
@@ -116,6 +225,37 @@ class XrayDetectionResponse(BaseModel):
     confidence_level: str
     model_available: bool
 
+class XrayBatchItem(BaseModel):
+    filename: str
+    is_xray: Optional[bool] = None
+    xray_probability: Optional[float] = None
+    confidence_level: Optional[str] = None
+    error: Optional[str] = None
+
+class XrayBatchDetectionResponse(BaseModel):
+    results: List[XrayBatchItem]
+    model_available: bool
+
+# X-ray detection settings
+XRAY_THRESHOLD = 0.5
+XRAY_GATE_ENABLED = os.getenv("XRAY_GATE_ENABLED", "false").lower() == "true"
+XRAY_GATE_THRESHOLD = float(os.getenv("XRAY_GATE_THRESHOLD", XRAY_THRESHOLD))
+XRAY_BATCH_SIZE = int(os.getenv("XRAY_BATCH_SIZE", 16))
+XRAY_BATCH_MAX_FILES = int(os.getenv("XRAY_BATCH_MAX_FILES", 256))
+
+# Longest side of the image sent to Gemini (0 keeps the upload's resolution)
+GEMINI_IMAGE_MAX_SIZE = int(os.getenv("GEMINI_IMAGE_MAX_SIZE", 2048))
+
+# Whole-response cache for /radiology/analyze (memory LRU plus optional SQLite file)
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE = ResponseCache(
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL", 3600)),
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", 64)),
+    max_bytes=int(float(os.getenv("RESPONSE_CACHE_MAX_MB", 256)) * 1024 * 1024),
+    disk_path=os.getenv("RESPONSE_CACHE_PATH") or None,
+    disk_max_bytes=int(float(os.getenv("RESPONSE_CACHE_DISK_MAX_MB", 1024)) * 1024 * 1024)
+) if RESPONSE_CACHE_ENABLED else None
+
 # Helper functions
 def format_output_as_html(source_name: str, answer: str, sources: list) -> str:
     """Creates an HTML string with a custom-styled box for the output."""
@@ -149,31 +289,87 @@ def image_to_base64(image_path: str) -> str:
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode('utf-8')
 
-def xray_probability(image: Image.Image) -> float:
+def encode_heatmap_grid(grid) -> HeatmapGrid:
+    """Encode a low-resolution heatmap grid as base64 float16 for low-bandwidth clients."""
+    array = np.asarray(grid, dtype="<f2")
+    return HeatmapGrid(
+        shape=list(array.shape),
+        dtype="float16",
+        data=base64.b64encode(array.tobytes()).decode('utf-8')
+    )
+
+def is_complete_analysis(response: RadiologyAnalysisResponse) -> bool:
+    """False if stages were skipped or any Gemini stage returned an error message instead of an analysis (not cached)."""
+    if response.skipped_stages:
+        return False
+    texts = [response.concise_conclusion, response.comprehensive_analysis or "", *response.individual_analyses.values()]
+    return not any(text.startswith("Error getting") for text in texts)
+
+def rethreshold_analysis(body: bytes, confidence_threshold: float) -> bytes:
+    """
+    Recompute predicted_diseases of an encoded analysis for another confidence threshold.
+    
+    Every other field depends only on the top-5 classes, so one cached analysis per
+    image serves any threshold.
+    """
+    analysis = json.loads(body)
+    probabilities = analysis.get("probabilities")
+    if probabilities is None:
+        return body
+    analysis["predicted_diseases"] = sorted(
+        (
+            {"disease": disease, "confidence": confidence}
+            for disease, confidence in probabilities.items()
+            if confidence >= confidence_threshold
+        ),
+        key=lambda d: d["confidence"],
+        reverse=True
+    )
+    return json.dumps(analysis).encode()
+
+def cache_headers(cache_status: str, cacheable: bool = True) -> Dict[str, str]:
+    """Response headers for a /radiology/analyze result served with the given cache status."""
+    if cacheable and cache_status in ("HIT", "MISS", "BYPASS"):
+        # Patient data: clients may reuse the response, shared caches must not store it
+        cache_control = f"private, max-age={int(RESPONSE_CACHE.ttl_seconds)}"
+    else:
+        cache_control = "no-store"
+    return {"X-Cache": cache_status, "Cache-Control": cache_control}
+
+def xray_probability(image: Union[Image.Image, DecodedImage]) -> float:
     """Calculate the probability that an image is an X-ray using BiomedCLIP."""
-    if not BIOMEDCLIP_AVAILABLE:
+    try:
+        xray_detector = XRAY_DETECTOR.get()
+    except RuntimeError:
         raise HTTPException(status_code=503, detail="BiomedCLIP model not available")
     
-    # Preprocess the image
-    img = xray_preprocess(image.convert("RGB")).unsqueeze(0)
-    
-    # Define positive and negative labels
-    labels_pos = ["a chest X-ray radiograph", "a bone X-ray radiograph", "a dental X-ray radiograph"]
-    labels_neg = [
-        "a CT scan", "an MRI scan", "an ultrasound image",
-        "a natural photograph", "a document scan", "a drawing or illustration"
-    ]
-    labels = labels_pos + labels_neg
-    
-    with torch.no_grad():
-        image_features, text_features, logit_scale = xray_model(
-            img, xray_tokenizer(labels, context_length=256)
-        )
-        probs = (logit_scale * image_features @ text_features.T).softmax(dim=-1)[0]
-    
-    # Calculate X-ray probability as sum of positive label probabilities
-    p_xray = probs[:len(labels_pos)].sum().item()
-    return p_xray
+    # Only the vision tower runs per call; the label embeddings are cached on the detector
+    return xray_detector.xray_probability(image)
+
+
+def xray_confidence_level(probability: float) -> str:
+    """Map an X-ray probability to the confidence level reported by the detection endpoints."""
+    if probability >= 0.8:
+        return "high"
+    elif probability >= 0.6:
+        return "medium"
+    elif probability >= 0.4:
+        return "low"
+    return "very_low"
+
+def prepare_xray_input(image_bytes: bytes):
+    """Decode an upload and build its BiomedCLIP input, returning (input, error) for batch use."""
+    try:
+        return XRAY_DETECTOR.get().image_input(ingest_image(image_bytes)), None
+    except Exception as e:
+        return None, f"Could not decode image: {str(e)}"
+
+def decode_xray_upload(image_bytes: bytes):
+    """Decode an upload for the inference service, returning (decoded image, error) for batch use."""
+    try:
+        return ingest_image(image_bytes), None
+    except Exception as e:
+        return None, f"Could not decode image: {str(e)}"
 
 
 # API Endpoints
@@ -188,9 +384,12 @@ async def root():
             "research": "/research/query",
             "radiology": "/radiology/analyze",
             "xray_detection": "/xray/detect",
+            "xray_detection_batch": "/xray/detect-batch",
             "test": "/test/analyze",
             "upload_docs": "/research/upload-documents",
-            "health": "/health"
+            "health": "/health",
+            "runtime_diagnostics": "/diagnostics/runtime",
+            "metrics": "/metrics"
         }
     }
 
@@ -200,7 +399,41 @@ async def health_check():
     return {
         "status": "healthy", 
         "gemini_available": gemini_client is not None,
-        "biomedclip_available": BIOMEDCLIP_AVAILABLE
+        "biomedclip_available": XRAY_DETECTOR.available,
+        "resources": resource_status(),
+        "inference_service": INFERENCE_SERVICE.describe()
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: per-stage and per-request latency histograms."""
+    if not PROMETHEUS_AVAILABLE:
+        raise HTTPException(status_code=503, detail="prometheus_client is not installed")
+    body, content_type = await run_io(metrics_payload)
+    return Response(content=body, media_type=content_type)
+
+@app.get("/profiles/{request_id}/{artifact}")
+async def get_profile_artifact(request_id: str, artifact: str, request: Request):
+    """Artifact of a profiled request: trace.json (Chrome trace), operators.txt or speedscope.json."""
+    if not authorized(request.headers.get("x-profile")):
+        raise HTTPException(status_code=404, detail="Not Found")
+    path = artifact_path(request_id, artifact)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found (or still being written)")
+    return FileResponse(path, media_type=ARTIFACTS[artifact], filename=f"{request_id}-{artifact}")
+
+@app.get("/diagnostics/runtime")
+async def get_runtime_diagnostics():
+    """Thread pool sizes, CPU affinity, executors, bulkheads and response cache of this worker process."""
+    return {
+        **runtime_diagnostics(),
+        "executors": executor_status(),
+        "degradation": {
+            "queue_reduced": DEGRADE_QUEUE_REDUCED,
+            "queue_minimal": DEGRADE_QUEUE_MINIMAL,
+            "tiers": TIER_LATENCY.describe()
+        },
+        "response_cache": RESPONSE_CACHE.describe() if RESPONSE_CACHE is not None else None
     }
 
 @app.post("/xray/detect", response_model=XrayDetectionResponse)
@@ -211,8 +444,8 @@ async def detect_xray_image(image: UploadFile = File(...)):
         if not image.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Check if BiomedCLIP model is available
-        if not BIOMEDCLIP_AVAILABLE:
+        # Check if BiomedCLIP model is available (waits while it is still loading)
+        if not INFERENCE_SERVICE.enabled and await get_xray_detector() is None:
             return XrayDetectionResponse(
                 is_xray=False,
                 xray_probability=0.0,
@@ -220,36 +453,101 @@ async def detect_xray_image(image: UploadFile = File(...)):
                 model_available=False
             )
         
-        # Convert uploaded image to PIL
         image_bytes = await image.read()
-        image_pil = Image.open(BytesIO(image_bytes))
-        
-        # Calculate X-ray probability
-        probability = xray_probability(image_pil)
+        async with XRAY_BULKHEAD:
+            # Decode the upload once (shared with /radiology/analyze for the same bytes)
+            decoded_image = await run_cpu(ingest_image, image_bytes)
+            
+            # Calculate X-ray probability
+            if INFERENCE_SERVICE.enabled:
+                try:
+                    probability = await INFERENCE_SERVICE.xray_probability(decoded_image)
+                except ResourceUnavailable:
+                    # BiomedCLIP failed to load in the inference service
+                    return XrayDetectionResponse(
+                        is_xray=False,
+                        xray_probability=0.0,
+                        confidence_level="unavailable",
+                        model_available=False
+                    )
+            else:
+                probability = await run_cpu(xray_probability, decoded_image)
         
         # Determine if it's an X-ray (threshold = 0.5)
-        is_xray = probability >= 0.5
-        
-        # Determine confidence level
-        if probability >= 0.8:
-            confidence_level = "high"
-        elif probability >= 0.6:
-            confidence_level = "medium"
-        elif probability >= 0.4:
-            confidence_level = "low"
-        else:
-            confidence_level = "very_low"
+        is_xray = probability >= XRAY_THRESHOLD
         
         return XrayDetectionResponse(
             is_xray=is_xray,
             xray_probability=round(probability, 4),
-            confidence_level=confidence_level,
+            confidence_level=xray_confidence_level(probability),
             model_available=True
         )
     
+    except (HTTPException, BulkheadRejected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during X-ray detection: {str(e)}")
 
+@app.post("/xray/detect-batch", response_model=XrayBatchDetectionResponse)
+async def detect_xray_batch(images: List[UploadFile] = File(...)):
+    """Detect X-ray images in a batch of uploads with batched BiomedCLIP inference."""
+    try:
+        if len(images) > XRAY_BATCH_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"At most {XRAY_BATCH_MAX_FILES} images per request")
+        
+        xray_detector = None if INFERENCE_SERVICE.enabled else await get_xray_detector()
+        if xray_detector is None and not INFERENCE_SERVICE.enabled:
+            return XrayBatchDetectionResponse(
+                results=[XrayBatchItem(filename=upload.filename, confidence_level="unavailable") for upload in images],
+                model_available=False
+            )
+        
+        results = [XrayBatchItem(filename=upload.filename) for upload in images]
+        pending = []
+        for result, upload in zip(results, images):
+            if not upload.content_type or not upload.content_type.startswith("image/"):
+                result.error = "File must be an image"
+            else:
+                pending.append((result, await upload.read()))
+        
+        async with XRAY_BULKHEAD:
+            # Decode and preprocess in parallel, then run the vision tower in batches
+            prepare = decode_xray_upload if INFERENCE_SERVICE.enabled else prepare_xray_input
+            prepared = await asyncio.gather(*(
+                run_in_executor(INGEST_POOL, prepare, image_bytes) for _, image_bytes in pending
+            ))
+            batch_inputs = []
+            batch_results = []
+            for (result, _), (image_input, error) in zip(pending, prepared):
+                if error:
+                    result.error = error
+                else:
+                    batch_inputs.append(image_input)
+                    batch_results.append(result)
+            
+            if INFERENCE_SERVICE.enabled:
+                try:
+                    probabilities = await asyncio.gather(*(
+                        INFERENCE_SERVICE.xray_probability(decoded_image) for decoded_image in batch_inputs
+                    ))
+                except ResourceUnavailable:
+                    for result in batch_results:
+                        result.confidence_level = "unavailable"
+                    return XrayBatchDetectionResponse(results=results, model_available=False)
+            else:
+                probabilities = await run_cpu(xray_detector.batch_xray_probabilities, batch_inputs, batch_size=XRAY_BATCH_SIZE)
+        for result, probability in zip(batch_results, probabilities):
+            result.is_xray = probability >= XRAY_THRESHOLD
+            result.xray_probability = round(probability, 4)
+            result.confidence_level = xray_confidence_level(probability)
+        
+        return XrayBatchDetectionResponse(results=results, model_available=True)
+    
+    except (HTTPException, BulkheadRejected):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error during batch X-ray detection: {str(e)}")
+
 
 # Research & Q&A Endpoints
 
@@ -263,12 +561,15 @@ async def upload_research_documents(files: List[UploadFile] = File(...)):
                 raise HTTPException(status_code=400, detail=f"File {uploaded_file.filename} is not a PDF")
             
             bytes_data = await uploaded_file.read()
-            chunks = parse_pdf(bytes_data, uploaded_file.filename)
+            async with DOCUMENTS_BULKHEAD:
+                chunks = await run_cpu(parse_pdf, bytes_data, uploaded_file.filename)
             if chunks:
                 all_chunks.extend(chunks)
         
         if all_chunks:
-            research_vector_store.add_documents(all_chunks)
+            await EMBEDDER.wait()
+            async with DOCUMENTS_BULKHEAD:
+                await run_cpu(research_vector_store.add_documents, all_chunks)
             return {
                 "message": f"Successfully processed and indexed {len(files)} PDF(s)",
                 "chunks_added": len(all_chunks)
@@ -276,6 +577,8 @@ async def upload_research_documents(files: List[UploadFile] = File(...)):
         else:
             raise HTTPException(status_code=400, detail="Could not extract text from the uploaded PDF(s)")
     
+    except (HTTPException, BulkheadRejected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing documents: {str(e)}")
 
@@ -295,7 +598,7 @@ async def research_query(query_request: ResearchQuery):
             )
             if web_context:
                 web_synthesis_prompt = f"Based ONLY on Web Search context, answer: {query_request.query}"
-                response.web_answer = gemini_client.generate_text(web_synthesis_prompt)
+                response.web_answer = await run_io(gemini_client.generate_text, web_synthesis_prompt)
                 response.web_sources = web_sources
         
         if query_request.use_pubmed:
@@ -307,10 +610,12 @@ async def research_query(query_request: ResearchQuery):
             )
             if pubmed_context:
                 pubmed_synthesis_prompt = f"Based ONLY on PubMed context, answer: {query_request.query}"
-                response.pubmed_answer = gemini_client.generate_text(pubmed_synthesis_prompt)
+                response.pubmed_answer = await run_io(gemini_client.generate_text, pubmed_synthesis_prompt)
                 response.pubmed_sources = pubmed_sources
         
         if query_request.use_uploaded_docs:
+            if research_vector_store.index.ntotal > 0:
+                await EMBEDDER.wait()
             doc_context, doc_sources = await perform_rag(
                 query_request.query, 
                 research_vector_store, 
@@ -319,7 +624,7 @@ async def research_query(query_request: ResearchQuery):
             )
             if doc_context and "No relevant information" not in doc_context:
                 doc_synthesis_prompt = f"Based ONLY on uploaded document context, answer: {query_request.query}"
-                response.doc_answer = gemini_client.generate_text(doc_synthesis_prompt)
+                response.doc_answer = await run_io(gemini_client.generate_text, doc_synthesis_prompt)
                 response.doc_sources = doc_sources
         
         return response
@@ -340,12 +645,15 @@ async def upload_radiology_context_documents(files: List[UploadFile] = File(...)
                 raise HTTPException(status_code=400, detail=f"File {uploaded_file.filename} is not a PDF")
             
             bytes_data = await uploaded_file.read()
-            chunks = parse_pdf(bytes_data, uploaded_file.filename)
+            async with DOCUMENTS_BULKHEAD:
+                chunks = await run_cpu(parse_pdf, bytes_data, uploaded_file.filename)
             if chunks:
                 all_chunks.extend(chunks)
         
         if all_chunks:
-            radiology_vector_store.add_documents(all_chunks)
+            await EMBEDDER.wait()
+            async with DOCUMENTS_BULKHEAD:
+                await run_cpu(radiology_vector_store.add_documents, all_chunks)
             return {
                 "message": f"Successfully processed and indexed {len(files)} PDF(s) for radiology context",
                 "chunks_added": len(all_chunks)
@@ -353,140 +661,360 @@ async def upload_radiology_context_documents(files: List[UploadFile] = File(...)
         else:
             raise HTTPException(status_code=400, detail="Could not extract text from the uploaded PDF(s)")
     
+    except (HTTPException, BulkheadRejected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing radiology context documents: {str(e)}")
 
 
+async def run_radiology_analysis(
+    image_bytes: bytes,
+    confidence_threshold: float,
+    model_path: Optional[str],
+    heatmap_mode: str,
+    gate_threshold: Optional[float],
+    deadline: Optional[float] = None,
+    gate_required: bool = False
+) -> RadiologyAnalysisResponse:
+    """
+    Run the radiology analysis graph on an upload (gate_threshold=None disables the X-ray gate).
+    
+    When BiomedCLIP cannot score the image, a gate_required (explicitly requested) gate
+    fails the request with 503; otherwise the gate is skipped and reported in skipped_stages.
+    
+    The degradation tier is chosen from the admission queue depth and the time left until
+    deadline (a time.perf_counter() value); optional stages still running at the deadline
+    are cut off and reported in skipped_stages.
+    """
+    render_heatmaps = heatmap_mode == "image"
+    started_at = time.perf_counter()
+    
+    # Decode the upload once at reduced resolution; the classifier, GradCAM and BiomedCLIP
+    # inputs are all derived from it
+    decoded_image = await run_cpu(ingest_image, image_bytes)
+    
+    # Optional X-ray gate on the already-decoded image
+    gate_skipped = False
+    if gate_threshold is not None:
+        probability = None
+        gate_error = None
+        if INFERENCE_SERVICE.enabled:
+            try:
+                probability = await INFERENCE_SERVICE.xray_probability(decoded_image)
+            except (ConnectionError, RuntimeError) as e:
+                gate_error = str(e)
+        else:
+            xray_detector = await get_xray_detector()
+            if xray_detector is None:
+                gate_error = "BiomedCLIP model not available"
+            else:
+                probability = await run_cpu(xray_detector.xray_probability, decoded_image)
+        if gate_error is not None:
+            if gate_required:
+                raise HTTPException(status_code=503, detail={
+                    "error": "xray_gate_unavailable",
+                    "message": f"The requested X-ray gate could not run: {gate_error}"
+                })
+            logger.warning("X-ray gate skipped: %s", gate_error)
+            gate_skipped = True
+        elif probability < gate_threshold:
+            raise HTTPException(status_code=422, detail={
+                "error": "not_an_xray",
+                "message": "The uploaded image does not appear to be an X-ray radiograph",
+                "xray_probability": round(probability, 4),
+                "confidence_level": xray_confidence_level(probability),
+                "threshold": gate_threshold
+            })
+    
+    await wait_for_classifier(model_path)
+    render_pool = RENDER_POOL if render_heatmaps else None
+    
+    # Under load or a tight deadline, cheaper tiers leave out optional stages
+    remaining_ms = (deadline - time.perf_counter()) * 1000 if deadline is not None else None
+    tier, _ = select_tier(RADIOLOGY_ADMISSION.waiting, remaining_ms)
+    plan = TIER_PLANS[tier]
+    gradcam_top_n = plan["gradcam_top_n"]
+    
+    # Gemini reads the upload itself, not the reduced model input (only opened when the
+    # tier runs a Gemini stage)
+    image_pil = None
+    if plan["disease_analyses"] or plan["concise_conclusion"] or plan["comprehensive_conclusion"]:
+        image_pil = await run_cpu(open_image, image_bytes, GEMINI_IMAGE_MAX_SIZE)
+    
+    # The analysis runs as a graph of stages, each starting as soon as its inputs exist:
+    # PubMed lookups need only the top-5 labels (so they overlap GradCAM), the five
+    # per-disease analyses run concurrently, and so do the two conclusions
+    pipeline = Pipeline("radiology_analyze", deadline=deadline)
+    
+    def optional_stage(name, enabled, fn, deps=()):
+        if enabled:
+            return pipeline.stage(name, fn, deps=deps, optional=True)
+        return pipeline.skip(name)
+    
+    async def classify():
+        if INFERENCE_SERVICE.enabled:
+            # The inference service returns predictions and heatmaps together
+            return await INFERENCE_SERVICE.diagnose(
+                decoded_image,
+                model_path=model_path,
+                threshold=confidence_threshold,
+                render_pool=render_pool,
+                gradcam_top_n=gradcam_top_n
+            )
+        async with ANALYSIS_BULKHEAD:
+            return {'diagnosis': await run_cpu(
+                classify_image, decoded_image, model_path=model_path, threshold=confidence_threshold
+            )}
+    
+    async def heatmaps(classification):
+        if 'gradcam_top5' in classification:
+            return classification
+        # GradCAM and attention maps off the event loop; figures render on the pool
+        # while the PubMed and Gemini stages proceed
+        async with ANALYSIS_BULKHEAD:
+            return await run_cpu(
+                diagnose_and_visualize,
+                decoded_image,
+                model_path=model_path,
+                threshold=confidence_threshold,
+                render_pool=render_pool,
+                prediction_results=classification['diagnosis'],
+                gradcam_top_n=gradcam_top_n
+            )
+    
+    pipeline.stage("classify", classify)
+    pipeline.stage("heatmaps", heatmaps, deps=["classify"])
+    
+    analysis_stages = []
+    for rank in range(1, 6):
+        async def pubmed(classification, rank=rank):
+            top_5 = classification['diagnosis']['top_5_diseases']
+            if rank > len(top_5):
+                return None, None
+            return await get_pubmed_for_disease(top_5[rank - 1]['disease'], perform_rag, radiology_vector_store)
+        
+        async def disease_analysis(diagnosis_results, pubmed_results, rank=rank):
+            top_5 = diagnosis_results['diagnosis']['top_5_diseases']
+            disease_key = f"top{rank}_{top_5[rank - 1]['disease']}" if rank <= len(top_5) else None
+            disease_info = diagnosis_results['gradcam_top5'].get(disease_key)
+            if disease_info is None:
+                return None
+            pubmed_context, pubmed_sources = pubmed_results or (None, None)
+            individual_analysis = await run_io(
+                analyze_individual_disease_with_pubmed,
+                gemini_client,
+                disease_info['disease'],
+                disease_info['confidence'],
+                np.array(disease_info['overlay']),
+                image_pil,
+                pubmed_context,
+                pubmed_sources
+            )
+            return disease_key, individual_analysis
+        
+        optional_stage(f"pubmed_top{rank}", plan["pubmed"], pubmed, deps=["classify"])
+        analysis_stages.append(optional_stage(
+            f"disease_analysis_top{rank}",
+            plan["disease_analyses"] and rank <= gradcam_top_n,
+            disease_analysis,
+            deps=["heatmaps", f"pubmed_top{rank}"]
+        ))
+    
+    async def document_context(classification):
+        # Context from uploaded PDFs, if any
+        if radiology_vector_store.index.ntotal == 0:
+            return ""
+        top_5 = classification['diagnosis']['top_5_diseases']
+        context_query = f"Clinical context for chest X-ray showing: {', '.join([d['disease'] for d in top_5])}"
+        context, sources = await perform_rag(
+            context_query, 
+            radiology_vector_store, 
+            use_web=False, use_pubmed=False
+        )
+        if context and "No relevant information" not in context:
+            return f"\n\n**Additional Context from Uploaded Documents:**\n{context}"
+        return ""
+    
+    def conclusion_stage(conclusion_fn):
+        async def conclusion(classification, *analyses):
+            individual_analyses = dict(analysis for analysis in analyses if analysis is not None)
+            return await run_io(
+                conclusion_fn,
+                gemini_client,
+                [{'disease': d['disease'], 'confidence': d['confidence']} for d in classification['diagnosis']['top_5_diseases']],
+                individual_analyses,
+                image_pil
+            )
+        return conclusion
+    
+    async def figures(diagnosis_results):
+        # Join the rendered figures (PNG bytes by top-5 key and 'attention')
+        return {
+            key: await asyncio.wrap_future(render)
+            for key, render in diagnosis_results.get('renders', {}).items()
+        }
+    
+    optional_stage("document_context", plan["document_context"], document_context, deps=["classify"])
+    optional_stage(
+        "concise_conclusion", plan["concise_conclusion"],
+        conclusion_stage(get_concise_conclusion_from_gemini), deps=["classify", *analysis_stages]
+    )
+    optional_stage(
+        "comprehensive_conclusion", plan["comprehensive_conclusion"],
+        conclusion_stage(get_comprehensive_conclusion_from_gemini), deps=["classify", *analysis_stages]
+    )
+    if render_heatmaps:
+        pipeline.stage("figures", figures, deps=["heatmaps"])
+    
+    results = await pipeline.run()
+    diagnosis_results = results["heatmaps"]
+    
+    # Extract results
+    predicted_diseases = [
+        DiseasePrediction(disease=d['disease'], confidence=d['confidence'])
+        for d in diagnosis_results['diagnosis']['predicted_diseases']
+    ]
+    
+    top_5_diseases = [
+        DiseasePrediction(disease=d['disease'], confidence=d['confidence'])
+        for d in diagnosis_results['diagnosis']['top_5_diseases']
+    ]
+    
+    individual_analyses = dict(results[name] for name in analysis_stages if results[name] is not None)
+    concise_conclusion = results["concise_conclusion"] or ""
+    comprehensive_analysis = None
+    if results["comprehensive_conclusion"] is not None:
+        comprehensive_analysis = results["comprehensive_conclusion"] + (results["document_context"] or "")
+    
+    gradcam_analyses = {}
+    gradcam_grids = {}
+    attention_map = None
+    attention_grid = None
+    if render_heatmaps:
+        for disease_key, png_bytes in results["figures"].items():
+            if disease_key == 'attention':
+                attention_map = base64.b64encode(png_bytes).decode('utf-8')
+            else:
+                gradcam_analyses[disease_key] = base64.b64encode(png_bytes).decode('utf-8')
+    else:
+        for disease_key, disease_info in diagnosis_results['gradcam_top5'].items():
+            gradcam_grids[disease_key] = encode_heatmap_grid(disease_info['cam_grid'])
+        if diagnosis_results['attention'].get('attention_map') is not None:
+            attention_grid = encode_heatmap_grid(diagnosis_results['attention']['attention_map'])
+    
+    pipeline_report = pipeline.report()
+    latency = time.perf_counter() - started_at
+    TIER_LATENCY.observe(tier, latency * 1000, cut_off=pipeline.cut_off)
+    
+    return RadiologyAnalysisResponse(
+        predicted_diseases=predicted_diseases,
+        top_5_diseases=top_5_diseases,
+        probabilities=dict(zip(disease_labels, diagnosis_results['diagnosis']['raw_probabilities'])),
+        gradcam_analyses=gradcam_analyses,
+        attention_map=attention_map,
+        individual_analyses=individual_analyses,
+        concise_conclusion=concise_conclusion,
+        comprehensive_analysis=comprehensive_analysis,
+        heatmap_mode=heatmap_mode,
+        gradcam_grids=gradcam_grids if not render_heatmaps else None,
+        attention_grid=attention_grid,
+        blend_parameters=HEATMAP_BLEND_PARAMETERS if not render_heatmaps else None,
+        pipeline_report=pipeline_report,
+        degradation_tier=tier,
+        skipped_stages=(["xray_gate"] if gate_skipped else []) + pipeline.skipped
+    )
+
+
 @app.post("/radiology/analyze", response_model=RadiologyAnalysisResponse)
 async def analyze_radiology_image(
+    request: Request,
     image: UploadFile = File(...),
     confidence_threshold: float = Form(0.4),
-    model_path: Optional[str] = Form(None)
+    model_path: Optional[str] = Form(None),
+    heatmap_mode: str = Form("image"),
+    xray_gate: Optional[bool] = Form(None),
+    xray_gate_threshold: Optional[float] = Form(None),
+    use_cache: bool = Form(True),
+    deadline_ms: Optional[int] = Form(None)
 ):
-    """Perform complete AI analysis on radiology image."""
+    """Perform complete AI analysis on radiology image.
+    
+    heatmap_mode="image" returns rendered GradCAM and attention PNGs; heatmap_mode="raw"
+    skips server-side rendering and returns the low-resolution grids as float16 arrays
+    together with the parameters needed to blend them client-side.
+    
+    With xray_gate enabled (default from XRAY_GATE_ENABLED), uploads whose BiomedCLIP
+    X-ray probability is below xray_gate_threshold are rejected with 422 before the
+    classifier, GradCAM, PubMed and Gemini stages run. If BiomedCLIP is unavailable, an
+    explicit xray_gate=true is answered with 503 and the XRAY_GATE_ENABLED default
+    skips the gate (reported as "xray_gate" in skipped_stages).
+    
+    With deadline_ms, or when requests queue up for admission, the analysis runs in a
+    cheaper degradation tier (fewer GradCAM overlays, no PubMed, fewer Gemini calls);
+    degradation_tier and skipped_stages in the response report what was left out.
+    
+    When RADIOLOGY_ADMISSION is saturated the request is rejected with 429 (queue
+    full) or 503 (queue wait exceeded) and a Retry-After header.
+    
+    Complete responses are cached by image SHA-256, model and prompt version; a cached
+    analysis is re-thresholded for the requested confidence_threshold. Requests with
+    deadline_ms never share an in-flight computation. use_cache=false or a
+    "Cache-Control: no-cache" request header recomputes (and refreshes) the entry.
+    X-Cache reports HIT, MISS, SHARED, BYPASS or DISABLED.
+    """
+    received_at = time.perf_counter()
     try:
         # Validate image file
         if not image.content_type.startswith("image/"):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Create temporary directory for outputs
-        temp_dir = tempfile.mkdtemp()
+        if heatmap_mode not in ("image", "raw"):
+            raise HTTPException(status_code=400, detail="heatmap_mode must be 'image' or 'raw'")
+        check_model_path(model_path)
         
-        try:
-            # Convert uploaded image to PIL
-            image_bytes = await image.read()
-            image_pil = Image.open(BytesIO(image_bytes))
-            
-            # Run complete diagnosis pipeline
-            diagnosis_results = diagnose_and_visualize(
-                image_pil,
-                model_path=model_path,
-                output_dir=temp_dir,
-                threshold=confidence_threshold
-            )
-            
-            # Extract results
-            predicted_diseases = [
-                DiseasePrediction(disease=d['disease'], confidence=d['confidence'])
-                for d in diagnosis_results['diagnosis']['predicted_diseases']
-            ]
-            
-            top_5_diseases = [
-                DiseasePrediction(disease=d['disease'], confidence=d['confidence'])
-                for d in diagnosis_results['diagnosis']['top_5_diseases']
-            ]
-            
-            # Process GradCAM analyses
-            gradcam_analyses = {}
-            individual_analyses = {}
-            gradcam_top5_results = diagnosis_results['gradcam_top5']
-            
-            for i in range(5):
-                disease_key = f"top{i+1}_{top_5_diseases[i].disease}"
-                if disease_key in gradcam_top5_results:
-                    disease_info = gradcam_top5_results[disease_key]
-                    
-                    # Convert GradCAM image to base64
-                    gradcam_path = f"{temp_dir}/top{i+1}_{disease_info['disease']}_gradcam.png"
-                    if os.path.exists(gradcam_path):
-                        gradcam_analyses[disease_key] = image_to_base64(gradcam_path)
-                    
-                    # Get individual analysis with PubMed
-                    from utils.model_inference import get_pubmed_for_disease, analyze_individual_disease_with_pubmed
-                    
-                    pubmed_context, pubmed_sources = await get_pubmed_for_disease(
-                        disease_info['disease'],
-                        perform_rag,
-                        radiology_vector_store
-                    )
-                    
-                    individual_analysis = analyze_individual_disease_with_pubmed(
-                        gemini_client,
-                        disease_info['disease'],
-                        disease_info['confidence'],
-                        np.array(disease_info['overlay']),
-                        image_pil,
-                        pubmed_context,
-                        pubmed_sources
-                    )
-                    individual_analyses[disease_key] = individual_analysis
-            
-            # Convert attention map to base64
-            attention_map = None
-            attention_path = f"{temp_dir}/attention_analysis.png"
-            if os.path.exists(attention_path):
-                attention_map = image_to_base64(attention_path)
-            
-            # Get context from uploaded PDFs if available
-            context_info = ""
-            if radiology_vector_store.index.ntotal > 0:
-                context_query = f"Clinical context for chest X-ray showing: {', '.join([d.disease for d in top_5_diseases])}"
-                context, sources = await perform_rag(
-                    context_query, 
-                    radiology_vector_store, 
-                    use_web=False, use_pubmed=False
+        # Identical re-posts (e.g. a report re-opened in the node backend) are served
+        # from the response cache; concurrent identical requests share one computation
+        gate_enabled = XRAY_GATE_ENABLED if xray_gate is None else xray_gate
+        gate_threshold = (XRAY_GATE_THRESHOLD if xray_gate_threshold is None else xray_gate_threshold) if gate_enabled else None
+        image_bytes = await image.read()
+        deadline = received_at + deadline_ms / 1000 if deadline_ms is not None else None
+        cacheable = True
+        
+        async def compute():
+            nonlocal cacheable
+            # Cache hits and requests joining an in-flight analysis are not admission-controlled
+            async with RADIOLOGY_ADMISSION:
+                response = await run_radiology_analysis(
+                    image_bytes, confidence_threshold, model_path, heatmap_mode, gate_threshold, deadline,
+                    gate_required=xray_gate is True
                 )
-                if context and "No relevant information" not in context:
-                    context_info = f"\n\n**Additional Context from Uploaded Documents:**\n{context}"
-            
-            # Generate concise conclusion
-            from utils.model_inference import get_concise_conclusion_from_gemini
-            concise_conclusion = get_concise_conclusion_from_gemini(
-                gemini_client,
-                [{'disease': d.disease, 'confidence': d.confidence} for d in top_5_diseases],
-                individual_analyses,
-                image_pil
-            )
-            
-            # Generate comprehensive analysis
-            from utils.model_inference import get_comprehensive_conclusion_from_gemini
-            comprehensive_analysis = get_comprehensive_conclusion_from_gemini(
-                gemini_client,
-                [{'disease': d.disease, 'confidence': d.confidence} for d in top_5_diseases],
-                individual_analyses,
-                image_pil
-            )
-            
-            if context_info:
-                comprehensive_analysis += context_info
-            
-            return RadiologyAnalysisResponse(
-                predicted_diseases=predicted_diseases,
-                top_5_diseases=top_5_diseases,
-                gradcam_analyses=gradcam_analyses,
-                attention_map=attention_map,
-                individual_analyses=individual_analyses,
-                concise_conclusion=concise_conclusion,
-                comprehensive_analysis=comprehensive_analysis
+            cacheable = is_complete_analysis(response)
+            with stage_timer("encode"):
+                return json.dumps(jsonable_encoder(response)).encode(), cacheable
+        
+        if RESPONSE_CACHE is None:
+            body, cache_status = (await compute())[0], "DISABLED"
+        else:
+            key = cache_key(
+                image_sha256=hashlib.sha256(image_bytes).hexdigest(),
+                model_version=model_version(model_path),
+                prompt_version=PROMPT_VERSION,
+                heatmap_mode=heatmap_mode,
+                xray_gate_threshold=gate_threshold
             )
+            bypass = not use_cache or "no-cache" in request.headers.get("cache-control", "").lower()
+            # A deadline request neither waits on an in-flight full analysis nor hands its
+            # possibly degraded result to requests without a deadline
+            body, cache_status = await RESPONSE_CACHE.get_or_compute(key, compute, bypass=bypass, share=deadline is None)
+            if cache_status in ("HIT", "SHARED"):
+                # The entry may have been computed for another confidence threshold
+                with stage_timer("encode"):
+                    body = await run_cpu(rethreshold_analysis, body, confidence_threshold)
         
-        finally:
-            # Clean up temporary directory
-            try:
-                shutil.rmtree(temp_dir)
-            except:
-                pass
+        return Response(content=body, media_type="application/json", headers=cache_headers(cache_status, cacheable))
     
+    except (HTTPException, BulkheadRejected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during radiology analysis: {str(e)}")
 
@@ -503,7 +1031,7 @@ async def get_test_samples():
             raise HTTPException(status_code=404, detail="NIH Chest X-ray 14 dataset not found")
         
         from utils.test_data_loader import load_test_samples
-        test_samples = load_test_samples(dataset_path, num_samples=10)
+        test_samples = await run_io(load_test_samples, dataset_path, num_samples=10)
         
         if not test_samples:
             raise HTTPException(status_code=404, detail="No test samples could be loaded")
@@ -531,6 +1059,7 @@ async def analyze_test_sample(
 ):
     """Analyze a test sample and compare with ground truth."""
     try:
+        check_model_path(model_path)
         dataset_path = "C:/chest-xray/nih_chestxray_14"
         
         if not os.path.exists(dataset_path):
@@ -538,7 +1067,7 @@ async def analyze_test_sample(
         
         from utils.test_data_loader import load_test_samples, compare_predictions_with_ground_truth
         
-        test_samples = load_test_samples(dataset_path, num_samples=10)
+        test_samples = await run_io(load_test_samples, dataset_path, num_samples=10)
         
         if not test_samples or sample_index >= len(test_samples):
             raise HTTPException(status_code=404, detail="Test sample not found")
@@ -550,15 +1079,28 @@ async def analyze_test_sample(
         
         try:
             from PIL import Image
-            test_image = Image.open(selected_sample['image_path'])
+            await wait_for_classifier(model_path)
             
-            # Run complete diagnosis pipeline
-            diagnosis_results = diagnose_and_visualize(
-                test_image,
-                model_path=model_path,
-                output_dir=temp_dir,
-                threshold=confidence_threshold
-            )
+            # Run complete diagnosis pipeline off the event loop
+            async with TEST_ANALYSIS_ADMISSION:
+                if INFERENCE_SERVICE.enabled:
+                    image_bytes = await run_io(Path(selected_sample['image_path']).read_bytes)
+                    diagnosis_results = await INFERENCE_SERVICE.diagnose(
+                        await run_cpu(ingest_image, image_bytes),
+                        model_path=model_path,
+                        output_dir=temp_dir,
+                        threshold=confidence_threshold
+                    )
+                else:
+                    test_image = Image.open(selected_sample['image_path'])
+                    async with ANALYSIS_BULKHEAD:
+                        diagnosis_results = await run_cpu(
+                            diagnose_and_visualize,
+                            test_image,
+                            model_path=model_path,
+                            output_dir=temp_dir,
+                            threshold=confidence_threshold
+                        )
             
             # Extract predictions
             predicted_diseases = [
@@ -606,6 +1148,8 @@ async def analyze_test_sample(
             except:
                 pass
     
+    except (HTTPException, BulkheadRejected):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during test analysis: {str(e)}")
 
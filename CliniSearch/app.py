@@ -10,7 +10,9 @@ import numpy as np
 # Import our utility modules
 from utils.api_clients import gemini_client
 from utils.rag_processing import VectorStore, perform_rag, parse_pdf, EMBEDDING_MODEL
-from utils.model_inference import diagnose_and_visualize, analyze_with_gemini, disease_labels
+from utils.model_inference import diagnose_and_visualize
+from utils.diagnosis import disease_labels
+from utils.gemini_analysis import analyze_with_gemini
 import tempfile
 import shutil
 
@@ -297,7 +299,7 @@ with tab2:
                                 with col2:
                                     with st.spinner(f"Getting PubMed evidence for {disease_info['disease']}..."):
                                         # Get PubMed information for this specific disease
-                                        from utils.model_inference import get_pubmed_for_disease, analyze_individual_disease_with_pubmed
+                                        from utils.gemini_analysis import get_pubmed_for_disease, analyze_individual_disease_with_pubmed
                                         
                                         pubmed_context, pubmed_sources = asyncio.run(get_pubmed_for_disease(
                                             disease_info['disease'],
@@ -356,7 +358,7 @@ with tab2:
                     # Concise Conclusion from Gemini
                     st.subheader("Quick Clinical Summary")
                     with st.spinner("Generating concise summary..."):
-                        from utils.model_inference import get_concise_conclusion_from_gemini
+                        from utils.gemini_analysis import get_concise_conclusion_from_gemini
                         concise_conclusion = get_concise_conclusion_from_gemini(
                             gemini_client,
                             top_5_diseases,
@@ -368,7 +370,7 @@ with tab2:
                     # Optional: Comprehensive Conclusion (in expander)
                     with st.expander("Detailed Comprehensive Analysis", expanded=False):
                         with st.spinner("Generating detailed analysis..."):
-                            from utils.model_inference import get_comprehensive_conclusion_from_gemini
+                            from utils.gemini_analysis import get_comprehensive_conclusion_from_gemini
                             comprehensive_conclusion = get_comprehensive_conclusion_from_gemini(
                                 gemini_client,
                                 top_5_diseases,
@@ -646,7 +648,7 @@ with tab3:
                                     # Get PubMed for the primary disease
                                     primary_disease = selected_sample['primary_disease']
                                     if primary_disease != "No Finding":
-                                        from utils.model_inference import get_pubmed_for_disease, analyze_individual_disease_with_pubmed
+                                        from utils.gemini_analysis import get_pubmed_for_disease, analyze_individual_disease_with_pubmed
                                         
                                         pubmed_context, pubmed_sources = asyncio.run(get_pubmed_for_disease(
                                             primary_disease,
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for CliniSearch hot paths, with a stable JSON format and a regression check.
+
+Covers preprocessing, classifier forward passes at several batch sizes, GradCAM (hooks
+and cached activations), heatmap overlays and figure rendering, MemoryBank.retrieve,
+chunk_text, parse_pdf, VectorStore.add_documents/search on 1k-100k chunks and the
+BiomedCLIP X-ray probability. All inputs are synthetic. Benchmarks whose models cannot
+be loaded (no network, no BiomedCLIP export) are recorded as skipped.
+
+Usage:
+    python -m benchmarks.hotpaths run --output baseline.json
+    python -m benchmarks.hotpaths run --output current.json --filter gradcam --quick
+    python -m benchmarks.hotpaths compare baseline.json current.json --threshold 0.15
+    python -m benchmarks.hotpaths list
+"""
+
+import argparse
+import datetime
+import functools
+import io
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.preprocess_benchmark import make_radiograph
+
+# Bump when the result format changes; compare refuses files of another schema
+SCHEMA = "clinisearch-benchmarks/1"
+
+
+class SkipBenchmark(Exception):
+    """Raised by a setup function when the benchmark cannot run here."""
+
+
+class Benchmark:
+    """
+    One benchmark case: setup() returns the zero-argument callable that is timed, or a
+    (callable, reset) pair where reset runs untimed after every call to restore the inputs.
+    """
+    def __init__(self, name, group, params, setup):
+        self.name = name
+        self.group = group
+        self.params = params
+        self.setup = setup
+
+
+BENCHMARKS = []
+
+
+def register(group, setup, **params):
+    """Add a case named group[key=value,...]; setup is called with the params."""
+    label = ",".join(f"{key}={value}" for key, value in params.items())
+    name = f"{group}[{label}]" if label else group
+    BENCHMARKS.append(Benchmark(name, group, params, functools.partial(setup, **params)))
+
+
+# --- Shared fixtures (built once per run) ---
+
+@functools.lru_cache(maxsize=None)
+def classifier():
+    from utils.model_inference import DEFAULT_MODEL_PATH, load_model
+    try:
+        return load_model(DEFAULT_MODEL_PATH, device="cpu")
+    except Exception as e:
+        # The backbone downloads ImageNet weights when no cached copy exists
+        raise SkipBenchmark(f"classifier unavailable: {e}")
+
+
+@functools.lru_cache(maxsize=None)
+def image_tensor():
+    from utils.model_inference import preprocess_image
+    return preprocess_image(make_radiograph(1024, "PNG"))
+
+
+@functools.lru_cache(maxsize=None)
+def embedding_model():
+    from utils.rag_processing import EMBEDDING_MODEL
+    try:
+        return EMBEDDING_MODEL.get()
+    except Exception as e:
+        raise SkipBenchmark(str(e))
+
+
+@functools.lru_cache(maxsize=None)
+def xray_detector():
+    from utils.xray_detection import load_xray_detector
+    try:
+        return load_xray_detector()
+    except Exception as e:
+        raise SkipBenchmark(f"BiomedCLIP unavailable: {e}")
+
+
+def synthetic_text(words, seed=0):
+    rng = np.random.default_rng(seed)
+    vocabulary = ["opacity", "lobe", "pleural", "effusion", "nodule", "consolidation", "cardiac",
+                  "silhouette", "bilateral", "infiltrate", "apex", "costophrenic", "angle", "mass"]
+    return " ".join(rng.choice(vocabulary, size=words))
+
+
+def synthetic_pdf(pages):
+    import fitz
+    document = fitz.open()
+    text = synthetic_text(400)
+    for _ in range(pages):
+        page = document.new_page()
+        page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=9)
+    return document.tobytes()
+
+
+def synthetic_store(chunks, seed=0):
+    """VectorStore holding `chunks` documents with random embeddings (only queries are embedded)."""
+    from utils.rag_processing import EMBEDDING_DIMENSION, VectorStore
+    store = VectorStore(EMBEDDING_DIMENSION)
+    embeddings = np.random.default_rng(seed).standard_normal((chunks, EMBEDDING_DIMENSION)).astype("float32")
+    store.index.add(embeddings)
+    store.documents = [{"source": "PDF: synthetic.pdf", "content": f"chunk {i}", "metadata": {}} for i in range(chunks)]
+    return store
+
+
+# --- Cases ---
+
+def setup_preprocess(format, size):
+    from utils.model_inference import preprocess_image
+    image_bytes = make_radiograph(size, format.upper())
+    return lambda: preprocess_image(image_bytes)
+
+
+def setup_predict(batch):
+    from utils.model_inference import predict_probabilities
+    model = classifier()
+    images = image_tensor().repeat(batch, 1, 1, 1)
+    return lambda: predict_probabilities(model, images, "cpu")
+
+
+def setup_generate_cam():
+    from utils.model_inference import GradCAMExtractor
+    gradcam = GradCAMExtractor(classifier())
+    tensor = image_tensor()
+    return lambda: gradcam.generate_cam(tensor, class_idx=0)
+
+
+def setup_cam_grids_from_features(classes):
+    import torch
+    from utils.model_inference import cam_grids_from_features
+    model = classifier()
+    with torch.no_grad():
+        features, momentum_pooled = model.forward_features(image_tensor())
+    return lambda: cam_grids_from_features(model, features, momentum_pooled, list(range(classes)), "cpu")
+
+
+def random_grid(seed=0):
+    return np.random.default_rng(seed).random((7, 7)).astype(np.float32)
+
+
+def setup_overlay():
+    from utils.diagnosis import overlay_heatmap, upsample_cam
+    from utils.model_inference import denormalize_image
+    img_np = denormalize_image(image_tensor())
+    grid = random_grid()
+    return lambda: overlay_heatmap(img_np, upsample_cam(grid))
+
+
+def setup_render_gradcam():
+    from utils.diagnosis import overlay_heatmap, render_gradcam_figure, upsample_cam
+    from utils.model_inference import denormalize_image
+    img_np = denormalize_image(image_tensor())
+    overlay = overlay_heatmap(img_np, upsample_cam(random_grid()))
+    return lambda: render_gradcam_figure(img_np, overlay, "Effusion GradCAM\n(Top 1 - Confidence: 0.812)")
+
+
+def setup_render_attention():
+    from utils.diagnosis import render_attention_figure
+    from utils.model_inference import denormalize_image
+    img_np = denormalize_image(image_tensor())
+    attention_map = random_grid()
+    return lambda: render_attention_figure(img_np, attention_map)
+
+
+def setup_memory_bank(batch, bank):
+    import torch
+    from utils.model_inference import MemoryBank
+    generator = torch.Generator().manual_seed(0)
+    memory_bank = MemoryBank(1280, bank_size=bank)
+    memory_bank.memory.copy_(torch.randn(bank, 1280, generator=generator))
+    query = torch.randn(batch, 1280, generator=generator)
+
+    def retrieve():
+        with torch.no_grad():
+            return memory_bank.retrieve(query)
+    return retrieve
+
+
+def setup_chunk_text(words):
+    from utils.rag_processing import chunk_text
+    text = synthetic_text(words)
+    return lambda: chunk_text(text)
+
+
+def setup_parse_pdf(pages):
+    from utils.rag_processing import parse_pdf
+    pdf_bytes = synthetic_pdf(pages)
+    return lambda: parse_pdf(pdf_bytes, "synthetic.pdf")
+
+
+def setup_vector_add(chunks, batch):
+    import faiss
+    embedding_model()
+    store = synthetic_store(chunks)
+    documents = [{"source": "PDF: added.pdf", "content": synthetic_text(300, seed=i), "metadata": {}} for i in range(batch)]
+
+    def reset():
+        # Every call adds to a store of exactly `chunks` documents
+        store.index.remove_ids(faiss.IDSelectorRange(chunks, store.index.ntotal))
+        del store.documents[chunks:]
+    return lambda: store.add_documents(documents), reset
+
+
+def setup_vector_search(chunks):
+    embedding_model()
+    store = synthetic_store(chunks)
+    return lambda: store.search("bilateral pleural effusion with cardiomegaly", k=5)
+
+
+def setup_index_search(chunks):
+    # FAISS alone, with a precomputed query embedding: runs without the sentence-transformer
+    store = synthetic_store(chunks)
+    query = np.random.default_rng(1).standard_normal((1, store.dimension)).astype("float32")
+    return lambda: store.index.search(query, 5)
+
+
+def setup_xray_probability():
+    from PIL import Image
+    detector = xray_detector()
+    image = Image.open(io.BytesIO(make_radiograph(512, "PNG")))
+    image.load()
+    return lambda: detector.xray_probability(image)
+
+
+for fmt in ("png", "jpeg"):
+    for size in (512, 2048):
+        register("preprocess_image", setup_preprocess, format=fmt, size=size)
+for batch in (1, 4, 16):
+    register("predict_probabilities", setup_predict, batch=batch)
+register("gradcam.generate_cam", setup_generate_cam)
+register("gradcam.cam_grids_from_features", setup_cam_grids_from_features, classes=5)
+register("render.overlay_heatmap", setup_overlay)
+register("render.gradcam_figure", setup_render_gradcam)
+register("render.attention_figure", setup_render_attention)
+register("memory_bank.retrieve", setup_memory_bank, batch=1, bank=512)
+register("memory_bank.retrieve", setup_memory_bank, batch=32, bank=4096)
+register("chunk_text", setup_chunk_text, words=10000)
+register("chunk_text", setup_chunk_text, words=100000)
+register("parse_pdf", setup_parse_pdf, pages=10)
+register("parse_pdf", setup_parse_pdf, pages=100)
+for chunks in (1000, 10000, 100000):
+    register("vector_store.add_documents", setup_vector_add, chunks=chunks, batch=32)
+    register("vector_store.search", setup_vector_search, chunks=chunks)
+    register("vector_store.index_search", setup_index_search, chunks=chunks)
+register("xray_probability", setup_xray_probability)
+
+
+# --- Runner ---
+
+def measure(fn, min_rounds, min_time, max_rounds=1000, reset=None):
+    """Per-call wall times in seconds: one warm-up call, then at least min_rounds and min_time of timed calls."""
+    fn()
+    if reset is not None:
+        reset()
+    timings = []
+    while len(timings) < max_rounds and (len(timings) < min_rounds or sum(timings) < min_time):
+        call_started_at = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - call_started_at)
+        if reset is not None:
+            reset()
+    return timings
+
+
+def summarize(timings):
+    return {
+        "rounds": len(timings),
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "stdev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "max": max(timings)
+    }
+
+
+def environment():
+    import torch
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "numpy": np.__version__,
+        "inference_precision": os.getenv("INFERENCE_PRECISION", "fp32"),
+        "inference_memory_format": os.getenv("INFERENCE_MEMORY_FORMAT", "contiguous")
+    }
+
+
+def run(args):
+    pattern = re.compile(args.filter) if args.filter else None
+    min_rounds, min_time = (3, 0.2) if args.quick else (args.rounds, args.min_time)
+    results = {}
+    for case in BENCHMARKS:
+        if pattern and not pattern.search(case.name):
+            continue
+        entry = {"group": case.group, "params": case.params, "unit": "seconds"}
+        try:
+            fn = case.setup()
+            fn, reset = fn if isinstance(fn, tuple) else (fn, None)
+            entry.update(summarize(measure(fn, min_rounds, min_time, reset=reset)))
+            print(f"{case.name:<60} median {entry['median'] * 1000:>10.3f} ms  ({entry['rounds']} rounds)")
+        except SkipBenchmark as e:
+            entry["skipped"] = str(e).splitlines()[0]
+            print(f"{case.name:<60} skipped: {entry['skipped']}")
+        results[case.name] = entry
+
+    report = {
+        "schema": SCHEMA,
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "benchmarks": results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nWrote {len(results)} results to {args.output}")
+
+
+def load_report(path):
+    with open(path) as f:
+        report = json.load(f)
+    if report.get("schema") != SCHEMA:
+        raise SystemExit(f"{path}: unsupported schema {report.get('schema')!r} (expected {SCHEMA})")
+    return report
+
+
+def compare(args):
+    """Compare medians; exit 1 if any benchmark is slower than the baseline by more than the threshold."""
+    baseline, current = load_report(args.baseline), load_report(args.current)
+    for key in ("cpu_count", "torch", "torch_threads", "inference_precision"):
+        if baseline["environment"].get(key) != current["environment"].get(key):
+            print(f"Warning: {key} differs (baseline {baseline['environment'].get(key)}, "
+                  f"current {current['environment'].get(key)}); timings may not be comparable")
+
+    regressions = []
+    print(f"\n{'benchmark':<60}{'baseline ms':>13}{'current ms':>13}{'ratio':>8}  status")
+    names = sorted(set(baseline["benchmarks"]) | set(current["benchmarks"]))
+    for name in names:
+        before, after = baseline["benchmarks"].get(name), current["benchmarks"].get(name)
+        if before is None or after is None:
+            print(f"{name:<60}{'':>34}  {'new' if before is None else 'missing'}")
+            continue
+        if "skipped" in before or "skipped" in after:
+            print(f"{name:<60}{'':>34}  skipped")
+            continue
+        ratio = after["median"] / before["median"] if before["median"] else float("inf")
+        delta_ms = (after["median"] - before["median"]) * 1000
+        if ratio > 1 + args.threshold and delta_ms > args.min_delta_ms:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - args.threshold and -delta_ms > args.min_delta_ms:
+            status = "improved"
+        else:
+            status = "ok"
+        print(f"{name:<60}{before['median'] * 1000:>13.3f}{after['median'] * 1000:>13.3f}{ratio:>8.2f}  {status}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        raise SystemExit(1)
+    print(f"\nNo regressions beyond {args.threshold:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and write a JSON report")
+    run_parser.add_argument("--output", help="JSON report path")
+    run_parser.add_argument("--filter", help="Regular expression selecting benchmark names")
+    run_parser.add_argument("--rounds", type=int, default=10, help="Minimum timed calls per benchmark")
+    run_parser.add_argument("--min-time", type=float, default=1.0, help="Minimum seconds of timed calls per benchmark")
+    run_parser.add_argument("--quick", action="store_true", help="3 rounds / 0.2 s per benchmark (smoke run)")
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser("compare", help="Flag regressions of a report against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative slowdown of the median")
+    compare_parser.add_argument("--min-delta-ms", type=float, default=0.05, help="Ignore slowdowns smaller than this")
+    compare_parser.set_defaults(handler=compare)
+
+    list_parser = commands.add_parser("list", help="List benchmark names")
+    list_parser.set_defaults(handler=lambda args: print("\n".join(case.name for case in BENCHMARKS)))
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    # Benchmarks import from utils/ and benchmarks/ relative to the CliniSearch directory
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
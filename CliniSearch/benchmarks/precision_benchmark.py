@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark classifier precision / memory-format modes on CPU.
+
+For every combination of INFERENCE_PRECISION (fp32, bf16) and INFERENCE_MEMORY_FORMAT
+(contiguous, channels_last), validates probabilities against fp32/contiguous on fixed
+inputs and reports throughput for each batch size. bf16 speedups need a CPU with
+AVX512-BF16 or AMX; elsewhere autocast falls back to slower emulated kernels.
+
+Usage:
+    python -m benchmarks.precision_benchmark --batch-sizes 1 2 4 8 16 32 --repeats 5
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from utils.model_inference import (
+    DEFAULT_MODEL_PATH, MEMORY_FORMATS, PRECISIONS,
+    apply_memory_format, inference_autocast, load_model, prepare_input
+)
+
+
+def probabilities(model, batch, precision, memory_format):
+    with torch.no_grad(), inference_autocast('cpu', precision):
+        outputs = model(prepare_input(batch, 'cpu', memory_format))
+    return torch.sigmoid(outputs.float()).numpy()
+
+
+def throughput(model, batch, precision, memory_format, repeats):
+    """Images per second (median over repeats)."""
+    probabilities(model, batch, precision, memory_format)  # Warm-up
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        probabilities(model, batch, precision, memory_format)
+        timings.append(time.perf_counter() - start)
+    return len(batch) / float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model-path', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=0.02, help='Max allowed |probability - fp32 probability|')
+    args = parser.parse_args()
+
+    print(f"CPU capability: {torch.backends.cpu.get_cpu_capability()}, threads: {torch.get_num_threads()}")
+    model = load_model(args.model_path, device='cpu')
+    inputs = torch.randn(max(args.batch_sizes), 3, 224, 224, generator=torch.Generator().manual_seed(0))
+
+    apply_memory_format(model, 'contiguous')
+    reference = probabilities(model, inputs, 'fp32', 'contiguous')
+
+    header = ''.join(f"{f'bs={b}':>9}" for b in args.batch_sizes)
+    print(f"\n{'precision':<10}{'memory format':<15}{'max |dp|':>10}{'ok':>5}{header}   (images/s)")
+    failed = False
+    for memory_format in MEMORY_FORMATS:
+        apply_memory_format(model, memory_format)
+        for precision in PRECISIONS:
+            diff = float(np.abs(probabilities(model, inputs, precision, memory_format) - reference).max())
+            ok = diff <= args.tolerance
+            failed = failed or not ok
+            rates = ''.join(
+                f"{throughput(model, inputs[:b], precision, memory_format, args.repeats):>9.1f}"
+                for b in args.batch_sizes
+            )
+            print(f"{precision:<10}{memory_format:<15}{diff:>10.2e}{'yes' if ok else 'NO':>5}{rates}")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark decode + preprocess time and peak memory per image size.
+
+Compares the previous preprocessing path (full decode, RGB conversion, per-call
+Compose) with preprocess_image on synthetic radiograph-like JPEG and PNG files.
+
+Usage:
+    python -m benchmarks.preprocess_benchmark --sizes 512 1024 2048 3000 --repeats 20
+"""
+
+import argparse
+import io
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+from PIL import Image
+
+
+def make_radiograph(size, fmt, seed=0):
+    """Encode a smooth synthetic grayscale image of the given size."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size] / size
+    pixels = 128 + 80 * np.sin(6 * x) * np.cos(4 * y) + rng.normal(0, 8, (size, size))
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'L')
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def legacy_preprocess(image_bytes):
+    """The preprocessing path used before the fast decode path."""
+    import torch  # noqa: F401
+    from torchvision import transforms
+    image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+    preprocess = transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+    ])
+    return preprocess(image).unsqueeze(0)
+
+
+def fast_preprocess(image_bytes):
+    from utils.model_inference import preprocess_image
+    return preprocess_image(image_bytes)
+
+
+PATHS = {'legacy': legacy_preprocess, 'fast': fast_preprocess}
+
+
+def run_case(args):
+    """Run one (path, size, format) case in a fresh process and report time and peak RSS growth."""
+    path, size, fmt, repeats = args
+    image_bytes = make_radiograph(size, fmt)
+    fn = PATHS[path]
+    fn(make_radiograph(64, fmt))  # Import modules and warm up outside the measurement
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(image_bytes)
+        timings.append(time.perf_counter() - start)
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'path': path,
+        'size': size,
+        'format': fmt,
+        'median_ms': 1000 * float(np.median(timings)),
+        'peak_rss_growth_mb': (peak_kb - baseline_kb) / 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048, 3000])
+    parser.add_argument('--formats', nargs='+', default=['JPEG', 'PNG'])
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    cases = [(path, size, fmt, args.repeats) for fmt in args.formats for size in args.sizes for path in PATHS]
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        results = pool.map(run_case, cases, chunksize=1)
+
+    print(f"{'format':<6} {'size':>6} {'path':<7} {'median ms':>10} {'peak RSS +MB':>13}")
+    for result in results:
+        print(f"{result['format']:<6} {result['size']:>6} {result['path']:<7} "
+              f"{result['median_ms']:>10.2f} {result['peak_rss_growth_mb']:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
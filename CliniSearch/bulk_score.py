@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Offline bulk scoring for the chest X-ray classifier.
+
+Streams images from a directory (recursively) or from the NIH Chest X-ray 14 dataset
+(Data_Entry_2017.csv) through a multi-worker DataLoader, runs batched forwards on the
+configured inference backend and writes the probabilities for all 14 disease labels
+in fixed-size chunks (NPZ or Parquet).
+
+Chunks are written atomically, so an interrupted run is resumed by running the same
+command again: finished chunks are skipped.
+
+Usage:
+    python bulk_score.py --image-dir /data/archive --output scores/ --format npz
+    python bulk_score.py --nih-dataset /data/nih_chestxray_14 --output scores/ --format parquet --workers 8
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from utils.inference_backends import CLASSIFIER_BACKEND, create_backend
+from utils.diagnosis import disease_labels
+from utils.model_inference import DEFAULT_MODEL_PATH, load_model, model_version, predict_probabilities, preprocess_image
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+def list_directory_images(image_dir):
+    """(image_id, path, ground_truth) for every image under image_dir, in a stable order."""
+    items = []
+    for root, _, files in os.walk(image_dir):
+        for name in files:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, name)
+                items.append((os.path.relpath(path, image_dir), path, None))
+    return sorted(items)
+
+
+def list_nih_images(dataset_path):
+    """(image_id, path, ground_truth) for every locally available image in Data_Entry_2017.csv."""
+    import pandas as pd
+    from utils.test_data_loader import index_image_paths
+
+    csv_path = os.path.join(dataset_path, "Data_Entry_2017.csv")
+    df = pd.read_csv(csv_path, usecols=['Image Index', 'Finding Labels'])
+    image_paths = index_image_paths(dataset_path)
+    return [
+        (row['Image Index'], image_paths[row['Image Index']], row['Finding Labels'])
+        for _, row in df.iterrows() if row['Image Index'] in image_paths
+    ]
+
+
+class ImageScoringDataset(Dataset):
+    """Decodes and preprocesses images in DataLoader workers; unreadable images are flagged, not fatal."""
+    def __init__(self, items):
+        self.items = items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        path = self.items[index][1]
+        try:
+            return preprocess_image(path)[0], index, ''
+        except Exception as e:
+            return torch.zeros(3, 224, 224), index, f"{type(e).__name__}: {e}"
+
+
+class ChunkBatchSampler:
+    """Batches of dataset indices that never cross a chunk boundary, for the pending chunks only."""
+    def __init__(self, chunks, batch_size):
+        self.chunks = chunks  # List of (chunk_id, start, end)
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        for _, start, end in self.chunks:
+            for batch_start in range(start, end, self.batch_size):
+                yield list(range(batch_start, min(batch_start + self.batch_size, end)))
+
+    def __len__(self):
+        return sum((end - start + self.batch_size - 1) // self.batch_size for _, start, end in self.chunks)
+
+
+def _single_thread_worker(_):
+    # DataLoader workers only decode; keep them from competing with the forward pass for cores
+    torch.set_num_threads(1)
+
+
+def chunk_path(output_dir, chunk_id, fmt):
+    return os.path.join(output_dir, f"chunk-{chunk_id:05d}.{fmt}")
+
+
+def write_chunk(path, items, probabilities, errors, fmt):
+    """Write one chunk to a temporary file and move it into place, so partial chunks never exist."""
+    tmp_path = f"{path}.tmp"
+    image_ids = [item[0] for item in items]
+    ground_truth = [item[2] or '' for item in items]
+
+    if fmt == 'npz':
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f, image_ids=np.array(image_ids), probabilities=probabilities.astype(np.float32),
+                labels=np.array(disease_labels), errors=np.array(errors), ground_truth=np.array(ground_truth)
+            )
+    else:
+        import pandas as pd
+        df = pd.DataFrame(probabilities.astype(np.float32), columns=disease_labels)
+        df.insert(0, 'image_id', image_ids)
+        df['ground_truth'] = ground_truth
+        df['error'] = errors
+        df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def check_parquet_engine():
+    """Fail before any scoring when Parquet output is requested but pandas/pyarrow are missing."""
+    try:
+        import pandas  # noqa: F401
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise SystemExit(f"--format parquet needs pandas and pyarrow ({e}); install them or use --format npz")
+
+
+def load_or_create_manifest(output_dir, manifest):
+    """Write the run manifest, or check that a resumed run uses the same source, chunking, model and backend."""
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            existing = json.load(f)
+        for key in ('source', 'num_images', 'chunk_size', 'format', 'model_version', 'backend'):
+            if existing.get(key) != manifest.get(key):
+                raise SystemExit(f"{output_dir} holds a different run ({key}: {existing.get(key)!r} != {manifest.get(key)!r}); "
+                                 f"use a new output directory")
+        return existing
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--image-dir', help='Directory of images (searched recursively)')
+    source.add_argument('--nih-dataset', help='Path to the nih_chestxray_14 folder')
+    parser.add_argument('--output', required=True, help='Output directory for chunk files')
+    parser.add_argument('--format', choices=['npz', 'parquet'], default='npz')
+    parser.add_argument('--model-path', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--backend', default=CLASSIFIER_BACKEND, help='Inference backend (eager, torchscript, compile, onnx)')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=4, help='DataLoader decode/preprocess workers')
+    parser.add_argument('--chunk-size', type=int, default=4096, help='Images per output file')
+    parser.add_argument('--device', default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    if args.format == 'parquet':
+        check_parquet_engine()
+    if not os.path.exists(args.model_path):
+        # Scores from a randomly initialized model look valid; never write them
+        raise SystemExit(f"Model weights not found: {args.model_path}")
+
+    items = list_directory_images(args.image_dir) if args.image_dir else list_nih_images(args.nih_dataset)
+    if not items:
+        raise SystemExit("No images found")
+
+    os.makedirs(args.output, exist_ok=True)
+    load_or_create_manifest(args.output, {
+        'source': os.path.abspath(args.image_dir or args.nih_dataset),
+        'num_images': len(items),
+        'chunk_size': args.chunk_size,
+        'format': args.format,
+        'model_path': args.model_path,
+        'model_version': model_version(args.model_path),
+        'backend': args.backend,
+        'labels': disease_labels
+    })
+
+    all_chunks = [
+        (chunk_id, start, min(start + args.chunk_size, len(items)))
+        for chunk_id, start in enumerate(range(0, len(items), args.chunk_size))
+    ]
+    pending = [chunk for chunk in all_chunks if not os.path.exists(chunk_path(args.output, chunk[0], args.format))]
+    print(f"{len(items)} images in {len(all_chunks)} chunks; {len(all_chunks) - len(pending)} already done")
+    if not pending:
+        return
+
+    model = load_model(args.model_path, device=args.device, require_weights=True)
+    backend = create_backend(model, name=args.backend, device=args.device)
+
+    loader = DataLoader(
+        ImageScoringDataset(items),
+        batch_sampler=ChunkBatchSampler(pending, args.batch_size),
+        num_workers=args.workers,
+        worker_init_fn=_single_thread_worker if args.workers else None,
+        pin_memory=str(args.device).startswith('cuda'),
+        persistent_workers=args.workers > 0
+    )
+
+    chunk_ends = {start: (chunk_id, end) for chunk_id, start, end in pending}
+    current = None
+    scored = 0
+    started_at = time.perf_counter()
+    for images, indices, errors in loader:
+        first_index = int(indices[0])
+        if first_index in chunk_ends:
+            chunk_id, end = chunk_ends[first_index]
+            current = {'id': chunk_id, 'start': first_index, 'end': end, 'probabilities': [], 'errors': []}
+
+        probabilities = predict_probabilities(backend, images, device=args.device)
+        probabilities[[bool(error) for error in errors]] = np.nan
+        current['probabilities'].append(probabilities)
+        current['errors'].extend(errors)
+        scored += len(indices)
+
+        if int(indices[-1]) + 1 == current['end']:
+            write_chunk(
+                chunk_path(args.output, current['id'], args.format),
+                items[current['start']:current['end']],
+                np.concatenate(current['probabilities']),
+                current['errors'],
+                args.format
+            )
+            failed = sum(1 for error in current['errors'] if error)
+            elapsed = time.perf_counter() - started_at
+            print(f"Chunk {current['id']} done ({current['end'] - current['start']} images, {failed} unreadable) - "
+                  f"{scored / elapsed:.1f} images/s")
+
+    print(f"Scored {scored} images in {time.perf_counter() - started_at:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Pre-forked CliniSearch API server that shares model weights between workers.
+
+`uvicorn --workers N` starts N independent processes that each load the classifier,
+BiomedCLIP and the sentence-transformer. This launcher instead loads every registered
+model once in the parent, moves their tensors into shared memory, freezes the
+garbage collector (so workers do not dirty the parent's object pages) and then forks
+N uvicorn workers that serve from one shared listening socket. Each worker sizes its
+thread pools to its share of the cores (see utils/runtime_config.py).
+
+Linux only (fork + /proc). Usage:
+    python serve_prefork.py --workers 4 --port 8000
+    python serve_prefork.py --workers 4 --memory-report 30   # print RSS/PSS per process after 30s
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+
+# Workers that die sooner than this after being forked are not restarted (startup failure)
+MIN_WORKER_UPTIME = 10
+
+
+def share_module_memory(obj):
+    """Move the tensors of every nn.Module reachable from a loaded resource into shared memory."""
+    import torch
+
+    candidates = [obj] + [getattr(obj, name, None) for name in ('model', 'module')]
+    shared = 0
+    for candidate in candidates:
+        if isinstance(candidate, torch.nn.Module):
+            candidate.share_memory()
+            shared += sum(tensor.numel() * tensor.element_size() for tensor in candidate.state_dict().values())
+    return shared
+
+
+def preload_models():
+    """Load every registered resource (and the classifier backend) in this process and share its tensors."""
+    import torch.multiprocessing
+
+    # One named shm file per storage instead of one open fd per storage
+    torch.multiprocessing.set_sharing_strategy('file_system')
+
+    from utils.lazy_resources import RESOURCES, _load_in_order
+    from utils.model_inference import get_backend, get_model
+
+    _load_in_order(list(RESOURCES.values()))
+    shared_bytes = 0
+    for name, resource in RESOURCES.items():
+        if resource.available:
+            shared_bytes += share_module_memory(resource.get())
+        else:
+            print(f"Warning: {name} not loaded in the parent; workers will load it on first use")
+    # The cached classifier is shared too (the resource above returns the same object)
+    if get_model() is not None:
+        get_backend()
+    print(f"Shared {shared_bytes / (1024 * 1024):.0f} MB of model tensors")
+
+
+def read_memory(pid):
+    """RSS, PSS and private (USS) memory in MB from /proc/<pid>/smaps_rollup."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[1].isdigit():
+                    values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    except OSError:
+        return None
+    return {
+        'rss_mb': values.get('Rss', 0),
+        'pss_mb': values.get('Pss', 0),
+        'uss_mb': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    }
+
+
+def print_memory_report(parent_pid, worker_pids):
+    rows = [('parent', parent_pid)] + [(f'worker {i}', pid) for i, pid in enumerate(worker_pids)]
+    print(f"\n{'process':<10} {'pid':>8} {'RSS MB':>9} {'PSS MB':>9} {'USS MB':>9}")
+    total_pss = 0
+    for label, pid in rows:
+        memory = read_memory(pid)
+        if memory is None:
+            continue
+        total_pss += memory['pss_mb']
+        print(f"{label:<10} {pid:>8} {memory['rss_mb']:>9.0f} {memory['pss_mb']:>9.0f} {memory['uss_mb']:>9.0f}")
+
+    parent_memory = read_memory(parent_pid)
+    if parent_memory:
+        # Without sharing, every uvicorn worker holds its own copy of everything the parent loaded
+        independent = parent_memory['rss_mb'] * len(worker_pids)
+        print(f"Total PSS (all processes): {total_pss:.0f} MB; "
+              f"{len(worker_pids)} independent workers would need ~{independent:.0f} MB")
+
+
+def create_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(sock, app, host, port, affinity):
+    """Body of a forked worker: re-apply the per-worker runtime settings and serve."""
+    import uvicorn
+    from utils.runtime_config import configure_runtime
+
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if affinity:
+        os.environ['CPU_AFFINITY'] = 'true'
+    configure_runtime()
+
+    config = uvicorn.Config(app, host=host, port=port, log_level='info')
+    uvicorn.Server(config).run(sockets=[sock])
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--memory-report', type=float, metavar='SECONDS',
+                        help='Print per-process RSS/PSS this many seconds after the workers start')
+    args = parser.parse_args()
+
+    # Workers split the cores between them; the parent only loads models, so it
+    # must not claim a CPU affinity slot of its own
+    os.environ['API_WORKERS'] = str(args.workers)
+    affinity = os.getenv('CPU_AFFINITY', 'false').lower() == 'true'
+    os.environ['CPU_AFFINITY'] = 'false'
+    os.environ['PRELOAD_RESOURCES'] = 'false'
+
+    started_at = time.perf_counter()
+    import api
+    preload_models()
+    print(f"Models loaded in the parent in {time.perf_counter() - started_at:.1f}s")
+
+    sock = create_socket(args.host, args.port)
+    # Objects that exist now are never collected; keeps GC passes in the workers from
+    # writing to (and thereby copying) the parent's pages
+    gc.collect()
+    gc.freeze()
+
+    workers = {}
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(sock, api.app, args.host, args.port, affinity)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                # Never fall back into the parent's supervision loop
+                os._exit(1)
+        workers[pid] = (slot, time.monotonic())
+
+    for slot in range(args.workers):
+        spawn(slot)
+    print(f"Serving on {args.host}:{args.port} with {args.workers} pre-forked workers (parent pid {os.getpid()})")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    if args.memory_report:
+        threading.Timer(args.memory_report, lambda: print_memory_report(os.getpid(), list(workers))).start()
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        worker = workers.pop(pid, None)
+        if worker is None or stopping:
+            continue
+        slot, spawned_at = worker
+        if time.monotonic() - spawned_at < MIN_WORKER_UPTIME:
+            print(f"Worker {pid} exited with status {status} during startup; shutting down")
+            stop(None, None)
+            continue
+        print(f"Worker {pid} exited with status {status}; restarting")
+        spawn(slot)
+
+    sock.close()
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# tests/test_bulkhead.py
+
+import asyncio
+
+import pytest
+
+from utils import executors
+from utils.executors import Bulkhead, BulkheadRejected, bulkhead
+
+
+async def hold(slot, seconds):
+    async with slot:
+        await asyncio.sleep(seconds)
+
+
+async def enter(slot):
+    async with slot:
+        return "admitted"
+
+
+def test_limit_bounds_concurrent_holders():
+    slot = Bulkhead("test", 2)
+    peak = 0
+
+    async def worker():
+        nonlocal peak
+        async with slot:
+            peak = max(peak, slot.active)
+            await asyncio.sleep(0.02)
+
+    async def run():
+        await asyncio.gather(*(worker() for _ in range(6)))
+
+    asyncio.run(run())
+
+    assert peak == 2
+    assert slot.stats["admitted"] == 6
+    assert slot.active == 0 and slot.waiting == 0
+
+
+def test_full_queue_is_rejected_with_429():
+    slot = Bulkhead("test", 1, max_queue=1)
+
+    async def run():
+        holder = asyncio.create_task(hold(slot, 0.1))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(enter(slot))
+        await asyncio.sleep(0)
+        with pytest.raises(BulkheadRejected) as rejected:
+            await enter(slot)
+        assert await waiter == "admitted"
+        await holder
+        return rejected.value
+
+    rejected = asyncio.run(run())
+
+    assert rejected.status_code == 429
+    assert rejected.bulkhead_name == "test"
+    assert rejected.retry_after >= 1
+    assert slot.stats["rejected_queue_full"] == 1
+
+
+def test_wait_beyond_max_wait_is_rejected_with_503():
+    slot = Bulkhead("test", 1, max_wait=0.05)
+
+    async def run():
+        holder = asyncio.create_task(hold(slot, 0.3))
+        await asyncio.sleep(0)
+        with pytest.raises(BulkheadRejected) as rejected:
+            await enter(slot)
+        assert slot.waiting == 0
+        await holder
+        return rejected.value
+
+    rejected = asyncio.run(run())
+
+    assert rejected.status_code == 503
+    assert slot.stats["rejected_timeout"] == 1
+
+
+def test_free_slot_is_taken_without_waiting_for_max_wait():
+    slot = Bulkhead("test", 1, max_wait=0)
+
+    assert asyncio.run(enter(slot)) == "admitted"
+
+
+def test_retry_after_scales_with_service_time_and_queue():
+    slot = Bulkhead("test", 2)
+    assert slot.retry_after() == 1
+
+    slot._service_time = 4.0
+    slot.waiting = 3
+
+    # 4 s per request, 4 requests ahead (3 waiting plus this one) over 2 slots
+    assert slot.retry_after() == 8
+
+
+def test_service_time_is_learned_from_held_slots():
+    slot = Bulkhead("test", 1)
+
+    asyncio.run(hold(slot, 0.05))
+
+    assert 0.04 < slot._service_time < 0.5
+    assert slot.describe()["service_ms_avg"] >= 40
+
+
+def test_environment_overrides_bulkhead_settings(monkeypatch):
+    monkeypatch.setenv("BULKHEAD_ENVTEST_LIMIT", "3")
+    monkeypatch.setenv("BULKHEAD_ENVTEST_QUEUE", "5")
+    monkeypatch.setenv("BULKHEAD_ENVTEST_MAX_WAIT", "1.5")
+    monkeypatch.setattr(executors, "BULKHEADS", {})
+
+    slot = bulkhead("envtest", 1, max_queue=1, max_wait=30)
+
+    assert (slot.limit, slot.max_queue, slot.max_wait) == (3, 5, 1.5)
+    assert executors.BULKHEADS == {"envtest": slot}
+
+
+def test_api_maps_rejections_to_retry_after():
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from api import bulkhead_rejected_handler
+
+    app = FastAPI()
+    app.add_exception_handler(BulkheadRejected, bulkhead_rejected_handler)
+
+    @app.get("/busy")
+    async def busy():
+        raise BulkheadRejected("radiology_analyze", "queue full", 429, 7)
+
+    response = TestClient(app).get("/busy")
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "7"
+    assert response.headers["Cache-Control"] == "no-store"
+    assert response.json()["detail"]["retry_after"] == 7
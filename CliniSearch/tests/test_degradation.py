@@ -0,0 +1,86 @@
+# tests/test_degradation.py
+
+import pytest
+
+from utils import degradation
+from utils.degradation import TIER_PLANS, TIERS, TierLatency, select_tier
+
+
+@pytest.fixture
+def latency(monkeypatch):
+    """Fresh tier latencies (defaults 30 s, 12 s, 3 s) and queue thresholds 2 and 6."""
+    tier_latency = TierLatency()
+    monkeypatch.setattr(degradation, "TIER_LATENCY", tier_latency)
+    monkeypatch.setattr(degradation, "DEGRADE_QUEUE_REDUCED", 2)
+    monkeypatch.setattr(degradation, "DEGRADE_QUEUE_MINIMAL", 6)
+    return tier_latency
+
+
+@pytest.mark.parametrize("queue_depth, expected", [
+    (0, ("full", None)),
+    (1, ("full", None)),
+    (2, ("reduced", "load")),
+    (5, ("reduced", "load")),
+    (6, ("minimal", "load")),
+])
+def test_load_tier_follows_queue_depth(latency, queue_depth, expected):
+    assert select_tier(queue_depth) == expected
+
+
+@pytest.mark.parametrize("remaining_ms, expected", [
+    (60000, ("full", None)),
+    (30000, ("full", None)),
+    (20000, ("reduced", "deadline")),
+    (5000, ("minimal", "deadline")),
+    (100, ("minimal", "deadline")),
+])
+def test_deadline_tier_is_the_richest_that_fits(latency, remaining_ms, expected):
+    assert select_tier(0, remaining_ms) == expected
+
+
+def test_cheaper_of_load_and_deadline_tier_wins(latency):
+    assert select_tier(6, 60000) == ("minimal", "load")
+    assert select_tier(2, 5000) == ("minimal", "deadline")
+    assert select_tier(2, 20000) == ("reduced", "load")
+
+
+def test_observed_latency_replaces_the_default(latency):
+    latency.observe("full", 8000)
+
+    assert latency.expected_ms("full") == 8000
+    assert select_tier(0, 10000) == ("full", None)
+
+
+def test_unobserved_tier_is_never_expected_slower_than_a_richer_one(latency):
+    latency.observe("full", 2000)
+
+    assert latency.expected_ms("reduced") == 2000
+    assert latency.expected_ms("minimal") == 2000
+
+
+def test_moving_average_smooths_observations():
+    latency = TierLatency(smoothing=0.5)
+    latency.observe("full", 1000)
+    latency.observe("full", 3000)
+
+    assert latency.expected_ms("full") == 2000
+    assert latency.describe()["full"]["avg_ms"] == 2000
+
+
+def test_runs_cut_off_at_the_deadline_do_not_lower_the_estimate():
+    latency = TierLatency()
+    latency.observe("full", 20000)
+    latency.observe("full", 500, cut_off=True)
+
+    assert latency.expected_ms("full") == 20000
+    described = latency.describe()["full"]
+    assert (described["count"], described["cut_off"]) == (2, 1)
+
+
+def test_every_tier_has_a_plan_and_cheaper_tiers_never_add_stages():
+    assert set(TIER_PLANS) == set(TIERS)
+    for richer, cheaper in zip(TIERS, TIERS[1:]):
+        assert TIER_PLANS[cheaper]["gradcam_top_n"] <= TIER_PLANS[richer]["gradcam_top_n"]
+        for stage, enabled in TIER_PLANS[cheaper].items():
+            if stage != "gradcam_top_n" and enabled:
+                assert TIER_PLANS[richer][stage]
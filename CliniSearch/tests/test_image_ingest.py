@@ -0,0 +1,104 @@
+# tests/test_image_ingest.py
+
+import io
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils import image_ingest
+from utils.image_ingest import (
+    IMAGENET_MEAN, IMAGENET_STD, PREPROCESS_TRANSFORM, DecodedImage, IngestCache, decode_image, ingest_image, open_image
+)
+
+
+def encoded(mode="L", size=(1200, 1000), fmt="PNG"):
+    rng = np.random.default_rng(0)
+    shape = (size[1], size[0]) if mode == "L" else (size[1], size[0], 3)
+    buffer = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, shape, dtype=np.uint8), mode).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def decoded(digest):
+    return DecodedImage(digest, np.zeros((1, 4, 4), dtype=np.uint8))
+
+
+def test_cache_returns_entries_by_digest():
+    cache = IngestCache()
+    entry = decoded("a")
+    cache.put(entry)
+
+    assert cache.get("a") is entry
+    assert cache.get("b") is None
+
+
+def test_cache_entries_expire_after_the_ttl():
+    cache = IngestCache(ttl_seconds=0.05)
+    cache.put(decoded("a"))
+    time.sleep(0.1)
+
+    assert cache.get("a") is None
+
+
+def test_cache_evicts_the_least_recently_used_entry():
+    cache = IngestCache(max_entries=2)
+    cache.put(decoded("a"))
+    cache.put(decoded("b"))
+    cache.get("a")
+    cache.put(decoded("c"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_ingest_decodes_identical_bytes_once(monkeypatch):
+    monkeypatch.setattr(image_ingest, "INGEST_CACHE", IngestCache())
+    calls = []
+    real_decode = image_ingest.decode_image
+    monkeypatch.setattr(image_ingest, "decode_image", lambda *args: calls.append(args) or real_decode(*args))
+    image_bytes = encoded()
+
+    first = ingest_image(image_bytes)
+    second = ingest_image(image_bytes)
+
+    assert first is second
+    assert len(calls) == 1
+    assert first.classifier_array() is second.classifier_array()
+
+
+@pytest.mark.parametrize("mode, channels", [("L", 1), ("RGB", 3)])
+def test_decode_keeps_grayscale_single_channel_and_at_least_twice_the_model_input(mode, channels):
+    image = decode_image(encoded(mode, size=(2000, 1000)))
+
+    assert image.pixels.dtype == np.uint8
+    assert image.pixels.shape[0] == channels
+    assert min(image.size) >= 2 * PREPROCESS_TRANSFORM.size
+    assert image.size == (1000, 500)
+    assert image.classifier_array().shape == (1, 3, 224, 224)
+
+
+def test_lookup_normalization_matches_float_arithmetic():
+    image = Image.open(io.BytesIO(encoded("RGB", size=(300, 300))))
+
+    resized = np.asarray(image.resize((224, 224), Image.BILINEAR), dtype=np.float32) / 255.0
+    expected = ((resized - IMAGENET_MEAN) / IMAGENET_STD).transpose(2, 0, 1)
+
+    np.testing.assert_allclose(PREPROCESS_TRANSFORM.normalize(image), expected, atol=1e-5)
+
+
+def test_open_image_keeps_the_upload_resolution_unless_capped():
+    image_bytes = encoded("RGB", size=(3000, 1500), fmt="JPEG")
+
+    assert open_image(image_bytes).size == (3000, 1500)
+    capped = open_image(image_bytes, max_size=1024)
+    assert capped.size == (1024, 512)
+    assert capped.mode == "RGB"
+
+
+def test_open_image_converts_16_bit_grayscale_to_l():
+    buffer = io.BytesIO()
+    Image.new("I;16", (64, 32)).save(buffer, "PNG")
+
+    assert open_image(buffer.getvalue()).mode == "L"
@@ -0,0 +1,196 @@
+# tests/test_inference_service.py
+
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from utils import inference_service
+from utils.image_ingest import DecodedImage
+from utils.inference_service import (
+    InferenceClient, SharedRing, _ConnectionHandler, _UnixServer, read_arrays, write_arrays
+)
+from utils.lazy_resources import ResourceUnavailable
+
+
+class FakeService:
+    """Stands in for InferenceService: sums the pixels, after release is set."""
+    def __init__(self):
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        self.release = threading.Event()
+        self.release.set()
+
+    def status(self):
+        return {"pid": os.getpid()}
+
+    def handle(self, ring, message):
+        self.release.wait(5)
+        if message["op"] == "unavailable":
+            raise ResourceUnavailable("biomedclip is not available: offline")
+        slot = ring.slot(message["slot"])
+        pixels = read_arrays(slot, message["inputs"])["pixels"]
+        return {"outputs": write_arrays(slot, {"sum": np.array([pixels.sum()], dtype=np.int64)})}
+
+
+@pytest.fixture
+def service():
+    # Unix socket paths are limited to about 100 bytes, so not under pytest's tmp_path
+    directory = tempfile.mkdtemp(prefix="svc")
+    path = os.path.join(directory, "inference.sock")
+    server = _UnixServer(path, _ConnectionHandler)
+    server.service = FakeService()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path, server.service
+    server.service.release.set()
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def decoded_image(value=1):
+    return DecodedImage("digest", np.full((1, 8, 8), value, dtype=np.uint8))
+
+
+async def wait_until(condition, timeout=2.0):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+
+def test_arrays_round_trip_through_a_slot_at_aligned_offsets():
+    buffer = memoryview(bytearray(1024))
+    arrays = {"a": np.arange(3, dtype=np.float32), "b": np.ones((2, 2), dtype=np.uint8)}
+
+    layout = write_arrays(buffer, arrays)
+    result = read_arrays(buffer, layout)
+
+    assert [entry["offset"] % 64 for entry in layout] == [0, 0]
+    for name, array in arrays.items():
+        np.testing.assert_array_equal(result[name], array)
+
+
+def test_arrays_larger_than_the_slot_are_rejected():
+    with pytest.raises(ValueError, match="INFERENCE_SHM_SLOT_MB"):
+        write_arrays(memoryview(bytearray(16)), {"a": np.zeros(8, dtype=np.float32)})
+
+
+def test_attached_ring_shares_the_owner_slots():
+    owner = SharedRing(2, 128)
+    attached = SharedRing(2, 128, name=owner.name)
+    try:
+        layout = write_arrays(owner.slot(1), {"a": np.arange(4, dtype=np.int32)})
+        np.testing.assert_array_equal(read_arrays(attached.slot(1), layout)["a"], np.arange(4))
+    finally:
+        attached.close()
+        owner.close()
+
+
+def test_call_returns_the_result_arrays(service):
+    path, _ = service
+    client = InferenceClient(path, num_slots=2, slot_mb=1)
+
+    async def run():
+        try:
+            _, arrays = await client._call("sum", decoded_image(2))
+            return int(arrays["sum"][0]), client.describe()["free_slots"]
+        finally:
+            client.close()
+
+    assert asyncio.run(run()) == (128, 2)
+
+
+def test_timed_out_request_keeps_its_slot_until_the_service_replies(service, monkeypatch):
+    path, fake = service
+    monkeypatch.setattr(inference_service, "INFERENCE_SERVICE_TIMEOUT", 0.1)
+    client = InferenceClient(path, num_slots=2, slot_mb=1)
+
+    async def run():
+        try:
+            await client.connect()
+            fake.release.clear()
+            with pytest.raises(asyncio.TimeoutError):
+                await client._call("sum", decoded_image())
+            # The service may still write into the slot, so it is not handed out again
+            described = client.describe()
+            assert (described["free_slots"], described["quarantined_slots"]) == (1, 1)
+
+            fake.release.set()
+            await wait_until(lambda: not client._quarantined)
+            assert client.describe()["free_slots"] == 2
+
+            _, arrays = await client._call("sum", decoded_image(3))
+            assert int(arrays["sum"][0]) == 192
+        finally:
+            client.close()
+
+    asyncio.run(run())
+
+
+def test_quarantined_slot_is_released_when_the_connection_is_lost(service, monkeypatch):
+    path, fake = service
+    monkeypatch.setattr(inference_service, "INFERENCE_SERVICE_TIMEOUT", 0.1)
+    client = InferenceClient(path, num_slots=2, slot_mb=1)
+
+    async def run():
+        try:
+            await client.connect()
+            fake.release.clear()
+            with pytest.raises(asyncio.TimeoutError):
+                await client._call("sum", decoded_image())
+            assert client.describe()["quarantined_slots"] == 1
+
+            client.connections[0].writer.close()
+            await wait_until(lambda: not client._quarantined)
+            assert client.describe()["free_slots"] == 2
+        finally:
+            fake.release.set()
+            client.close()
+
+    asyncio.run(run())
+
+
+def test_cancelled_request_keeps_its_slot_until_the_service_replies(service):
+    path, fake = service
+    client = InferenceClient(path, num_slots=1, slot_mb=1)
+
+    async def run():
+        try:
+            await client.connect()
+            fake.release.clear()
+            task = asyncio.create_task(client._call("sum", decoded_image()))
+            await wait_until(lambda: client.connections[0].pending)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert client.describe()["quarantined_slots"] == 1
+
+            fake.release.set()
+            await wait_until(lambda: not client._quarantined)
+            assert client.describe()["free_slots"] == 1
+        finally:
+            client.close()
+
+    asyncio.run(run())
+
+
+def test_resource_that_failed_to_load_is_reported_as_unavailable(service):
+    path, _ = service
+    client = InferenceClient(path, num_slots=1, slot_mb=1)
+
+    async def run():
+        try:
+            with pytest.raises(ResourceUnavailable):
+                await client._call("unavailable", decoded_image())
+            assert client.describe()["free_slots"] == 1
+        finally:
+            client.close()
+
+    asyncio.run(run())
@@ -0,0 +1,120 @@
+# tests/test_pipeline.py
+
+import asyncio
+import time
+
+import pytest
+
+from utils.pipeline import Pipeline
+
+
+def stage_fn(log, name, delay=0.0, result=None):
+    async def fn(*deps):
+        log.append(("start", name, deps))
+        await asyncio.sleep(delay)
+        log.append(("end", name))
+        return result if result is not None else name
+    return fn
+
+
+def test_stages_start_after_their_dependencies_and_receive_their_results():
+    log = []
+    pipeline = Pipeline("test")
+    pipeline.stage("a", stage_fn(log, "a", result=1))
+    pipeline.stage("b", stage_fn(log, "b", result=2), deps=["a"])
+    pipeline.stage("c", stage_fn(log, "c", result=3), deps=["a", "b"])
+
+    results = asyncio.run(pipeline.run())
+
+    assert results == {"a": 1, "b": 2, "c": 3}
+    assert log.index(("end", "a")) < log.index(("start", "b", (1,)))
+    assert log.index(("end", "b")) < log.index(("start", "c", (1, 2)))
+
+
+def test_independent_stages_overlap():
+    pipeline = Pipeline("test")
+    pipeline.stage("a", stage_fn([], "a", delay=0.2))
+    pipeline.stage("b", stage_fn([], "b", delay=0.2))
+
+    started_at = time.perf_counter()
+    asyncio.run(pipeline.run())
+
+    assert time.perf_counter() - started_at < 0.35
+
+
+def test_unknown_and_duplicate_stages_are_rejected():
+    pipeline = Pipeline("test")
+    pipeline.stage("a", stage_fn([], "a"))
+    with pytest.raises(ValueError):
+        pipeline.stage("a", stage_fn([], "a"))
+    with pytest.raises(ValueError):
+        pipeline.stage("b", stage_fn([], "b"), deps=["missing"])
+
+
+def test_planned_skip_yields_none_to_dependents():
+    log = []
+    pipeline = Pipeline("test")
+    pipeline.skip("pubmed")
+    pipeline.stage("analysis", stage_fn(log, "analysis"), deps=["pubmed"])
+
+    results = asyncio.run(pipeline.run())
+
+    assert results["pubmed"] is None
+    assert ("start", "analysis", (None,)) in log
+    assert pipeline.skipped == ["pubmed"]
+    assert not pipeline.cut_off
+    assert pipeline.report()["stages"]["pubmed"] == {"status": "skipped"}
+
+
+def test_optional_stage_is_cut_off_at_the_deadline():
+    pipeline = Pipeline("test", deadline=time.perf_counter() + 0.1)
+    pipeline.stage("classify", stage_fn([], "classify"))
+    pipeline.stage("slow", stage_fn([], "slow", delay=1.0), deps=["classify"], optional=True)
+    pipeline.stage("conclusion", stage_fn([], "conclusion"), deps=["slow"])
+
+    started_at = time.perf_counter()
+    results = asyncio.run(pipeline.run())
+
+    assert time.perf_counter() - started_at < 0.5
+    assert results["slow"] is None
+    assert results["conclusion"] == "conclusion"
+    assert pipeline.skipped == ["slow"]
+    assert pipeline.cut_off
+
+
+def test_required_stage_ignores_the_deadline():
+    pipeline = Pipeline("test", deadline=time.perf_counter())
+    pipeline.stage("classify", stage_fn([], "classify", delay=0.05))
+
+    assert asyncio.run(pipeline.run()) == {"classify": "classify"}
+
+
+def test_failing_stage_cancels_the_rest():
+    log = []
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    pipeline = Pipeline("test")
+    pipeline.stage("fail", fail)
+    pipeline.stage("slow", stage_fn(log, "slow", delay=1.0))
+
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(pipeline.run())
+    assert ("end", "slow") not in log
+
+
+def test_critical_path_follows_the_dependency_that_finished_last():
+    pipeline = Pipeline("test")
+    pipeline.stage("classify", stage_fn([], "classify"))
+    pipeline.stage("fast", stage_fn([], "fast", delay=0.01), deps=["classify"])
+    pipeline.stage("slow", stage_fn([], "slow", delay=0.1), deps=["classify"])
+    pipeline.stage("conclusion", stage_fn([], "conclusion"), deps=["fast", "slow"])
+
+    asyncio.run(pipeline.run())
+    report = pipeline.report()
+
+    assert pipeline.critical_path() == ["classify", "slow", "conclusion"]
+    assert report["critical_path"] == ["classify", "slow", "conclusion"]
+    assert set(report["critical_path_ms"]) == {"classify", "slow", "conclusion"}
+    assert report["stages"]["slow"]["duration_ms"] >= 90
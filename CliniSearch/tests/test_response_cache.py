@@ -0,0 +1,191 @@
+# tests/test_response_cache.py
+
+import asyncio
+import time
+
+from utils.response_cache import MemoryTier, ResponseCache, SqliteTier, cache_key
+
+
+def counting_compute(value=b"response", delay=0.0, cacheable=True):
+    calls = []
+
+    async def compute():
+        calls.append(time.perf_counter())
+        await asyncio.sleep(delay)
+        return value, cacheable
+    return compute, calls
+
+
+def test_cache_key_ignores_argument_order():
+    assert cache_key(image_sha256="abc", model_version="v1") == cache_key(model_version="v1", image_sha256="abc")
+    assert cache_key(image_sha256="abc", model_version="v1") != cache_key(image_sha256="abc", model_version="v2")
+
+
+def test_miss_then_hit():
+    cache = ResponseCache()
+    compute, calls = counting_compute()
+
+    async def run():
+        return [await cache.get_or_compute("key", compute) for _ in range(2)]
+
+    assert asyncio.run(run()) == [(b"response", "MISS"), (b"response", "HIT")]
+    assert len(calls) == 1
+
+
+def test_concurrent_identical_requests_share_one_computation():
+    cache = ResponseCache()
+    compute, calls = counting_compute(delay=0.1)
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute("key", compute) for _ in range(3)))
+
+    results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert sorted(status for _, status in results) == ["MISS", "SHARED", "SHARED"]
+    assert cache.stats["shared"] == 2
+
+
+def test_failed_computation_propagates_to_waiters_and_is_not_cached():
+    cache = ResponseCache()
+
+    async def fail():
+        await asyncio.sleep(0.05)
+        raise RuntimeError("boom")
+
+    async def run():
+        return await asyncio.gather(
+            cache.get_or_compute("key", fail), cache.get_or_compute("key", fail), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.describe()["in_flight"] == 0
+    assert cache.memory.get("key") is None
+
+
+def test_uncacheable_results_are_not_stored():
+    cache = ResponseCache()
+    compute, calls = counting_compute(cacheable=False)
+
+    async def run():
+        return [await cache.get_or_compute("key", compute) for _ in range(2)]
+
+    assert [status for _, status in asyncio.run(run())] == ["MISS", "MISS"]
+    assert len(calls) == 2
+
+
+def test_bypass_recomputes_and_refreshes_the_entry():
+    cache = ResponseCache()
+    first, _ = counting_compute(b"old")
+    second, calls = counting_compute(b"new")
+
+    async def run():
+        await cache.get_or_compute("key", first)
+        bypassed = await cache.get_or_compute("key", second, bypass=True)
+        return bypassed, await cache.get_or_compute("key", first)
+
+    assert asyncio.run(run()) == ((b"new", "BYPASS"), (b"new", "HIT"))
+    assert len(calls) == 1
+
+
+def test_memory_entries_expire_after_the_ttl():
+    tier = MemoryTier(ttl_seconds=0.05, max_entries=4, max_bytes=1024)
+    tier.put("key", b"value")
+    assert tier.get("key") == b"value"
+
+    time.sleep(0.1)
+
+    assert tier.get("key") is None
+    assert tier.total_bytes == 0
+
+
+def test_memory_tier_evicts_least_recently_used_by_count_and_bytes():
+    tier = MemoryTier(ttl_seconds=60, max_entries=2, max_bytes=10)
+    tier.put("a", b"1234")
+    tier.put("b", b"1234")
+    tier.get("a")
+    tier.put("c", b"1234")
+    assert tier.get("b") is None and tier.get("a") is not None
+
+    tier.put("d", b"12345678")
+    assert len(tier) == 1 and tier.get("d") == b"12345678"
+    tier.put("too_large", b"x" * 11)
+    assert tier.get("too_large") is None
+
+
+def test_sqlite_tier_evicts_least_recently_used_entries_beyond_max_bytes(tmp_path):
+    tier = SqliteTier(str(tmp_path / "cache.sqlite"), ttl_seconds=60, max_bytes=10)
+    tier.put("a", b"1234")
+    time.sleep(0.01)
+    tier.put("b", b"1234")
+    time.sleep(0.01)
+    tier.get("a")
+    time.sleep(0.01)
+    tier.put("c", b"1234")
+
+    assert tier.get("b") == (None, None)
+    assert tier.get("a")[0] == b"1234"
+    assert tier.get("c")[0] == b"1234"
+    assert tier.describe()["bytes"] == 8
+
+
+def test_sqlite_entries_expire_after_the_ttl(tmp_path):
+    tier = SqliteTier(str(tmp_path / "cache.sqlite"), ttl_seconds=0.05, max_bytes=1024)
+    tier.put("key", b"value")
+    time.sleep(0.1)
+
+    assert tier.get("key") == (None, None)
+
+
+def test_disk_hits_survive_a_restart_and_are_promoted_to_memory(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    compute, calls = counting_compute()
+
+    async def run(cache):
+        return await cache.get_or_compute("key", compute)
+
+    assert asyncio.run(run(ResponseCache(disk_path=path)))[1] == "MISS"
+    restarted = ResponseCache(disk_path=path)
+    assert asyncio.run(run(restarted)) == (b"response", "HIT")
+    assert restarted.stats["disk_hits"] == 1
+    assert restarted.memory.get("key") == b"response"
+    assert len(calls) == 1
+
+
+
+def test_unshared_request_neither_joins_nor_is_joined():
+    cache = ResponseCache()
+    compute, calls = counting_compute(delay=0.1)
+
+    async def run():
+        shared = asyncio.create_task(cache.get_or_compute("key", compute))
+        await asyncio.sleep(0)
+        private = asyncio.create_task(cache.get_or_compute("key", compute, share=False))
+        await asyncio.sleep(0)
+        joined = await cache.get_or_compute("key", compute)
+        return await shared, await private, joined
+
+    shared, private, joined = asyncio.run(run())
+
+    # The deadline request computes on its own; later requests join the shared computation
+    assert len(calls) == 2
+    assert (shared[1], private[1], joined[1]) == ("MISS", "MISS", "SHARED")
+    assert cache.stats["shared"] == 1
+
+
+def test_unshared_computation_is_not_joined():
+    cache = ResponseCache()
+    compute, calls = counting_compute(delay=0.1)
+
+    async def run():
+        private = asyncio.create_task(cache.get_or_compute("key", compute, share=False))
+        await asyncio.sleep(0)
+        shared = await cache.get_or_compute("key", compute)
+        return await private, shared
+
+    private, shared = asyncio.run(run())
+
+    assert len(calls) == 2
+    assert (private[1], shared[1]) == ("MISS", "MISS")
@@ -0,0 +1,47 @@
+# tests/test_rethreshold.py
+
+import json
+
+from api import rethreshold_analysis
+
+
+def encoded_analysis(**fields):
+    analysis = {
+        "predicted_diseases": [{"disease": "Effusion", "confidence": 0.7}],
+        "top_5_diseases": [{"disease": "Effusion", "confidence": 0.7}],
+        "probabilities": {"Atelectasis": 0.3, "Effusion": 0.7, "Edema": 0.45, "Mass": 0.05},
+        "concise_conclusion": "concise",
+        **fields
+    }
+    return json.dumps(analysis).encode()
+
+
+def test_predicted_diseases_follow_the_requested_threshold():
+    result = json.loads(rethreshold_analysis(encoded_analysis(), 0.4))
+
+    assert result["predicted_diseases"] == [
+        {"disease": "Effusion", "confidence": 0.7},
+        {"disease": "Edema", "confidence": 0.45}
+    ]
+
+
+def test_threshold_is_inclusive():
+    result = json.loads(rethreshold_analysis(encoded_analysis(), 0.45))
+
+    assert [d["disease"] for d in result["predicted_diseases"]] == ["Effusion", "Edema"]
+
+
+def test_other_fields_are_unchanged():
+    original = json.loads(encoded_analysis())
+    result = json.loads(rethreshold_analysis(encoded_analysis(), 0.9))
+
+    assert result["predicted_diseases"] == []
+    assert {k: v for k, v in result.items() if k != "predicted_diseases"} == {
+        k: v for k, v in original.items() if k != "predicted_diseases"
+    }
+
+
+def test_body_without_probabilities_is_returned_as_is():
+    body = json.dumps({"detail": "not an analysis"}).encode()
+
+    assert rethreshold_analysis(body, 0.4) is body
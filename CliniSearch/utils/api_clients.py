@@ -4,6 +4,7 @@ import os
 import google.generativeai as genai
 import anthropic
 from dotenv import load_dotenv
+from utils.telemetry import stage_timer
 
 # Load environment variables from .env file
 load_dotenv()
@@ -30,10 +31,11 @@ class GeminiClient:
     def generate_text(self, prompt: str, temperature: float = 0.3) -> str:
         """Generates text using the Gemini model."""
         try:
-            response = self.model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(temperature=temperature)
-            )
+            with stage_timer("gemini"):
+                response = self.model.generate_content(
+                    prompt,
+                    generation_config=genai.types.GenerationConfig(temperature=temperature)
+                )
             return response.text
         except Exception as e:
             error_message = f"Error during Gemini text generation: {e}"
@@ -48,7 +50,8 @@ class GeminiClient:
             image_parts = [{"mime_type": "image/jpeg", "data": image_bytes}]
             prompt_parts = [prompt, image_parts[0]]
             
-            response = self.model.generate_content(prompt_parts)
+            with stage_timer("gemini"):
+                response = self.model.generate_content(prompt_parts)
             return response.text
         except Exception as e:
             error_message = f"Error during Gemini image analysis: {e}"
@@ -0,0 +1,243 @@
+# utils/biomedclip_export.py
+"""
+Export BiomedCLIP's image encoder for CPU serving and check it against open_clip.
+
+/xray/detect only needs the ViT-B/16 vision tower once the label text features are
+precomputed, so the export writes that tower alone (ONNX or TorchScript, optionally
+with dynamic INT8 quantization of the Linear layers) plus a JSON sidecar holding the
+label prompts, their text features, the logit scale and the preprocess config.
+Point BIOMEDCLIP_VISION_PATH at the exported file to serve it without PubMedBERT.
+
+Usage:
+    python -m utils.biomedclip_export export --format onnx --quantize --output models/biomedclip_vision.onnx
+    python -m utils.biomedclip_export parity --vision-path models/biomedclip_vision.onnx --fixtures fixtures/xray_detection
+
+The parity fixture directory holds xray/ and non_xray/ subdirectories of images.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from utils.inference_backends import onnx_export_options
+from utils.xray_detection import (
+    BIOMEDCLIP_MODEL_ID, XRAY_LABELS_NEG, XRAY_LABELS_POS,
+    load_exported_detector, load_open_clip_detector, sidecar_path
+)
+
+FIXTURE_CLASSES = {"xray": True, "non_xray": False}
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+
+class VisionTower(torch.nn.Module):
+    """open_clip visual module followed by the L2 normalization encode_image applies."""
+    def __init__(self, visual):
+        super().__init__()
+        self.visual = visual
+
+    def forward(self, pixel_values):
+        return F.normalize(self.visual(pixel_values), dim=-1)
+
+
+def export_onnx(tower, output_path, quantize=False, opset=17):
+    """Export the vision tower to ONNX with a dynamic batch axis, optionally INT8-quantizing the weights."""
+    dummy = torch.randn(1, 3, *tower.visual.image_size)
+    export_path = output_path
+    if quantize:
+        export_path = os.path.join(tempfile.mkdtemp(), "vision_fp32.onnx")
+
+    torch.onnx.export(
+        tower, (dummy,), export_path,
+        input_names=["pixel_values"], output_names=["image_features"],
+        dynamic_axes={"pixel_values": {0: "batch"}, "image_features": {0: "batch"}},
+        opset_version=opset, **onnx_export_options()
+    )
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(export_path, output_path, weight_type=QuantType.QInt8)
+
+
+def export_torchscript(tower, output_path, quantize=False):
+    """Trace the vision tower to TorchScript, optionally with dynamic INT8 Linear layers."""
+    if quantize:
+        tower = torch.ao.quantization.quantize_dynamic(tower, {torch.nn.Linear}, dtype=torch.qint8)
+    dummy = torch.randn(1, 3, *tower.visual.image_size)
+    with torch.no_grad():
+        traced = torch.jit.trace(tower, dummy)
+    torch.jit.save(torch.jit.freeze(traced), output_path)
+
+
+EXPORTERS = {"onnx": export_onnx, "torchscript": export_torchscript}
+
+
+def export_vision_tower(output_path, fmt="onnx", quantize=False):
+    """
+    Export BiomedCLIP's image encoder and write its sidecar metadata.
+
+    Args:
+        output_path: Destination of the exported model (.onnx or .pt)
+        fmt: "onnx" or "torchscript"
+        quantize: Apply dynamic INT8 quantization
+
+    Returns:
+        Path of the sidecar JSON file
+    """
+    from open_clip.model import get_model_preprocess_cfg
+
+    detector = load_open_clip_detector()
+    model = detector.model
+    tower = VisionTower(model.visual).eval()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    EXPORTERS[fmt](tower, output_path, quantize=quantize)
+
+    preprocess_cfg = dict(get_model_preprocess_cfg(model))
+    preprocess_cfg.pop("fill_color", None)
+    metadata = {
+        "model_id": BIOMEDCLIP_MODEL_ID,
+        "format": fmt,
+        "quantized": quantize,
+        "labels_pos": list(XRAY_LABELS_POS),
+        "labels_neg": list(XRAY_LABELS_NEG),
+        "text_features": detector.text_features.tolist(),
+        "logit_scale": float(detector.logit_scale),
+        "preprocess": preprocess_cfg
+    }
+    metadata_path = sidecar_path(output_path)
+    with open(metadata_path, "w") as f:
+        json.dump(metadata, f)
+
+    size_mb = os.path.getsize(output_path) / (1024 * 1024)
+    print(f"Exported {fmt}{' (INT8)' if quantize else ''} vision tower to {output_path} ({size_mb:.1f} MB)")
+    print(f"Wrote sidecar metadata to {metadata_path}")
+    return metadata_path
+
+
+def load_fixtures(fixture_dir):
+    """(path, is_xray) pairs from the xray/ and non_xray/ subdirectories."""
+    fixtures = []
+    for subdir, is_xray in FIXTURE_CLASSES.items():
+        class_dir = os.path.join(fixture_dir, subdir)
+        if not os.path.isdir(class_dir):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                fixtures.append((os.path.join(class_dir, name), is_xray))
+    return fixtures
+
+
+def timed_probability(detector, image):
+    start = time.perf_counter()
+    probability = detector.xray_probability(image)
+    return probability, time.perf_counter() - start
+
+
+def parity_report(vision_path, fixture_dir, threshold=0.5, tolerance=0.05):
+    """
+    Compare the exported detector with the open_clip detector on a fixture set.
+
+    Args:
+        vision_path: Exported vision tower (its sidecar must sit next to it)
+        fixture_dir: Directory with xray/ and non_xray/ image subdirectories
+        threshold: X-ray decision threshold
+        tolerance: Maximum allowed absolute probability difference
+
+    Returns:
+        Dictionary with per-image results and summary statistics
+    """
+    fixtures = load_fixtures(fixture_dir)
+    if not fixtures:
+        raise ValueError(f"No fixture images found under {fixture_dir}/xray or {fixture_dir}/non_xray")
+
+    reference = load_open_clip_detector()
+    exported = load_exported_detector(vision_path)
+
+    rows = []
+    for path, is_xray in fixtures:
+        image = Image.open(path).convert("RGB")
+        # Warm-up run so the first image does not carry session/graph initialization
+        if not rows:
+            reference.xray_probability(image)
+            exported.xray_probability(image)
+        reference_prob, reference_seconds = timed_probability(reference, image)
+        exported_prob, exported_seconds = timed_probability(exported, image)
+        rows.append({
+            "image": os.path.relpath(path, fixture_dir),
+            "is_xray": is_xray,
+            "reference_probability": reference_prob,
+            "exported_probability": exported_prob,
+            "abs_diff": abs(reference_prob - exported_prob),
+            "decision_match": (reference_prob >= threshold) == (exported_prob >= threshold),
+            "reference_ms": 1000 * reference_seconds,
+            "exported_ms": 1000 * exported_seconds
+        })
+
+    summary = {
+        "images": len(rows),
+        "max_abs_diff": max(row["abs_diff"] for row in rows),
+        "decision_agreement": float(np.mean([row["decision_match"] for row in rows])),
+        "reference_accuracy": float(np.mean([(row["reference_probability"] >= threshold) == row["is_xray"] for row in rows])),
+        "exported_accuracy": float(np.mean([(row["exported_probability"] >= threshold) == row["is_xray"] for row in rows])),
+        "reference_median_ms": float(np.median([row["reference_ms"] for row in rows])),
+        "exported_median_ms": float(np.median([row["exported_ms"] for row in rows])),
+        "tolerance": tolerance
+    }
+    summary["passed"] = summary["max_abs_diff"] <= tolerance and summary["decision_agreement"] == 1.0
+    return {"rows": rows, "summary": summary}
+
+
+def print_parity_report(report):
+    print(f"{'image':<40} {'x-ray':>5} {'open_clip':>10} {'exported':>10} {'diff':>8} {'match':>6}")
+    for row in report["rows"]:
+        print(f"{row['image'][:40]:<40} {str(row['is_xray']):>5} {row['reference_probability']:>10.4f} "
+              f"{row['exported_probability']:>10.4f} {row['abs_diff']:>8.4f} {str(row['decision_match']):>6}")
+
+    summary = report["summary"]
+    print(f"\nImages: {summary['images']}")
+    print(f"Max abs probability diff: {summary['max_abs_diff']:.4f} (tolerance {summary['tolerance']})")
+    print(f"Decision agreement: {summary['decision_agreement']:.1%}")
+    print(f"Accuracy open_clip / exported: {summary['reference_accuracy']:.1%} / {summary['exported_accuracy']:.1%}")
+    print(f"Median latency open_clip / exported: {summary['reference_median_ms']:.1f} ms / {summary['exported_median_ms']:.1f} ms")
+    print("PASSED" if summary["passed"] else "FAILED")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export the BiomedCLIP vision tower")
+    export_parser.add_argument("--format", choices=sorted(EXPORTERS), default="onnx")
+    export_parser.add_argument("--quantize", action="store_true", help="Dynamic INT8 quantization")
+    export_parser.add_argument("--output", required=True)
+
+    parity_parser = subparsers.add_parser("parity", help="Compare an exported vision tower with open_clip")
+    parity_parser.add_argument("--vision-path", required=True)
+    parity_parser.add_argument("--fixtures", required=True)
+    parity_parser.add_argument("--threshold", type=float, default=0.5)
+    parity_parser.add_argument("--tolerance", type=float, default=0.05)
+    parity_parser.add_argument("--json", help="Also write the report to this file")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export_vision_tower(args.output, fmt=args.format, quantize=args.quantize)
+        return
+
+    report = parity_report(args.vision_path, args.fixtures, threshold=args.threshold, tolerance=args.tolerance)
+    print_parity_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(0 if report["summary"]["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
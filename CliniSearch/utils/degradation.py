@@ -0,0 +1,127 @@
+# utils/degradation.py
+
+import os
+
+# Analysis tiers from richest to cheapest. Every tier returns the classification and
+# at least the top-1 GradCAM; cheaper tiers leave out optional stages
+TIERS = ("full", "reduced", "minimal")
+
+# What each tier runs: GradCAM overlays for the top gradcam_top_n diseases (and a
+# Gemini analysis for each of them when disease_analyses is set)
+TIER_PLANS = {
+    "full": {
+        "gradcam_top_n": 5,
+        "pubmed": True,
+        "disease_analyses": True,
+        "document_context": True,
+        "concise_conclusion": True,
+        "comprehensive_conclusion": True
+    },
+    "reduced": {
+        "gradcam_top_n": int(os.getenv("DEGRADED_GRADCAM_TOP_N", 3)),
+        "pubmed": False,
+        "disease_analyses": True,
+        "document_context": False,
+        "concise_conclusion": True,
+        "comprehensive_conclusion": False
+    },
+    "minimal": {
+        "gradcam_top_n": 1,
+        "pubmed": False,
+        "disease_analyses": False,
+        "document_context": False,
+        "concise_conclusion": False,
+        "comprehensive_conclusion": False
+    }
+}
+
+# Requests waiting for admission at which analyses start in a cheaper tier
+DEGRADE_QUEUE_REDUCED = int(os.getenv("DEGRADE_QUEUE_REDUCED", 2))
+DEGRADE_QUEUE_MINIMAL = int(os.getenv("DEGRADE_QUEUE_MINIMAL", 6))
+
+# Expected latency of each tier until it has been observed on this worker
+DEFAULT_TIER_LATENCY_MS = {"full": 30000.0, "reduced": 12000.0, "minimal": 3000.0}
+
+
+class TierLatency:
+    """
+    Per-tier request counts and latencies; the moving average is the tier's expected latency.
+
+    Runs cut off at their deadline only count towards the request statistics: their
+    latency is the deadline, not what the tier takes, and averaging it in would let a
+    tier look fast enough for ever tighter deadlines.
+    """
+    def __init__(self, smoothing=0.2):
+        self.smoothing = smoothing
+        self._stats = {
+            tier: {"count": 0, "cut_off": 0, "total_ms": 0.0, "max_ms": 0.0, "ewma_ms": None} for tier in TIERS
+        }
+
+    def observe(self, tier, latency_ms, cut_off=False):
+        stats = self._stats[tier]
+        stats["count"] += 1
+        stats["total_ms"] += latency_ms
+        stats["max_ms"] = max(stats["max_ms"], latency_ms)
+        if cut_off:
+            stats["cut_off"] += 1
+            return
+        stats["ewma_ms"] = latency_ms if stats["ewma_ms"] is None else (
+            (1 - self.smoothing) * stats["ewma_ms"] + self.smoothing * latency_ms
+        )
+
+    def expected_ms(self, tier):
+        observed = self._stats[tier]["ewma_ms"]
+        if observed is not None:
+            return observed
+        # An unobserved tier is never expected to be slower than a richer one
+        index = TIERS.index(tier)
+        return min([DEFAULT_TIER_LATENCY_MS[tier]] + [self.expected_ms(richer) for richer in TIERS[:index]])
+
+    def describe(self):
+        return {
+            tier: {
+                "count": stats["count"],
+                "cut_off": stats["cut_off"],
+                "avg_ms": round(stats["total_ms"] / stats["count"], 1) if stats["count"] else None,
+                "max_ms": round(stats["max_ms"], 1),
+                "expected_ms": round(self.expected_ms(tier), 1)
+            }
+            for tier, stats in self._stats.items()
+        }
+
+
+TIER_LATENCY = TierLatency()
+
+
+def select_tier(queue_depth, remaining_ms=None):
+    """
+    Choose the analysis tier from the admission queue depth and the remaining deadline budget.
+
+    The load tier follows DEGRADE_QUEUE_REDUCED/DEGRADE_QUEUE_MINIMAL. With a deadline, the
+    richest tier whose expected latency fits the remaining budget is used (minimal if
+    none does). The cheaper of the two wins.
+
+    Args:
+        queue_depth: Requests currently waiting for admission
+        remaining_ms: Milliseconds left until the request deadline, or None
+
+    Returns:
+        Tuple of (tier, reason) where reason is "load", "deadline" or None
+    """
+    if queue_depth >= DEGRADE_QUEUE_MINIMAL:
+        load_tier = "minimal"
+    elif queue_depth >= DEGRADE_QUEUE_REDUCED:
+        load_tier = "reduced"
+    else:
+        load_tier = "full"
+
+    deadline_tier = "full"
+    if remaining_ms is not None:
+        fitting = [tier for tier in TIERS if TIER_LATENCY.expected_ms(tier) <= remaining_ms]
+        deadline_tier = fitting[0] if fitting else "minimal"
+
+    if TIERS.index(deadline_tier) > TIERS.index(load_tier):
+        return deadline_tier, "deadline"
+    if load_tier != "full":
+        return load_tier, "load"
+    return "full", None
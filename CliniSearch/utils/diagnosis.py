@@ -0,0 +1,501 @@
+# utils/diagnosis.py
+
+import contextvars
+import functools
+import io
+import json
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from utils.image_ingest import DecodedImage, PREPROCESS_TRANSFORM
+from utils.telemetry import stage_timer
+
+# The torch-free half of the classifier pipeline: thresholding, heatmap overlays and
+# figures from probabilities and CAM grids. API workers in front of the inference
+# service import this module instead of model_inference, so they never load torch.
+# matplotlib and cv2 are imported inside the functions that render or resize heatmaps
+
+# Define disease labels
+disease_labels = ['Atelectasis', 'Consolidation', 'Infiltration', 'Pneumothorax', 
+                 'Edema', 'Emphysema', 'Fibrosis', 'Effusion', 'Pneumonia', 
+                 'Pleural_Thickening', 'Cardiomegaly', 'Nodule', 'Mass', 'Hernia']
+
+# Inference precision (fp32 or bf16, see model_inference), part of the model version
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION", "fp32")
+
+# Default weights used when a request does not name a model path
+DEFAULT_MODEL_PATH = os.getenv("MODEL_PATH")
+
+# Directories a request-supplied model path may point into (os.pathsep-separated);
+# defaults to the directory of MODEL_PATH
+MODEL_DIRS = [
+    os.path.realpath(directory)
+    for directory in os.getenv("MODEL_DIRS", os.path.dirname(DEFAULT_MODEL_PATH or "")).split(os.pathsep)
+    if directory
+]
+
+def is_torchscript_archive(model_path):
+    """True if model_path is a torch.jit.save archive rather than a torch.save checkpoint"""
+    if not zipfile.is_zipfile(model_path):
+        return False
+    with zipfile.ZipFile(model_path) as archive:
+        return any('/code/' in name for name in archive.namelist())
+
+@functools.lru_cache(maxsize=32)
+def _is_torchscript_file(path, mtime_ns, size):
+    # Keyed by modification time and size, so a replaced file is inspected again
+    return is_torchscript_archive(path)
+
+def resolve_model_path(model_path=None):
+    """
+    Check a requested weights path against MODEL_DIRS
+    
+    TorchScript archives (e.g. the INT8 model from utils/quantization.py) are rejected,
+    MODEL_PATH included: they are classification-only, while a diagnosis needs the eager
+    weights for GradCAM and the attention map. Serve them as CLASSIFIER_BACKEND_PATH.
+    
+    Args:
+        model_path: Requested path to the model weights (None for MODEL_PATH)
+        
+    Returns:
+        DEFAULT_MODEL_PATH for the default weights, else the resolved (real) path
+        
+    Raises:
+        ValueError: If the path is outside MODEL_DIRS, is not an existing file or is a
+            TorchScript archive
+    """
+    real_path = os.path.realpath(model_path) if model_path else None
+    if not model_path or (DEFAULT_MODEL_PATH and real_path == os.path.realpath(DEFAULT_MODEL_PATH)):
+        resolved = DEFAULT_MODEL_PATH
+    else:
+        if not any(os.path.commonpath([real_path, directory]) == directory for directory in MODEL_DIRS):
+            raise ValueError("model_path must be inside one of the MODEL_DIRS directories")
+        if not os.path.isfile(real_path):
+            raise ValueError(f"model_path does not exist: {model_path}")
+        resolved = real_path
+    if resolved and os.path.isfile(resolved):
+        stat = os.stat(resolved)
+        if _is_torchscript_file(os.path.realpath(resolved), stat.st_mtime_ns, stat.st_size):
+            raise ValueError(
+                f"{model_path or 'MODEL_PATH'} is a TorchScript archive, which is classification-only; "
+                f"diagnosis needs the eager weights (serve the archive with CLASSIFIER_BACKEND_PATH)"
+            )
+    return resolved
+
+def model_version(model_path=None):
+    """
+    Identifier of the classifier weights and numerics that produce a prediction
+    
+    MODEL_VERSION overrides it; otherwise it is derived from the weights file name, size
+    and modification time plus the inference precision.
+    
+    Args:
+        model_path: Path to the model weights (defaults to the MODEL_PATH environment variable)
+        
+    Returns:
+        Version string
+    """
+    path = model_path or DEFAULT_MODEL_PATH
+    if not model_path and os.getenv("MODEL_VERSION"):
+        return os.getenv("MODEL_VERSION")
+    try:
+        stat = os.stat(path)
+        weights = f"{os.path.basename(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    except (OSError, TypeError):
+        weights = f"{path}:unavailable"
+    return f"{weights}:{INFERENCE_PRECISION}"
+
+def predictions_from_probabilities(probs, threshold=0.4):
+    """
+    Apply the confidence threshold to one image's probabilities
+    
+    Args:
+        probs: Numpy array of per-class probabilities, shape (num_classes,)
+        threshold: Confidence threshold for positive detection
+        
+    Returns:
+        Dictionary with predictions and confidence scores (as returned by predict)
+    """
+    # Get predictions above threshold
+    positives = probs >= threshold
+    
+    results = []
+    for i, (prob, is_positive) in enumerate(zip(probs, positives)):
+        if is_positive:
+            results.append({
+                'disease': disease_labels[i],
+                'confidence': float(prob),
+                'index': i
+            })
+    
+    # Also get top 5 diseases regardless of threshold for comprehensive analysis
+    top_5_indices = np.argsort(probs)[-5:][::-1]
+    top_5_diseases = []
+    for idx in top_5_indices:
+        top_5_diseases.append({
+            'disease': disease_labels[idx],
+            'confidence': float(probs[idx]),
+            'index': int(idx)
+        })
+    
+    # Sort by confidence
+    results = sorted(results, key=lambda x: x['confidence'], reverse=True)
+    
+    return {
+        'raw_probabilities': probs.tolist(),
+        'predicted_diseases': results,
+        'top_5_diseases': top_5_diseases
+    }
+
+def preprocess_array(image_data):
+    """
+    Preprocess an image for the model without torch
+    
+    Args:
+        image_data: PIL image, path to image, encoded image bytes or DecodedImage
+        
+    Returns:
+        Normalized float32 array of shape (1, 3, 224, 224)
+    """
+    if isinstance(image_data, DecodedImage):
+        # Already decoded by the ingest stage; the input is derived once and shared
+        return image_data.classifier_array()
+    if isinstance(image_data, (str, bytes)):
+        # Opened here, so JPEG draft decoding can be applied before pixels are loaded
+        image = PREPROCESS_TRANSFORM.open(image_data)
+    elif isinstance(image_data, Image.Image):
+        # If image_data is already a PIL Image (left unmodified)
+        image = image_data
+    else:
+        raise ValueError("Unsupported image_data type. Expected PIL Image, path string or bytes.")
+    
+    with stage_timer("preprocess"):
+        return PREPROCESS_TRANSFORM.normalize(image)[None]
+
+def denormalize_array(normalized):
+    """Undo ImageNet normalization of a (3, H, W) input, as an (H, W, 3) array in [0, 1]"""
+    img_np = normalized.transpose(1, 2, 0)
+    mean = np.array([0.485, 0.456, 0.406])
+    std = np.array([0.229, 0.224, 0.225])
+    return np.clip(img_np * std + mean, 0, 1)
+
+# Parameters that turn a raw CAM grid into the overlay rendered by the server,
+# returned to clients that colorize heatmaps themselves
+HEATMAP_BLEND_PARAMETERS = {
+    'output_size': [224, 224],
+    'interpolation': 'bilinear',
+    'normalization': 'minmax',
+    'colormap': 'jet',
+    'image_weight': 0.6,
+    'heatmap_weight': 0.4
+}
+
+def upsample_cam(cam_grid):
+    """
+    Upsample a low-resolution CAM grid to the model input size and min-max normalize it
+    
+    Args:
+        cam_grid: 2D numpy array at the target layer resolution
+        
+    Returns:
+        224x224 heatmap with values in [0, 1]
+    """
+    import cv2
+    width, height = HEATMAP_BLEND_PARAMETERS['output_size']
+    cam = cv2.resize(np.asarray(cam_grid, dtype=np.float32), (width, height), interpolation=cv2.INTER_LINEAR)
+    cam = cam - np.min(cam)
+    cam = cam / np.max(cam) if np.max(cam) > 0 else cam
+    return cam
+
+def overlay_heatmap(img_np, cam):
+    """
+    Colorize a [0, 1] heatmap with the JET colormap and blend it over the image
+    
+    Args:
+        img_np: Denormalized RGB image as float array in [0, 1]
+        cam: Heatmap with the same spatial size as img_np
+        
+    Returns:
+        Blended overlay as float array
+    """
+    import cv2
+    heatmap = cv2.applyColorMap(np.uint8(255 * cam), cv2.COLORMAP_JET)
+    heatmap = cv2.cvtColor(heatmap, cv2.COLOR_BGR2RGB)
+    heatmap = heatmap / 255.0
+    return HEATMAP_BLEND_PARAMETERS['image_weight'] * img_np + HEATMAP_BLEND_PARAMETERS['heatmap_weight'] * heatmap
+
+# Bounded pool for figure rendering and PNG encoding, so callers can continue with
+# PubMed/LLM work while figures are produced in the background
+RENDER_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("RENDER_WORKERS", min(4, os.cpu_count() or 1))),
+    thread_name_prefix="gradcam-render"
+)
+
+def _figure_to_png(fig):
+    """Encode a matplotlib Figure as PNG bytes"""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    FigureCanvasAgg(fig)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='PNG', bbox_inches='tight', dpi=150)
+    return buffer.getvalue()
+
+def render_gradcam_figure(original_image, overlay, title):
+    """
+    Render the original image next to its GradCAM overlay
+    
+    Uses the object-oriented matplotlib API instead of pyplot, so figures can be
+    rendered concurrently from worker threads.
+    
+    Args:
+        original_image: Original image (numpy array or PIL image)
+        overlay: GradCAM overlay as numpy array
+        title: Title for the overlay panel
+        
+    Returns:
+        PNG-encoded figure as bytes
+    """
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(12, 5))
+    ax1, ax2 = fig.subplots(1, 2)
+    
+    # Original image
+    ax1.imshow(original_image)
+    ax1.set_title('Original X-ray')
+    ax1.axis('off')
+    
+    # GradCAM overlay
+    ax2.imshow(overlay)
+    ax2.set_title(title)
+    ax2.axis('off')
+    
+    fig.tight_layout()
+    return _figure_to_png(fig)
+
+def render_attention_figure(original_image, attention_map):
+    """
+    Render the original image next to the 7x7 attention grid
+    
+    Args:
+        original_image: Original image as numpy array
+        attention_map: 7x7 attention map as numpy array
+        
+    Returns:
+        PNG-encoded figure as bytes
+    """
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=(12, 5))
+    ax1, ax2 = fig.subplots(1, 2)
+    
+    # Original image
+    ax1.imshow(original_image)
+    ax1.set_title('Original X-ray')
+    ax1.axis('off')
+    
+    # Attention map (7x7 grid)
+    im2 = ax2.imshow(attention_map, cmap='jet', interpolation='nearest')
+    ax2.set_title('Model Attention Map (7x7)')
+    ax2.axis('off')
+    
+    # Add colorbar
+    fig.colorbar(im2, ax=ax2, fraction=0.046, pad=0.04)
+    
+    # Add grid lines to show 7x7 structure
+    ax2.set_xticks(np.arange(-0.5, 7, 1), minor=True)
+    ax2.set_yticks(np.arange(-0.5, 7, 1), minor=True)
+    ax2.grid(which='minor', color='white', linestyle='-', linewidth=0.5, alpha=0.7)
+    
+    fig.tight_layout()
+    return _figure_to_png(fig)
+
+def _render_and_save(render_fn, args, output_path=None):
+    """Render a figure and optionally write it to output_path"""
+    with stage_timer("render"):
+        png_bytes = render_fn(*args)
+    if output_path:
+        with open(output_path, 'wb') as f:
+            f.write(png_bytes)
+        print(f"Saved visualization: {output_path}")
+    return png_bytes
+
+def gradcam_from_grids(img_np, prediction_results, cam_grids, output_dir=None):
+    """
+    GradCAM overlays for all detected diseases from precomputed CAM grids
+    
+    Args:
+        img_np: Denormalized input image, shape (224, 224, 3)
+        prediction_results: Results from predictions_from_probabilities
+        cam_grids: CAM grids keyed by class index
+        output_dir: Directory to save the visualization images
+        
+    Returns:
+        Dictionary mapping disease names to GradCAM visualizations
+    """
+    gradcam_results = {}
+    
+    for result in prediction_results['predicted_diseases']:
+        disease = result['disease']
+        cam_grid = np.asarray(cam_grids[result['index']])
+        cam = upsample_cam(cam_grid)
+        
+        # Colorize the heatmap and overlay it on the original image
+        overlay = overlay_heatmap(img_np, cam)
+        
+        # Save visualization if output_dir is provided
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            _render_and_save(
+                render_gradcam_figure,
+                (img_np, overlay, f'{disease} GradCAM\n(Confidence: {result["confidence"]:.3f})'),
+                f"{output_dir}/{disease}_gradcam_analysis.png"
+            )
+        
+        # Save result
+        gradcam_results[disease] = {
+            'cam_grid': cam_grid.tolist(),
+            'heatmap': cam.tolist(),
+            'overlay': overlay.tolist(),
+            'confidence': result['confidence']
+        }
+    
+    return gradcam_results
+
+def gradcam_top5_from_grids(img_np, top_5_diseases, cam_grids, output_dir=None, render_pool=None):
+    """
+    GradCAM overlays for the top 5 diseases from precomputed CAM grids
+    
+    Args:
+        img_np: Denormalized input image, shape (224, 224, 3)
+        top_5_diseases: List of top 5 diseases from predictions_from_probabilities
+        cam_grids: CAM grids keyed by class index
+        output_dir: Directory to save the visualization images
+        render_pool: Optional executor; when given, each figure is rendered on it and
+            the entry gets a 'figure' Future resolving to the PNG bytes
+        
+    Returns:
+        Dictionary mapping disease names to GradCAM visualizations
+    """
+    gradcam_results = {}
+    
+    for i, disease_info in enumerate(top_5_diseases):
+        disease = disease_info['disease']
+        confidence = disease_info['confidence']
+        cam_grid = np.asarray(cam_grids[disease_info['index']])
+        cam = upsample_cam(cam_grid)
+        
+        # Colorize the heatmap and overlay it on the original image
+        overlay = overlay_heatmap(img_np, cam)
+        
+        # Save result
+        gradcam_results[f"top{i+1}_{disease}"] = {
+            'disease': disease,
+            'rank': i + 1,
+            'cam_grid': cam_grid.tolist(),
+            'heatmap': cam.tolist(),
+            'overlay': overlay.tolist(),
+            'confidence': confidence
+        }
+        
+        # Render the visualization in the background or save it if output_dir is provided
+        gradcam_path = None
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            gradcam_path = f"{output_dir}/top{i+1}_{disease}_gradcam.png"
+        render_args = (img_np, overlay, f'{disease} GradCAM\n(Top {i+1} - Confidence: {confidence:.3f})')
+        if render_pool is not None:
+            gradcam_results[f"top{i+1}_{disease}"]['figure'] = render_pool.submit(
+                contextvars.copy_context().run, _render_and_save, render_gradcam_figure, render_args, gradcam_path
+            )
+        elif gradcam_path:
+            _render_and_save(render_gradcam_figure, render_args, gradcam_path)
+    
+    return gradcam_results
+
+def attention_from_map(img_np, attention_map, output_dir=None, render_pool=None):
+    """
+    Attention map visualization (7x7 grid without overlay) from a precomputed map
+    
+    Args:
+        img_np: Denormalized input image, shape (224, 224, 3)
+        attention_map: 7x7 attention map
+        output_dir: Directory to save the visualization
+        render_pool: Optional executor; when given, the figure is rendered on it and
+            the result gets a 'figure' Future resolving to the PNG bytes
+        
+    Returns:
+        Dictionary with attention map visualization
+    """
+    attention_map = np.asarray(attention_map)
+    results = {
+        'attention_map': attention_map.tolist()
+    }
+    
+    # Render the visualization in the background or save it if output_dir is provided
+    attention_path = None
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        attention_path = f"{output_dir}/attention_analysis.png"
+    if render_pool is not None:
+        results['figure'] = render_pool.submit(
+            contextvars.copy_context().run, _render_and_save, render_attention_figure, (img_np, attention_map), attention_path
+        )
+    elif attention_path:
+        _render_and_save(render_attention_figure, (img_np, attention_map), attention_path)
+    
+    return results
+
+def diagnosis_from_grids(image_data, probabilities, cam_grids, attention_map, output_dir=None, threshold=0.4, render_pool=None, gradcam_top_n=5):
+    """
+    Build the diagnose_and_visualize result from inference outputs computed in another process
+    
+    Thresholding, heatmap upsampling, overlays and figure rendering run here; the
+    classifier, GradCAM and attention map are not touched.
+    
+    Args:
+        image_data: PIL image, path to image or DecodedImage that was diagnosed
+        probabilities: Per-class probabilities, shape (num_classes,)
+        cam_grids: CAM grids keyed by class index, covering the top 5 and every class
+            at or above threshold
+        attention_map: 7x7 attention map
+        output_dir: Directory to save visualizations
+        threshold: Confidence threshold for positive detection
+        render_pool: Optional executor for the top-5 GradCAM and attention figures
+        gradcam_top_n: Number of top-5 diseases that get a GradCAM overlay and figure
+        
+    Returns:
+        Dictionary with diagnosis and visualization results, as from diagnose_and_visualize
+    """
+    img_np = denormalize_array(preprocess_array(image_data)[0])
+    prediction_results = predictions_from_probabilities(np.asarray(probabilities), threshold)
+    gradcam_results = gradcam_from_grids(img_np, prediction_results, cam_grids, output_dir)
+    gradcam_top5_results = gradcam_top5_from_grids(
+        img_np, prediction_results['top_5_diseases'][:gradcam_top_n], cam_grids, output_dir, render_pool
+    )
+    attention_results = attention_from_map(img_np, attention_map, output_dir, render_pool)
+    return format_diagnosis_results(prediction_results, gradcam_results, gradcam_top5_results, attention_results, output_dir, render_pool)
+
+def format_diagnosis_results(prediction_results, gradcam_results, gradcam_top5_results, attention_results, output_dir=None, render_pool=None):
+    """Assemble the diagnose_and_visualize result, splitting out pending renders and saving it as JSON"""
+    results = {
+        'diagnosis': prediction_results,
+        'gradcam': gradcam_results,
+        'gradcam_top5': gradcam_top5_results,
+        'attention': attention_results
+    }
+    
+    # Pending figure renders are returned separately so the results stay JSON-serializable
+    if render_pool is not None:
+        renders = {key: info.pop('figure') for key, info in gradcam_top5_results.items()}
+        renders['attention'] = attention_results.pop('figure')
+        results['renders'] = renders
+    
+    # Save results as JSON if output_dir is provided
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        with open(f"{output_dir}/diagnosis_results.json", 'w') as f:
+            json.dump({key: value for key, value in results.items() if key != 'renders'}, f, indent=4)
+    
+    return results
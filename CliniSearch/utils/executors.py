@@ -0,0 +1,168 @@
+# utils/executors.py
+
+import asyncio
+import contextvars
+import functools
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import telemetry
+
+# CPU-bound model work (classifier, GradCAM, BiomedCLIP, embeddings, decoding). Kept small:
+# each task already uses the worker's torch intra-op threads
+CPU_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("CPU_EXECUTOR_WORKERS", 2)),
+    thread_name_prefix="cpu-inference"
+)
+
+# Blocking SDK and file calls (Gemini, Claude, CSV reads) that mostly wait on I/O
+IO_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("IO_EXECUTOR_WORKERS", 16)),
+    thread_name_prefix="blocking-io"
+)
+
+
+async def run_in_executor(executor, fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) on an executor, carrying the caller's context variables along."""
+    context = contextvars.copy_context()
+    call = functools.partial(context.run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run CPU-bound work off the event loop on the bounded CPU executor."""
+    return await run_in_executor(CPU_EXECUTOR, fn, *args, **kwargs)
+
+
+async def run_io(fn, *args, **kwargs):
+    """Run a blocking I/O call (SDK request, file read) off the event loop."""
+    return await run_in_executor(IO_EXECUTOR, fn, *args, **kwargs)
+
+
+class BulkheadRejected(Exception):
+    """Raised when a bulkhead sheds a request instead of queueing it (mapped to 429/503 with Retry-After)."""
+    def __init__(self, bulkhead_name, reason, status_code, retry_after):
+        super().__init__(f"{bulkhead_name}: {reason}")
+        self.bulkhead_name = bulkhead_name
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Bulkhead:
+    """
+    Caps how many requests of one endpoint class run at once.
+
+    Heavy endpoints wait for a slot here instead of queueing in front of everything else
+    on the executors, so a burst of analyses cannot starve health checks or light
+    endpoints. With max_queue, requests arriving while max_queue others are already
+    waiting are rejected at once (429); with max_wait, a request that has not started
+    after max_wait seconds is rejected (503). Both carry a Retry-After estimate.
+    """
+    def __init__(self, name, limit, max_queue=None, max_wait=None):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.stats = {"admitted": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        # Exponentially weighted average of the time a request holds a slot
+        self._service_time = None
+        self._held_since = {}
+
+    def retry_after(self):
+        """Seconds until a newly queued request would likely get a slot (at least 1)."""
+        service_time = self._service_time or 1.0
+        return max(1, math.ceil(service_time * (self.waiting + 1) / self.limit))
+
+    async def __aenter__(self):
+        if self.max_queue is not None and self.waiting >= self.max_queue:
+            self.stats["rejected_queue_full"] += 1
+            if telemetry.PROMETHEUS_AVAILABLE:
+                telemetry.BULKHEAD_REJECTED.labels(bulkhead=self.name, reason="queue_full").inc()
+            raise BulkheadRejected(self.name, "queue full", 429, self.retry_after())
+        self.waiting += 1
+        if telemetry.PROMETHEUS_AVAILABLE:
+            telemetry.BULKHEAD_WAITING.labels(bulkhead=self.name).inc()
+        queued_at = time.perf_counter()
+        try:
+            if self.max_wait is None or not self._semaphore.locked():
+                await self._semaphore.acquire()
+            else:
+                await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            self.stats["rejected_timeout"] += 1
+            if telemetry.PROMETHEUS_AVAILABLE:
+                telemetry.BULKHEAD_REJECTED.labels(bulkhead=self.name, reason="wait_exceeded").inc()
+            raise BulkheadRejected(self.name, "queue wait exceeded", 503, self.retry_after()) from None
+        finally:
+            self.waiting -= 1
+            if telemetry.PROMETHEUS_AVAILABLE:
+                telemetry.BULKHEAD_WAITING.labels(bulkhead=self.name).dec()
+        waited = time.perf_counter() - queued_at
+        if telemetry.PROMETHEUS_AVAILABLE:
+            telemetry.BULKHEAD_WAIT.labels(bulkhead=self.name).observe(waited)
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        self.stats["admitted"] += 1
+        self.active += 1
+        self._held_since[asyncio.current_task()] = time.perf_counter()
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        held = time.perf_counter() - self._held_since.pop(asyncio.current_task())
+        self._service_time = held if self._service_time is None else 0.8 * self._service_time + 0.2 * held
+        self.active -= 1
+        self._semaphore.release()
+
+    def describe(self):
+        admitted = self.stats["admitted"]
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "max_queue": self.max_queue,
+            "max_wait": self.max_wait,
+            **self.stats,
+            "wait_ms_avg": round(self._wait_total / admitted * 1000, 1) if admitted else None,
+            "wait_ms_max": round(self._wait_max * 1000, 1),
+            "service_ms_avg": round(self._service_time * 1000, 1) if self._service_time is not None else None
+        }
+
+
+BULKHEADS = {}
+
+
+def bulkhead(name, default_limit, max_queue=None, max_wait=None):
+    """
+    Create and register a bulkhead.
+
+    BULKHEAD_<NAME>_LIMIT overrides the default size, BULKHEAD_<NAME>_QUEUE the queue
+    bound and BULKHEAD_<NAME>_MAX_WAIT the maximum queue wait in seconds.
+    """
+    prefix = f"BULKHEAD_{name.upper()}"
+    limit = int(os.getenv(f"{prefix}_LIMIT", default_limit))
+    max_queue = os.getenv(f"{prefix}_QUEUE", max_queue)
+    max_wait = os.getenv(f"{prefix}_MAX_WAIT", max_wait)
+    BULKHEADS[name] = Bulkhead(
+        name,
+        limit,
+        max_queue=int(max_queue) if max_queue is not None else None,
+        max_wait=float(max_wait) if max_wait is not None else None
+    )
+    return BULKHEADS[name]
+
+
+def executor_status():
+    """Executor sizes and bulkhead occupancy, for diagnostics endpoints."""
+    return {
+        "cpu_executor_workers": CPU_EXECUTOR._max_workers,
+        "io_executor_workers": IO_EXECUTOR._max_workers,
+        "bulkheads": {name: bulkhead.describe() for name, bulkhead in BULKHEADS.items()}
+    }
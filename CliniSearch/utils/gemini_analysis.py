@@ -0,0 +1,586 @@
+# utils/gemini_analysis.py
+
+import io
+import os
+
+import numpy as np
+
+from utils.diagnosis import render_gradcam_figure
+from utils.telemetry import stage_timer
+
+# Version of the Gemini prompts below; bump it whenever a prompt changes so cached
+# analyses produced with the old prompts are not served
+PROMPT_VERSION = "1"
+
+async def get_pubmed_for_disease(disease_name, perform_rag_func, vector_store):
+    """
+    Get PubMed information for a specific disease
+    
+    Args:
+        disease_name: Name of the disease to search for
+        perform_rag_func: The perform_rag function
+        vector_store: Vector store instance
+        
+    Returns:
+        Tuple of (context, sources) from PubMed
+    """
+    try:
+        query = f"human chest X-ray {disease_name} radiographic signs location anatomy patient"
+        context, sources = await perform_rag_func(
+            query, 
+            vector_store, 
+            use_web=False, 
+            use_pubmed=True
+        )
+        return context, sources
+    except Exception as e:
+        print(f"Error getting PubMed for {disease_name}: {e}")
+        return None, None
+
+def analyze_individual_disease_with_pubmed(gemini_client, disease_name, confidence, gradcam_overlay, original_image_pil, pubmed_context=None, pubmed_sources=None):
+    """
+    Get concise individual analysis for a specific disease with PubMed citations
+    
+    Args:
+        gemini_client: Initialized Gemini client
+        disease_name: Name of the disease
+        confidence: Confidence score
+        gradcam_overlay: GradCAM overlay image as numpy array
+        original_image_pil: Original PIL image
+        pubmed_context: PubMed context for this disease
+        pubmed_sources: PubMed sources for this disease
+        
+    Returns:
+        Concise analysis with PubMed citations
+    """
+    # Format citations
+    citations = ""
+    if pubmed_sources:
+        for i, source in enumerate(pubmed_sources[:2]):  # Use top 2 sources
+            pmid = source.get('link', '').split('/')[-1] if source.get('link') else 'N/A'
+            citations += f"[{i+1}] {source.get('title', 'N/A')} (PMID: {pmid})\n"
+    
+    prompt = f"""You are a radiologist. Provide a CONCISE analysis of {disease_name} for this human chest X-ray.
+
+**Disease**: {disease_name}
+**PubMed Evidence:**
+{pubmed_context if pubmed_context else "No PubMed information available"}
+
+**References:**
+{citations if citations else "No references available"}
+
+**Required Analysis (Keep VERY brief):**
+
+1. **Location & Signs** (1-2 sentences):
+   - Where does {disease_name} typically appear on human chest X-ray?
+   - What are the key radiographic signs in humans? Cite evidence [number]
+
+2. **GradCAM Assessment** (1-2 sentences):
+   - Does the highlighted area match the expected anatomical location from literature?
+   - Is the model focusing on the correct region for {disease_name}?
+
+3. **Quick Assessment** (1 sentence):
+   - Based on PubMed evidence, is this finding consistent with {disease_name} in humans?
+
+**Guidelines:**
+- Maximum 5 sentences total
+- Always cite PubMed sources using [number]
+- Focus only on human pathology and anatomical accuracy
+- Do not include any animal disease references"""
+
+    try:
+        # Create visualization image
+        img_bytes = render_gradcam_figure(original_image_pil, gradcam_overlay, f'{disease_name} GradCAM')
+        
+        # Create multimodal prompt
+        prompt_parts = [
+            prompt,
+            {
+                "mime_type": "image/png",
+                "data": img_bytes
+            }
+        ]
+        
+        with stage_timer("gemini"):
+            analysis = gemini_client.model.generate_content(prompt_parts)
+        return analysis.text
+        
+    except Exception as e:
+        return f"Error getting analysis for {disease_name}: {str(e)}"
+
+def analyze_individual_disease_with_gemini(gemini_client, disease_name, confidence, gradcam_overlay, original_image_pil):
+    """
+    Get individual analysis for a specific disease from Gemini
+    
+    Args:
+        gemini_client: Initialized Gemini client
+        disease_name: Name of the disease
+        confidence: Confidence score
+        gradcam_overlay: GradCAM overlay image as numpy array
+        original_image_pil: Original PIL image
+        
+    Returns:
+        Gemini's analysis for this specific disease
+    """
+    prompt = f"""You are an expert radiologist. Analyze this human chest X-ray specifically for {disease_name}.
+
+**Disease**: {disease_name} (Human pathology only)
+**AI Confidence**: {confidence:.3f}
+
+**Please provide a focused analysis for {disease_name} including:**
+
+1. **Clinical Description**: What is {disease_name} and how does it typically present on human chest X-rays?
+
+2. **GradCAM Interpretation**: Looking at the highlighted regions in the GradCAM visualization:
+   - Are the highlighted areas anatomically consistent with {disease_name} in humans?
+   - Do the focus areas match typical radiographic patterns for this condition in human patients?
+   - Any concerning or unexpected areas of attention?
+
+3. **Confidence Assessment**: Based on the visualization and confidence score ({confidence:.3f}):
+   - Does this confidence level seem appropriate for human diagnosis?
+   - What factors support or contradict this diagnosis in humans?
+
+4. **Clinical Recommendations**: For this specific finding in human patients:
+   - What additional views or imaging might be helpful?
+   - What clinical correlation would be important?
+
+Keep your response focused specifically on {disease_name} in human patients only. Do not reference veterinary or animal pathology."""
+
+    try:
+        # Create visualization image
+        img_bytes = render_gradcam_figure(original_image_pil, gradcam_overlay, f'{disease_name} GradCAM\n(Confidence: {confidence:.3f})')
+        
+        # Create multimodal prompt
+        prompt_parts = [
+            prompt,
+            {
+                "mime_type": "image/png",
+                "data": img_bytes
+            }
+        ]
+        
+        with stage_timer("gemini"):
+            analysis = gemini_client.model.generate_content(prompt_parts)
+        return analysis.text
+        
+    except Exception as e:
+        return f"Error getting individual analysis for {disease_name}: {str(e)}"
+
+def get_concise_conclusion_from_gemini(gemini_client, top_5_diseases, individual_analyses, original_image_pil):
+    """
+    Get concise conclusion and overall assessment from Gemini
+    
+    Args:
+        gemini_client: Initialized Gemini client
+        top_5_diseases: List of top 5 diseases with confidence scores
+        individual_analyses: Dictionary of individual disease analyses
+        original_image_pil: Original PIL image
+        
+    Returns:
+        Concise conclusion from Gemini
+    """
+    diseases_summary = ""
+    for i, disease in enumerate(top_5_diseases[:3]):  # Only top 3
+        diseases_summary += f"{i+1}. {disease['disease']}: {disease['confidence']:.3f}\n"
+    
+    prompt = f"""You are a radiologist providing a CONCISE conclusion for this human chest X-ray.
+
+**AI Results (Top 3):**
+{diseases_summary}
+
+**Provide a BRIEF conclusion (maximum 6 sentences):**
+
+1. **Primary Finding** (1-2 sentences):
+   - What is the most significant finding on this human X-ray?
+
+2. **Clinical Significance** (1-2 sentences): 
+   - What does this mean for the human patient?
+
+3. **Immediate Recommendations** (1-2 sentences):
+   - What should be done next for this patient?
+
+**Guidelines:**
+- Maximum 6 sentences total
+- Focus only on the most important findings in humans
+- Be concise and actionable for human healthcare
+- Do not reference animal or veterinary conditions"""
+
+    try:
+        # Convert original image to bytes
+        img_buffer = io.BytesIO()
+        original_image_pil.save(img_buffer, format='JPEG')
+        img_buffer.seek(0)
+        img_bytes = img_buffer.getvalue()
+        
+        prompt_parts = [
+            prompt,
+            {
+                "mime_type": "image/jpeg",
+                "data": img_bytes
+            }
+        ]
+        
+        with stage_timer("gemini"):
+            conclusion = gemini_client.model.generate_content(prompt_parts)
+        return conclusion.text
+        
+    except Exception as e:
+        return f"Error getting concise conclusion: {str(e)}"
+
+def get_comprehensive_conclusion_from_gemini(gemini_client, top_5_diseases, individual_analyses, original_image_pil):
+    """
+    Get comprehensive conclusion and overall assessment from Gemini
+    
+    Args:
+        gemini_client: Initialized Gemini client
+        top_5_diseases: List of top 5 diseases with confidence scores
+        individual_analyses: Dictionary of individual disease analyses
+        original_image_pil: Original PIL image
+        
+    Returns:
+        Comprehensive conclusion from Gemini
+    """
+    diseases_summary = ""
+    for i, disease in enumerate(top_5_diseases):
+        diseases_summary += f"{i+1}. {disease['disease']}: {disease['confidence']:.3f}\n"
+    
+    individual_summary = ""
+    for disease_key, analysis in individual_analyses.items():
+        disease_name = disease_key.split('_', 1)[1]  # Remove 'top1_' prefix
+        individual_summary += f"\n**Analysis for {disease_name}:**\n{analysis[:500]}...\n"
+    
+    prompt = f"""You are a senior radiologist providing a comprehensive conclusion for this human chest X-ray analysis.
+
+**AI Model Results - Top 5 Predictions:**
+{diseases_summary}
+
+**Individual Disease Analyses Summary:**
+{individual_summary}
+
+**Please provide a COMPREHENSIVE CONCLUSION including:**
+
+1. **Overall Radiological Impression**:
+   - Primary findings and their significance in human patients
+   - Most likely diagnoses based on the complete analysis
+   - Confidence in the overall assessment for human pathology
+
+2. **Clinical Synthesis**:
+   - How do the individual findings relate to each other in humans?
+   - Are there any patterns or combinations that suggest specific human conditions?
+   - What is the most coherent clinical picture for this patient?
+
+3. **Risk Stratification**:
+   - Which findings require immediate attention for the patient?
+   - Which findings need follow-up monitoring in humans?
+   - Any incidental findings of note in human healthcare?
+
+4. **Recommendations**:
+   - Next steps for human patient management
+   - Additional imaging or studies needed for humans
+   - Clinical correlation required for this patient
+   - Timeline for follow-up in human healthcare
+
+5. **Limitations and Caveats**:
+   - Limitations of AI analysis for human diagnosis
+   - Factors that might affect interpretation in humans
+   - Importance of clinical correlation with patient history
+
+6. **Final Assessment**:
+   - Summary statement of key findings in this human patient
+   - Overall clinical significance for human health
+   - Recommended action priority level for patient care
+
+Provide a professional, structured conclusion that synthesizes all the individual analyses into a coherent radiological report for human healthcare only. Do not reference veterinary or animal pathology."""
+
+    try:
+        # Convert original image to bytes
+        img_buffer = io.BytesIO()
+        original_image_pil.save(img_buffer, format='JPEG')
+        img_buffer.seek(0)
+        img_bytes = img_buffer.getvalue()
+        
+        prompt_parts = [
+            prompt,
+            {
+                "mime_type": "image/jpeg",
+                "data": img_bytes
+            }
+        ]
+        
+        with stage_timer("gemini"):
+            conclusion = gemini_client.model.generate_content(prompt_parts)
+        return conclusion.text
+        
+    except Exception as e:
+        return f"Error getting comprehensive conclusion: {str(e)}"
+
+def prepare_gemini_analysis_from_results(original_image_pil, diagnosis_results, output_dir=None):
+    """
+    Prepare comprehensive analysis for Gemini based on diagnosis results
+    
+    Args:
+        original_image_pil: PIL Image of the original chest X-ray
+        diagnosis_results: Results from diagnose_and_visualize
+        output_dir: Optional directory to save visualization images
+        
+    Returns:
+        Dictionary with prompt and image data for Gemini
+    """
+    import matplotlib.pyplot as plt
+    
+    # Create analysis prompt
+    predicted_diseases = diagnosis_results['diagnosis']['predicted_diseases']
+    
+    prompt = f"""You are an expert radiologist analyzing a human chest X-ray. I have performed AI-assisted analysis and will provide:
+
+1. The original human chest X-ray image
+2. AI model predictions with confidence scores for human pathology
+3. GradCAM visualizations showing model attention for each predicted disease
+4. Overall attention map showing general areas of focus
+
+**AI Model Predictions (Human Pathology Only):**
+"""
+    
+    if predicted_diseases:
+        for disease in predicted_diseases:
+            prompt += f"- {disease['disease']}: {disease['confidence']:.3f} confidence\n"
+    else:
+        prompt += "- No diseases detected above threshold\n"
+    
+    prompt += """
+**Please provide a comprehensive radiological analysis for human healthcare including:**
+
+1. **Clinical Assessment**: For each predicted disease in humans, explain:
+   - What the condition represents clinically in human patients
+   - Typical radiographic findings in humans
+   - How the GradCAM visualization aligns with expected findings in human chest X-rays
+
+2. **GradCAM Analysis**: Interpret the highlighted regions in each GradCAM:
+   - Are the highlighted areas anatomically relevant for human pathology?
+   - Do they correspond to typical locations for each condition in humans?
+   - Any concerning or unexpected focus areas for human diagnosis?
+
+3. **Attention Map Analysis**: 
+   - Overall pattern of model attention across the human chest image
+   - Whether attention aligns with clinically relevant human anatomical structures
+   - Any areas of high attention that weren't flagged for specific human diseases
+
+4. **Clinical Correlation**:
+   - Overall interpretation of findings for human patient care
+   - Confidence in AI predictions based on visualization analysis for humans
+   - Recommended follow-up or additional imaging needed for human patients
+   - Any limitations or caveats specific to human diagnosis
+
+5. **Quality Assessment**:
+   - Image quality and technical factors affecting human diagnosis
+   - Any artifacts or limitations affecting interpretation for patient care
+
+Please structure your response clearly and provide specific observations about the visualizations relevant to human healthcare only. Do not reference animal or veterinary pathology."""
+
+    # Prepare image data for multimodal input
+    images_for_analysis = []
+    
+    # Convert PIL image to bytes for Gemini
+    img_byte_arr = io.BytesIO()
+    original_image_pil.save(img_byte_arr, format='JPEG')
+    original_image_bytes = img_byte_arr.getvalue()
+    
+    images_for_analysis.append({
+        "description": "Original Chest X-ray",
+        "data": original_image_bytes,
+        "mime_type": "image/jpeg"
+    })
+    
+    # Create visualization images for Gemini if output_dir is provided
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        
+        # Save and add GradCAM images
+        for disease_name, gradcam_data in diagnosis_results['gradcam'].items():
+            fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
+            
+            # Original image
+            img_np = np.array(original_image_pil.convert('RGB'))
+            ax1.imshow(img_np, cmap='gray')
+            ax1.set_title('Original X-ray')
+            ax1.axis('off')
+            
+            # GradCAM overlay
+            overlay = np.array(gradcam_data['overlay'])
+            ax2.imshow(overlay)
+            ax2.set_title(f'{disease_name} GradCAM\n(Confidence: {gradcam_data["confidence"]:.3f})')
+            ax2.axis('off')
+            
+            plt.tight_layout()
+            gradcam_path = f"{output_dir}/{disease_name}_gradcam_analysis.png"
+            plt.savefig(gradcam_path, bbox_inches='tight', dpi=150)
+            plt.close()
+            
+            # Add to images for analysis
+            with open(gradcam_path, 'rb') as f:
+                gradcam_bytes = f.read()
+            images_for_analysis.append({
+                "description": f"GradCAM visualization for {disease_name}",
+                "data": gradcam_bytes,
+                "mime_type": "image/png"
+            })
+        
+        # Save and add attention map
+        attention_data = diagnosis_results['attention']
+        fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(15, 5))
+        
+        # Original
+        img_np = np.array(original_image_pil.convert('RGB'))
+        ax1.imshow(img_np, cmap='gray')
+        ax1.set_title('Original X-ray')
+        ax1.axis('off')
+        
+        # Attention map
+        attention_map = np.array(attention_data['attention_map'])
+        im2 = ax2.imshow(attention_map, cmap='jet')
+        ax2.set_title('Model Attention Map')
+        ax2.axis('off')
+        plt.colorbar(im2, ax=ax2, fraction=0.046, pad=0.04)
+        
+        # Overlay
+        overlay = np.array(attention_data['overlay'])
+        ax3.imshow(overlay)
+        ax3.set_title('Attention Overlay')
+        ax3.axis('off')
+        
+        plt.tight_layout()
+        attention_path = f"{output_dir}/attention_analysis.png"
+        plt.savefig(attention_path, bbox_inches='tight', dpi=150)
+        plt.close()
+        
+        # Add to images for analysis
+        with open(attention_path, 'rb') as f:
+            attention_bytes = f.read()
+        images_for_analysis.append({
+            "description": "Model attention map and overlay",
+            "data": attention_bytes,
+            "mime_type": "image/png"
+        })
+    
+    return {
+        "prompt": prompt,
+        "images": images_for_analysis
+    }
+
+def analyze_with_gemini_and_pubmed(gemini_client, original_image_pil, diagnosis_results, pubmed_context=None, pubmed_sources=None):
+    """
+    Generate concise analysis with PubMed citations for diagnosis results
+    
+    Args:
+        gemini_client: Initialized Gemini client
+        original_image_pil: PIL Image of the original chest X-ray
+        diagnosis_results: Results from diagnose_and_visualize
+        pubmed_context: Context retrieved from PubMed search
+        pubmed_sources: PubMed sources with citation information
+        
+    Returns:
+        Concise analysis with scientific citations
+    """
+    top_5_diseases = diagnosis_results['diagnosis']['top_5_diseases']
+    
+    # Create disease summary
+    diseases_summary = ""
+    for i, disease in enumerate(top_5_diseases[:3]):  # Focus on top 3
+        diseases_summary += f"{i+1}. {disease['disease']}: {disease['confidence']:.3f}\n"
+    
+    # Format PubMed citations
+    citations = ""
+    if pubmed_sources:
+        for i, source in enumerate(pubmed_sources[:3]):  # Use top 3 relevant sources
+            pmid = source.get('link', '').split('/')[-1] if source.get('link') else 'N/A'
+            citations += f"[{i+1}] {source.get('title', 'N/A')} (PMID: {pmid})\n"
+    
+    prompt = f"""You are a professional radiologist. Provide a concise analysis of the AI diagnosis results with scientific evidence from PubMed for human healthcare.
+
+**AI Results (Top 3 Human Pathologies):**
+{diseases_summary}
+
+**PubMed Context (Human Studies Only):**
+{pubmed_context if pubmed_context else "No PubMed information available"}
+
+**References:**
+{citations if citations else "No references available"}
+
+**Analysis Requirements:**
+
+1. **Clinical Assessment** (2-3 sentences):
+   - Comment on the detected pathologies in human patients
+   - Clinical significance of the findings for human health
+
+2. **Scientific Evidence** (2-3 sentences):
+   - Based on PubMed information, explain why the model produced these results for humans
+   - Cite specific evidence using [number] from human studies only
+
+3. **Recommendations** (1-2 sentences):
+   - Next steps required for human patient care
+   - Follow-up or additional testing needed for humans
+
+**Guidelines:** 
+- Keep responses concise, maximum 3 sentences per section
+- Always cite PubMed sources using [number] from human studies only
+- Do not evaluate whether confidence scores are high or low
+- Focus exclusively on human pathology and healthcare
+- Do not reference animal or veterinary studies"""
+
+    try:
+        # Convert image to bytes
+        img_buffer = io.BytesIO()
+        original_image_pil.save(img_buffer, format='JPEG')
+        img_buffer.seek(0)
+        img_bytes = img_buffer.getvalue()
+        
+        prompt_parts = [
+            prompt,
+            {
+                "mime_type": "image/jpeg",
+                "data": img_bytes
+            }
+        ]
+        
+        with stage_timer("gemini"):
+            analysis = gemini_client.model.generate_content(prompt_parts)
+        return analysis.text
+        
+    except Exception as e:
+        return f"Error getting analysis with PubMed citations: {str(e)}"
+
+def analyze_with_gemini(gemini_client, original_image_pil, diagnosis_results, output_dir=None):
+    """
+    Complete pipeline to analyze chest X-ray with Gemini
+    
+    Args:
+        gemini_client: Initialized Gemini client
+        original_image_pil: PIL Image of the original chest X-ray
+        diagnosis_results: Results from diagnose_and_visualize
+        output_dir: Optional directory to save visualizations
+        
+    Returns:
+        Gemini's comprehensive analysis
+    """
+    # Prepare analysis data
+    analysis_data = prepare_gemini_analysis_from_results(
+        original_image_pil, diagnosis_results, output_dir
+    )
+    
+    # Create multimodal prompt for Gemini
+    prompt_parts = [analysis_data["prompt"]]
+    
+    # Add images to prompt
+    for img_info in analysis_data["images"]:
+        prompt_parts.append({
+            "mime_type": img_info["mime_type"],
+            "data": img_info["data"]
+        })
+    
+    # Get Gemini's analysis
+    try:
+        with stage_timer("gemini"):
+            analysis = gemini_client.model.generate_content(prompt_parts)
+        return analysis.text
+    except Exception as e:
+        return f"Error getting Gemini analysis: {str(e)}"
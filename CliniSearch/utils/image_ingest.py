@@ -0,0 +1,216 @@
+# utils/image_ingest.py
+
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from utils.telemetry import stage_timer
+
+# Model input geometry and ImageNet normalization statistics
+MODEL_INPUT_SIZE = 224
+IMAGENET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+IMAGENET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+# Modes that hold a single luminance channel (16-bit PNGs open as 'I' or 'I;16')
+GRAYSCALE_MODES = ('1', 'L', 'LA', 'I', 'I;16', 'I;16B', 'I;16L', 'F')
+
+class XrayPreprocess:
+    """
+    Preprocessing transform equivalent to Resize((224, 224)) -> ToTensor() -> Normalize(ImageNet)
+    
+    Large uploads are shrunk before the final resize (JPEG draft decoding when the file is
+    opened here, integer Image.reduce otherwise) while keeping at least twice the target size,
+    grayscale images stay single-channel until the final tensor, and normalization is a lookup
+    from uint8 pixel values instead of float arithmetic over the whole image.
+    """
+    def __init__(self, size=MODEL_INPUT_SIZE, mean=IMAGENET_MEAN, std=IMAGENET_STD):
+        self.size = size
+        # Normalized value of every uint8 pixel value, per output channel: shape (3, 256)
+        self.lut = ((np.arange(256, dtype=np.float32)[None, :] / 255.0) - mean[:, None]) / std[:, None]
+    
+    def open(self, image_data):
+        """Open a path or encoded bytes, decoding JPEGs at reduced resolution when possible"""
+        image = Image.open(io.BytesIO(image_data) if isinstance(image_data, bytes) else image_data)
+        if image.format == 'JPEG':
+            image.draft(image.mode if image.mode in ('L', 'RGB') else None, (2 * self.size, 2 * self.size))
+        return image
+    
+    def reduce(self, image):
+        """Convert to 'L' or 'RGB' and box-downscale by an integer factor towards twice the target size"""
+        if image.mode in GRAYSCALE_MODES:
+            image = image.convert('L') if image.mode != 'L' else image
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        factor = min(image.size) // (2 * self.size)
+        if factor >= 2:
+            image = image.reduce(factor)
+        return image
+    
+    def normalize(self, image):
+        """Return the normalized (3, size, size) float32 array for a PIL image"""
+        image = self.reduce(image).resize((self.size, self.size), Image.BILINEAR)
+        pixels = np.asarray(image)
+        
+        if pixels.ndim == 2:
+            # Grayscale: index each channel's table with the same luminance plane
+            return self.lut[:, pixels]
+        return np.stack([self.lut[c][pixels[..., c]] for c in range(3)])
+    
+    def __call__(self, image):
+        """Return the normalized (3, size, size) float tensor for a PIL image"""
+        import torch
+        return torch.from_numpy(self.normalize(image))
+
+# Shared transform instance (lookup tables are built once per process)
+PREPROCESS_TRANSFORM = XrayPreprocess()
+
+
+class DecodedImage:
+    """
+    An upload decoded once into a uint8 array, from which every model input is derived.
+    
+    Pixels are stored as a (C, H, W) uint8 numpy array with C=1 for grayscale and C=3 for RGB,
+    already shrunk to at least twice the model input size. Derived inputs (the classifier
+    tensor, the BiomedCLIP tensor, ...) are computed on first use and memoized, so a
+    detect-then-analyze sequence on the same bytes pays for them once.
+    """
+    def __init__(self, digest, pixels):
+        self.digest = digest
+        self.pixels = pixels
+        self._derived = {}
+        self._lock = threading.Lock()
+    
+    @property
+    def is_grayscale(self):
+        return self.pixels.shape[0] == 1
+    
+    @property
+    def size(self):
+        """(width, height), matching PIL's convention"""
+        return self.pixels.shape[2], self.pixels.shape[1]
+    
+    def to_pil(self):
+        """Return a PIL view of the decoded pixels ('L' or 'RGB')"""
+        if self.is_grayscale:
+            return Image.fromarray(self.pixels[0], 'L')
+        return Image.fromarray(self.pixels.transpose(1, 2, 0), 'RGB')
+    
+    def derive(self, key, fn):
+        """Compute a model input once per decoded image and reuse it afterwards"""
+        with self._lock:
+            if key not in self._derived:
+                self._derived[key] = fn()
+            return self._derived[key]
+    
+    def classifier_array(self):
+        """Normalized (1, 3, 224, 224) float32 array for ChestXrayModel"""
+        def build():
+            with stage_timer("preprocess"):
+                return PREPROCESS_TRANSFORM.normalize(self.to_pil())[None]
+        return self.derive('classifier', build)
+    
+    def classifier_input(self):
+        """Normalized (1, 3, 224, 224) tensor for ChestXrayModel, sharing memory with classifier_array"""
+        import torch
+        return torch.from_numpy(self.classifier_array())
+
+def decode_image(image_bytes, digest=None):
+    """
+    Decode encoded image bytes into a DecodedImage
+    
+    Args:
+        image_bytes: Encoded image file contents
+        digest: SHA-256 hex digest of image_bytes, computed if not given
+        
+    Returns:
+        DecodedImage holding the reduced-resolution uint8 pixels
+    """
+    with stage_timer("decode"):
+        digest = digest or hashlib.sha256(image_bytes).hexdigest()
+        image = PREPROCESS_TRANSFORM.reduce(PREPROCESS_TRANSFORM.open(image_bytes))
+        pixels = np.array(image, dtype=np.uint8)
+        pixels = pixels[None] if pixels.ndim == 2 else np.ascontiguousarray(pixels.transpose(2, 0, 1))
+    return DecodedImage(digest, pixels)
+
+class IngestCache:
+    """Short-lived LRU of decoded images keyed by the SHA-256 of the uploaded bytes"""
+    def __init__(self, ttl_seconds=60.0, max_entries=32):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            expires_at, decoded = entry
+            if expires_at < time.monotonic():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return decoded
+    
+    def put(self, decoded):
+        with self._lock:
+            self._entries[decoded.digest] = (time.monotonic() + self.ttl_seconds, decoded)
+            self._entries.move_to_end(decoded.digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+INGEST_CACHE = IngestCache(
+    ttl_seconds=float(os.getenv("INGEST_CACHE_TTL", 60)),
+    max_entries=int(os.getenv("INGEST_CACHE_SIZE", 32))
+)
+
+# Pool for decoding and preprocessing many uploads in parallel (batch endpoints)
+INGEST_POOL = ThreadPoolExecutor(
+    max_workers=int(os.getenv("INGEST_WORKERS", min(8, os.cpu_count() or 1))),
+    thread_name_prefix="image-ingest"
+)
+
+def open_image(image_bytes, max_size=None):
+    """
+    Open an upload at its own resolution for display and vision-language models
+    
+    Args:
+        image_bytes: Encoded image file contents
+        max_size: Optional bound on the longest side (aspect ratio is kept)
+        
+    Returns:
+        PIL image in 'L' or 'RGB' mode, not reduced like the classifier input
+    """
+    with stage_timer("decode"):
+        image = Image.open(io.BytesIO(image_bytes))
+        if max_size:
+            # thumbnail only ever shrinks, and decodes JPEGs at a reduced scale when it can
+            image.thumbnail((max_size, max_size), Image.BICUBIC)
+        if image.mode in GRAYSCALE_MODES:
+            return image.convert('L') if image.mode != 'L' else image
+        return image.convert('RGB') if image.mode != 'RGB' else image
+
+def ingest_image(image_bytes):
+    """
+    Decode an upload once, reusing a recent decode of the same bytes
+    
+    Args:
+        image_bytes: Encoded image file contents
+        
+    Returns:
+        DecodedImage shared by every stage that needs the image
+    """
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    decoded = INGEST_CACHE.get(digest)
+    if decoded is None:
+        decoded = decode_image(image_bytes, digest)
+        INGEST_CACHE.put(decoded)
+    return decoded
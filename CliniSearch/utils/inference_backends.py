@@ -0,0 +1,264 @@
+# utils/inference_backends.py
+"""
+Pluggable inference backends for ChestXrayModel classification.
+
+A backend wraps a loaded (eval-mode) ChestXrayModel and is called like the model:
+backend(img_batch) returns the logits as a torch tensor. predict accepts either, so
+classification runs on the configured backend while GradCAM and the attention map
+keep using the eager model (they need hooks and gradients).
+
+Backends:
+    eager        plain PyTorch
+    torchscript  traced and frozen TorchScript (loaded from an export, or traced in-process)
+    compile      torch.compile
+    onnx         ONNX Runtime with all graph optimizations (loaded from an export, or
+                 exported in memory)
+
+Usage:
+    python -m utils.inference_backends export --backend onnx --output models/chest_xray_model.onnx
+    python -m utils.inference_backends parity --backends eager torchscript compile onnx
+"""
+
+import argparse
+import copy
+import inspect
+import io
+import logging
+import os
+import time
+
+import numpy as np
+import torch
+
+# Backend used for classification, and an optional pre-exported artifact for the default weights
+CLASSIFIER_BACKEND = os.getenv("CLASSIFIER_BACKEND", "eager")
+CLASSIFIER_BACKEND_PATH = os.getenv("CLASSIFIER_BACKEND_PATH")
+
+logger = logging.getLogger(__name__)
+
+INPUT_SHAPE = (3, 224, 224)
+ONNX_OPSET = 17
+
+
+def example_input(batch_size=1, device='cpu', seed=0):
+    """Fixed random input batch used for tracing, export and parity checks."""
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randn(batch_size, *INPUT_SHAPE, generator=generator).to(device)
+
+
+class EagerBackend:
+    """Plain PyTorch forward pass."""
+    name = 'eager'
+
+    def __init__(self, model, device='cpu', path=None):
+        self.model = model
+        self.device = device
+
+    def __call__(self, img_tensor):
+        with torch.no_grad():
+            return self.model(img_tensor.to(self.device))
+
+
+class TorchScriptBackend(EagerBackend):
+    """Traced and frozen TorchScript module."""
+    name = 'torchscript'
+
+    def __init__(self, model, device='cpu', path=None):
+        self.device = device
+        if path:
+            self.model = torch.jit.load(path, map_location=device).eval()
+        else:
+            self.model = trace_model(model, device)
+
+
+class CompileBackend(EagerBackend):
+    """torch.compile of the eager model; compilation happens on the first call."""
+    name = 'compile'
+
+    def __init__(self, model, device='cpu', path=None):
+        self.device = device
+        self.model = torch.compile(model)
+        # Trigger compilation now rather than on the first request
+        self(example_input(device=device))
+
+
+class OnnxBackend:
+    """ONNX Runtime session with all graph optimizations enabled."""
+    name = 'onnx'
+
+    def __init__(self, model, device='cpu', path=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ['CPUExecutionProvider']
+        if str(device).startswith('cuda') and 'CUDAExecutionProvider' in ort.get_available_providers():
+            providers.insert(0, 'CUDAExecutionProvider')
+
+        source = path if path else export_onnx_bytes(model)
+        self.session = ort.InferenceSession(source, options, providers=providers)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, img_tensor):
+        outputs = self.session.run(None, {self.input_name: img_tensor.detach().cpu().contiguous().numpy()})[0]
+        return torch.from_numpy(outputs)
+
+
+BACKENDS = {backend.name: backend for backend in (EagerBackend, TorchScriptBackend, CompileBackend, OnnxBackend)}
+
+
+def trace_model(model, device='cpu'):
+    """Trace and freeze an eval-mode model with a dynamic batch dimension."""
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example_input(device=device))
+    return torch.jit.freeze(traced)
+
+
+def onnx_export_options():
+    """
+    torch.onnx.export keyword arguments selecting the TorchScript-based exporter.
+
+    Newer torch defaults to the dynamo exporter, which does not take dynamic_axes;
+    older torch has only the TorchScript-based one and no dynamo keyword.
+    """
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        return {'dynamo': False}
+    return {}
+
+
+def export_onnx(model, output, opset=ONNX_OPSET):
+    """Export an eval-mode model to ONNX (path or file-like object) with a dynamic batch axis."""
+    # Export a CPU copy: the model may be the shared one serving GradCAM on another device
+    model = copy.deepcopy(model).cpu()
+    with torch.no_grad():
+        torch.onnx.export(
+            model, (example_input(),), output,
+            input_names=['image'], output_names=['logits'],
+            dynamic_axes={'image': {0: 'batch'}, 'logits': {0: 'batch'}},
+            opset_version=opset, **onnx_export_options()
+        )
+
+
+def export_onnx_bytes(model):
+    buffer = io.BytesIO()
+    export_onnx(model, buffer)
+    return buffer.getvalue()
+
+
+def create_backend(model, name=None, device='cpu', path=None):
+    """
+    Wrap a loaded model in an inference backend
+
+    Args:
+        model: Eval-mode ChestXrayModel
+        name: Backend name (defaults to CLASSIFIER_BACKEND)
+        device: Device to run inference on
+        path: Optional exported TorchScript/ONNX artifact for this model's weights
+
+    Returns:
+        Backend instance; falls back to eager if the requested backend cannot be built
+    """
+    name = name or CLASSIFIER_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown classifier backend '{name}'. Expected one of {sorted(BACKENDS)}")
+
+    start = time.perf_counter()
+    try:
+        backend = BACKENDS[name](model, device=device, path=path)
+    except Exception as e:
+        logger.warning("%s backend not available (%s: %s), using eager inference", name, type(e).__name__, e)
+        return EagerBackend(model, device=device)
+    print(f"Classifier backend '{name}' ready in {time.perf_counter() - start:.2f}s")
+    return backend
+
+
+def parity_report(model, backend_names, batch_sizes=(1, 8), repeats=10, device='cpu'):
+    """
+    Compare each backend against eager on fixed inputs
+
+    Args:
+        model: Eval-mode ChestXrayModel
+        backend_names: Backends to compare
+        batch_sizes: Batch sizes to time
+        repeats: Timed runs per batch size
+        device: Device to run on
+
+    Returns:
+        List of per-backend dictionaries with max probability difference, top-5
+        agreement and median latency per batch size
+    """
+    reference_input = example_input(max(batch_sizes), device=device, seed=1)
+    with torch.no_grad():
+        reference = torch.sigmoid(model(reference_input)).cpu().numpy()
+    reference_top5 = np.argsort(reference, axis=1)[:, -5:]
+
+    report = []
+    for name in backend_names:
+        backend = BACKENDS[name](model, device=device)
+        probs = torch.sigmoid(backend(reference_input)).cpu().numpy()
+        top5 = np.argsort(probs, axis=1)[:, -5:]
+
+        latency = {}
+        for batch_size in batch_sizes:
+            batch = reference_input[:batch_size]
+            backend(batch)  # Warm-up
+            timings = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                backend(batch)
+                timings.append(time.perf_counter() - start)
+            latency[batch_size] = 1000 * float(np.median(timings))
+
+        report.append({
+            'backend': name,
+            'max_abs_diff': float(np.abs(probs - reference).max()),
+            'top5_agreement': float(np.mean([set(a) == set(b) for a, b in zip(top5, reference_top5)])),
+            'median_ms': latency
+        })
+    return report
+
+
+def main():
+    from utils.model_inference import DEFAULT_MODEL_PATH, load_model
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Export the classifier for the torchscript or onnx backend')
+    export_parser.add_argument('--backend', choices=['torchscript', 'onnx'], required=True)
+    export_parser.add_argument('--model-path', default=DEFAULT_MODEL_PATH)
+    export_parser.add_argument('--output', required=True)
+
+    parity_parser = subparsers.add_parser('parity', help='Compare backends against eager on fixed inputs')
+    parity_parser.add_argument('--backends', nargs='+', choices=sorted(BACKENDS), default=sorted(BACKENDS))
+    parity_parser.add_argument('--model-path', default=DEFAULT_MODEL_PATH)
+    parity_parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8])
+    parity_parser.add_argument('--repeats', type=int, default=10)
+    parity_parser.add_argument('--tolerance', type=float, default=1e-3)
+
+    args = parser.parse_args()
+    model = load_model(args.model_path, device='cpu')
+
+    if args.command == 'export':
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        if args.backend == 'onnx':
+            export_onnx(model, args.output)
+        else:
+            torch.jit.save(trace_model(model), args.output)
+        print(f"Exported {args.backend} classifier to {args.output}")
+        print(f"Serve it with CLASSIFIER_BACKEND={args.backend} CLASSIFIER_BACKEND_PATH={args.output}")
+        return
+
+    report = parity_report(model, args.backends, batch_sizes=args.batch_sizes, repeats=args.repeats)
+    latency_headers = ''.join(f"{f'bs={b} ms':>11}" for b in args.batch_sizes)
+    print(f"{'backend':<12} {'max |dp|':>10} {'top-5 agree':>12}{latency_headers}")
+    failed = False
+    for row in report:
+        latencies = ''.join(f"{row['median_ms'][b]:>11.2f}" for b in args.batch_sizes)
+        print(f"{row['backend']:<12} {row['max_abs_diff']:>10.2e} {row['top5_agreement']:>12.0%}{latencies}")
+        failed = failed or row['max_abs_diff'] > args.tolerance
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,537 @@
+# utils/inference_service.py
+"""
+Out-of-process inference for the classifier, GradCAM, BiomedCLIP and the sentence-transformer.
+
+The service process owns the models. An API worker decodes an upload as usual, copies
+the reduced uint8 pixels into a slot of a shared-memory ring it created, and sends only
+a small JSON descriptor (slot, shape, threshold, ...) over a unix socket. The service
+maps the slot without copying, runs the models, writes the result arrays (probabilities,
+CAM grids, attention map) back into the same slot and replies with their layout.
+Thresholding, overlays and figure rendering stay in the API worker
+(see diagnosis_from_grids), so inference processes scale independently of HTTP workers
+and API workers never import torch. Document and query embeddings for the vector stores
+are requested with the texts inline and returned in the reply (RemoteEmbedder).
+
+Run a service (several can be listed in INFERENCE_SERVICE_SOCKET, comma-separated):
+    python -m utils.inference_service --socket /tmp/clinisearch-inference.sock --threads 2
+"""
+
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils.lazy_resources import ResourceUnavailable
+from utils.telemetry import stage_timer
+
+# Unix socket(s) of running inference services; empty = run models in the API process
+INFERENCE_SERVICE_SOCKET = os.getenv("INFERENCE_SERVICE_SOCKET", "")
+INFERENCE_SERVICE_TIMEOUT = float(os.getenv("INFERENCE_SERVICE_TIMEOUT", 120))
+# Shared-memory ring owned by each API worker: slots bound concurrent requests and the
+# largest decoded image (pixels are already reduced to about twice the model input size)
+INFERENCE_SHM_SLOTS = int(os.getenv("INFERENCE_SHM_SLOTS", 8))
+INFERENCE_SHM_SLOT_MB = float(os.getenv("INFERENCE_SHM_SLOT_MB", 8))
+
+PROTOCOL_VERSION = 2
+_ALIGNMENT = 64
+
+
+def write_arrays(buffer, arrays):
+    """
+    Copy named arrays into a shared-memory slot back to back.
+
+    Args:
+        buffer: memoryview of the slot
+        arrays: Dictionary of name -> numpy array
+
+    Returns:
+        Layout list of {name, offset, shape, dtype} for read_arrays
+    """
+    layout = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        if offset + array.nbytes > len(buffer):
+            raise ValueError(f"{name} ({array.nbytes} bytes) does not fit in a {len(buffer)}-byte slot; "
+                             f"increase INFERENCE_SHM_SLOT_MB")
+        np.ndarray(array.shape, dtype=array.dtype, buffer=buffer, offset=offset)[...] = array
+        layout.append({"name": name, "offset": offset, "shape": list(array.shape), "dtype": array.dtype.str})
+        offset += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+    return layout
+
+
+def read_arrays(buffer, layout, copy=True):
+    """Arrays described by a write_arrays layout; copy=False returns views into the slot."""
+    arrays = {}
+    for entry in layout:
+        array = np.ndarray(tuple(entry["shape"]), dtype=np.dtype(entry["dtype"]), buffer=buffer, offset=entry["offset"])
+        arrays[entry["name"]] = array.copy() if copy else array
+    return arrays
+
+
+class SharedRing:
+    """Fixed-size slots in one shared-memory block."""
+    def __init__(self, num_slots, slot_bytes, name=None):
+        self.num_slots = num_slots
+        self.slot_bytes = slot_bytes
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(
+            name=name or f"clinisearch-{os.getpid()}-{uuid.uuid4().hex[:8]}",
+            create=self.owner,
+            size=num_slots * slot_bytes if self.owner else 0
+        )
+        if not self.owner:
+            # Attaching registers the block with this process' resource tracker, which
+            # would unlink it when the service exits; only the creating API worker unlinks it
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+            except Exception:
+                pass
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def slot(self, index):
+        start = index * self.slot_bytes
+        return self.shm.buf[start:start + self.slot_bytes]
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            # A view is still referenced somewhere; the mapping goes away with the process
+            return
+        if self.owner:
+            self.shm.unlink()
+
+
+# Service side
+
+def heatmap_class_indices(probabilities, threshold, top_n=5):
+    """Classes that need a CAM grid: the first top_n of the top 5 plus every class at or above threshold."""
+    top_5 = np.argsort(probabilities)[-5:][::-1]
+    above = np.flatnonzero(probabilities >= threshold)
+    return sorted(set(int(i) for i in top_5[:top_n]) | set(int(i) for i in above))
+
+
+def run_diagnosis(decoded_image, threshold, model_path=None, device='cpu', gradcam_top_n=5):
+    """
+    Model-side part of diagnose_and_visualize: probabilities, CAM grids and attention map.
+
+    CAM grids are computed only for the classes the client renders: every predicted
+    class plus the first gradcam_top_n of the top 5.
+
+    Returns:
+        (arrays, metadata) where arrays hold probabilities (num_classes,), cam_grids
+        (K, 7, 7) and attention_map (7, 7), and metadata lists the K class indices
+    """
+    from utils.model_inference import get_backend, get_model, heatmap_grids, image_activations, model_lock, preprocess_image
+
+    model = get_model(model_path, device=device)
+    if model is None:
+        raise RuntimeError("Model inference test failed")
+    backend = get_backend(model_path, device=device)
+    img_tensor = preprocess_image(decoded_image)
+
+    with model_lock(model):
+        activations = image_activations(model, backend, decoded_image, img_tensor, model_path, device)
+        # Rank the float32 probabilities the client receives, so both sides pick the same top 5
+        probabilities = activations.probabilities.astype(np.float32)
+        class_indices = heatmap_class_indices(probabilities, threshold, gradcam_top_n)
+        cam_grids, attention_map = heatmap_grids(model, img_tensor, class_indices, activations, device)
+
+    arrays = {
+        "probabilities": probabilities,
+        "cam_grids": np.stack([cam_grids[idx] for idx in class_indices]).astype(np.float32),
+        "attention_map": np.asarray(attention_map, dtype=np.float32)
+    }
+    return arrays, {"cam_classes": class_indices}
+
+
+class InferenceService:
+    """Models and request handling of one inference service process."""
+    def __init__(self, threads=2, device='cpu'):
+        from utils.lazy_resources import register_resource
+        from utils.model_inference import CLASSIFIER_MODEL
+        from utils.rag_processing import EMBEDDING_MODEL
+        from utils.xray_detection import load_xray_detector
+
+        self.device = device
+        self.classifier = CLASSIFIER_MODEL
+        self.xray_detector = register_resource("biomedclip", load_xray_detector)
+        self.embedding_model = EMBEDDING_MODEL
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="inference-service")
+        self.requests_served = 0
+
+    def status(self):
+        from utils.lazy_resources import resource_status
+        return {"pid": os.getpid(), "requests_served": self.requests_served, "resources": resource_status()}
+
+    def decoded_image(self, ring, message):
+        """DecodedImage whose pixels are a zero-copy view of the request's slot."""
+        from utils.image_ingest import DecodedImage
+
+        pixels = read_arrays(ring.slot(message["slot"]), message["inputs"], copy=False)["pixels"]
+        return DecodedImage(message.get("digest"), pixels)
+
+    def handle(self, ring, message):
+        """Run one request; results are written into the request's slot."""
+        op = message["op"]
+        if op == "status":
+            return {"status": self.status()}
+        if op == "embed":
+            # Texts and embeddings travel in the messages: a document batch may not fit a slot
+            embeddings = np.asarray(self.embedding_model.encode(message["texts"], convert_to_tensor=False), dtype=np.float32)
+            self.requests_served += 1
+            return {"embeddings": base64.b64encode(embeddings.tobytes()).decode(), "shape": list(embeddings.shape)}
+
+        decoded_image = self.decoded_image(ring, message)
+        if op == "diagnose":
+            if not message.get("model_path"):
+                self.classifier.get()
+            arrays, metadata = run_diagnosis(
+                decoded_image, message["threshold"], message.get("model_path"), self.device,
+                message.get("gradcam_top_n", 5)
+            )
+        elif op == "xray_probability":
+            probability = self.xray_detector.get().xray_probability(decoded_image)
+            arrays, metadata = {"xray_probability": np.array([probability], dtype=np.float32)}, {}
+        else:
+            raise ValueError(f"Unknown op: {op}")
+
+        # The pixels have been consumed; the results overwrite them in the same slot
+        del decoded_image
+        self.requests_served += 1
+        return {"outputs": write_arrays(ring.slot(message["slot"]), arrays), **metadata}
+
+
+class _ConnectionHandler(socketserver.StreamRequestHandler):
+    """One API worker connection: a hello handshake, then pipelined requests answered by id."""
+    def handle(self):
+        service = self.server.service
+        ring = None
+        write_lock = threading.Lock()
+
+        def reply(payload):
+            with write_lock:
+                self.wfile.write((json.dumps(payload) + "\n").encode())
+                self.wfile.flush()
+
+        def run(message):
+            started_at = time.perf_counter()
+            try:
+                result = service.handle(ring, message)
+                reply({"id": message["id"], "ok": True, "seconds": time.perf_counter() - started_at, **result})
+            except Exception as e:
+                reply({
+                    "id": message["id"], "ok": False, "error": f"{type(e).__name__}: {e}",
+                    "unavailable": isinstance(e, ResourceUnavailable)
+                })
+
+        try:
+            for line in self.rfile:
+                message = json.loads(line)
+                if message["op"] == "hello":
+                    if message.get("protocol") != PROTOCOL_VERSION:
+                        reply({"id": message["id"], "ok": False, "error": f"protocol {PROTOCOL_VERSION} required"})
+                        return
+                    ring = SharedRing(message["slots"], message["slot_bytes"], name=message["shm"])
+                    reply({"id": message["id"], "ok": True, "status": service.status()})
+                elif ring is None:
+                    reply({"id": message["id"], "ok": False, "error": "hello required"})
+                else:
+                    service.pool.submit(run, message)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if ring is not None:
+                ring.close()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path, threads=2, device='cpu', preload=True):
+    """Run an inference service on a unix socket until interrupted."""
+    from utils.lazy_resources import start_background_loading
+    from utils.runtime_config import configure_runtime
+
+    configure_runtime()
+    service = InferenceService(threads=threads, device=device)
+    if preload:
+        start_background_loading()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    with _UnixServer(socket_path, _ConnectionHandler) as server:
+        server.service = service
+        print(f"Inference service listening on {socket_path} (pid {os.getpid()}, {threads} threads)")
+        # Exit through the finally below on SIGTERM as well, so the socket file is removed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+
+
+# API side
+
+class _ServiceConnection:
+    """Pipelined connection to one inference service."""
+    def __init__(self, path):
+        self.path = path
+        self.reader = None
+        self.writer = None
+        self.pending = {}
+        self.ids = itertools.count()
+        self.status = None
+        self._reader_task = None
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self, ring):
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self._reader_task = asyncio.create_task(self._read_replies())
+        reply = await self.request({
+            "op": "hello", "protocol": PROTOCOL_VERSION,
+            "shm": ring.name, "slots": ring.num_slots, "slot_bytes": ring.slot_bytes
+        })
+        self.status = reply["status"]
+
+    async def _read_replies(self):
+        try:
+            async for line in self.reader:
+                reply = json.loads(line)
+                future = self.pending.pop(reply["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        finally:
+            error = ConnectionError(f"Inference service at {self.path} closed the connection")
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.pending.clear()
+            self.writer.close()
+
+    def send(self, message):
+        """Write a request; returns the future of its reply, which stays pending until the service answers."""
+        message = {**message, "id": next(self.ids)}
+        future = asyncio.get_running_loop().create_future()
+        self.pending[message["id"]] = future
+        self.writer.write((json.dumps(message) + "\n").encode())
+        return future
+
+    async def reply(self, future):
+        """Await the reply to a sent request; a timeout or cancellation leaves the future itself pending."""
+        await self.writer.drain()
+        reply = await asyncio.wait_for(asyncio.shield(future), INFERENCE_SERVICE_TIMEOUT)
+        if not reply["ok"]:
+            if reply.get("unavailable"):
+                # A model of the service failed to load, as opposed to this request failing
+                raise ResourceUnavailable(f"Inference service: {reply['error']}")
+            raise RuntimeError(f"Inference service error: {reply['error']}")
+        return reply
+
+    async def request(self, message):
+        return await self.reply(self.send(message))
+
+
+class InferenceClient:
+    """
+    API-side handle to one or more inference services.
+
+    Created from INFERENCE_SERVICE_SOCKET; when no socket is configured, enabled is False
+    and the API runs the models in-process as before.
+    """
+    def __init__(self, socket_paths=INFERENCE_SERVICE_SOCKET, num_slots=INFERENCE_SHM_SLOTS,
+                 slot_mb=INFERENCE_SHM_SLOT_MB):
+        self.socket_paths = [path.strip() for path in socket_paths.split(",") if path.strip()]
+        self.num_slots = num_slots
+        self.slot_bytes = int(slot_mb * 1024 * 1024)
+        self.ring = None
+        self.connections = [_ServiceConnection(path) for path in self.socket_paths]
+        self._free_slots = None
+        self._quarantined = set()
+        self._connect_lock = None
+        self.loop = None
+
+    @property
+    def enabled(self):
+        return bool(self.socket_paths)
+
+    async def _ensure_ring(self):
+        if self.ring is None:
+            self.loop = asyncio.get_running_loop()
+            self.ring = SharedRing(self.num_slots, self.slot_bytes)
+            self._free_slots = asyncio.Queue()
+            for index in range(self.num_slots):
+                self._free_slots.put_nowait(index)
+            self._connect_lock = asyncio.Lock()
+
+    async def connect(self):
+        """Open the shared-memory ring and connect to every service that is reachable."""
+        await self._ensure_ring()
+        async with self._connect_lock:
+            for connection in self.connections:
+                if not connection.connected:
+                    try:
+                        await connection.connect(self.ring)
+                    except (OSError, RuntimeError) as e:
+                        print(f"Warning: inference service {connection.path} not available: {e}")
+
+    async def _connection(self):
+        connected = [connection for connection in self.connections if connection.connected]
+        if not connected:
+            await self.connect()
+            connected = [connection for connection in self.connections if connection.connected]
+            if not connected:
+                raise ConnectionError("No inference service is reachable")
+        # Least outstanding requests first
+        return min(connected, key=lambda connection: len(connection.pending))
+
+    async def _call(self, op, decoded_image, **params):
+        """Send one image through a free slot and return (reply, result arrays)."""
+        await self._ensure_ring()
+        pixels = decoded_image.pixels
+        if pixels.nbytes > self.slot_bytes:
+            raise ValueError(f"Decoded image ({pixels.nbytes} bytes) exceeds INFERENCE_SHM_SLOT_MB")
+
+        connection = await self._connection()
+        index = await self._free_slots.get()
+        slot = self.ring.slot(index)
+        future = None
+        try:
+            with stage_timer("inference_service"):
+                inputs = write_arrays(slot, {"pixels": pixels})
+                future = connection.send({
+                    "op": op, "slot": index, "inputs": inputs, "digest": decoded_image.digest, **params
+                })
+                reply = await connection.reply(future)
+                return reply, read_arrays(slot, reply["outputs"])
+        finally:
+            slot.release()
+            if future is not None and not future.done():
+                # Timed out or cancelled while the service still works on the request: it
+                # writes its results into this slot later, so the slot is not handed to
+                # another request until the service has replied (or the connection is lost)
+                self._quarantined.add(index)
+                future.add_done_callback(lambda done: self._release_quarantined(index, done))
+            else:
+                self._free_slots.put_nowait(index)
+
+    def _release_quarantined(self, index, future):
+        if not future.cancelled():
+            # Retrieve a connection error so it is not reported as never retrieved
+            future.exception()
+        self._quarantined.discard(index)
+        self._free_slots.put_nowait(index)
+
+    async def diagnose(self, decoded_image, model_path=None, threshold=0.4, output_dir=None, render_pool=None, gradcam_top_n=5):
+        """diagnose_and_visualize with the models run by the inference service."""
+        from utils.executors import run_cpu
+        from utils.diagnosis import diagnosis_from_grids
+
+        reply, arrays = await self._call(
+            "diagnose", decoded_image, threshold=threshold, model_path=model_path, gradcam_top_n=gradcam_top_n
+        )
+        cam_grids = dict(zip(reply["cam_classes"], arrays["cam_grids"]))
+        return await run_cpu(
+            diagnosis_from_grids, decoded_image, arrays["probabilities"], cam_grids, arrays["attention_map"],
+            output_dir=output_dir, threshold=threshold, render_pool=render_pool, gradcam_top_n=gradcam_top_n
+        )
+
+    async def xray_probability(self, decoded_image):
+        """BiomedCLIP X-ray probability computed by the inference service."""
+        _, arrays = await self._call("xray_probability", decoded_image)
+        return float(arrays["xray_probability"][0])
+
+    async def embed(self, texts):
+        """Sentence-transformer embeddings computed by the inference service, shape (len(texts), dimension)."""
+        connection = await self._connection()
+        with stage_timer("inference_service"):
+            reply = await connection.request({"op": "embed", "texts": list(texts)})
+        return np.frombuffer(base64.b64decode(reply["embeddings"]), dtype=np.float32).reshape(reply["shape"])
+
+    def describe(self):
+        return {
+            "enabled": self.enabled,
+            "shm_slots": self.num_slots,
+            "shm_slot_bytes": self.slot_bytes,
+            "free_slots": self._free_slots.qsize() if self._free_slots is not None else None,
+            "quarantined_slots": len(self._quarantined),
+            "services": [
+                {"socket": c.path, "connected": c.connected, "in_flight": len(c.pending), "status": c.status}
+                for c in self.connections
+            ]
+        }
+
+    def close(self):
+        for connection in self.connections:
+            if connection.writer is not None:
+                connection.writer.close()
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+
+class RemoteEmbedder:
+    """
+    Stand-in for the sentence-transformer resource whose encode runs on the inference service.
+
+    encode blocks like SentenceTransformer.encode and is called from executor threads
+    (VectorStore runs on run_cpu); the request itself goes out on the client's event loop.
+    """
+    def __init__(self, client):
+        self.client = client
+
+    async def wait(self):
+        """Counterpart of LazyResource.wait: make sure a service connection is open."""
+        if not any(connection.connected for connection in self.client.connections):
+            await self.client.connect()
+        return self
+
+    def encode(self, sentences, convert_to_tensor=False):
+        loop = self.client.loop
+        if loop is None:
+            raise ConnectionError("Inference service is not connected")
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            raise RuntimeError("RemoteEmbedder.encode blocks; call it from an executor thread")
+        return asyncio.run_coroutine_threadsafe(self.client.embed(sentences), loop).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socket', default=INFERENCE_SERVICE_SOCKET.split(",")[0] or "/tmp/clinisearch-inference.sock")
+    parser.add_argument('--threads', type=int, default=2, help='Requests processed concurrently')
+    parser.add_argument('--device', default='cpu')
+    parser.add_argument('--no-preload', action='store_true', help='Load each model on first use')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    serve(args.socket, threads=args.threads, device=args.device, preload=not args.no_preload)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+# utils/lazy_resources.py
+
+import asyncio
+import threading
+import time
+
+# Loads run one at a time: concurrent first imports of torchvision/transformers from
+# several threads can deadlock on Python's module locks
+_LOAD_LOCK = threading.Lock()
+
+
+class ResourceUnavailable(RuntimeError):
+    """Raised by LazyResource.get when the resource failed to load."""
+
+
+class LazyResource:
+    """
+    A heavy resource (model, tokenizer, ...) that is loaded at most once.
+
+    Loading starts either in a background thread at application startup (start) or in the
+    calling thread on first use (get). Attribute access is forwarded to the loaded object,
+    so a LazyResource can stand in for the object it wraps; async code should await wait()
+    first so the event loop is not blocked while the resource is still loading.
+    """
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._value = None
+        self._error = None
+        self._started = False
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self.load_seconds = None
+
+    def _claim(self):
+        """Mark loading as started; True if the caller should perform the load."""
+        with self._lock:
+            if self._started:
+                return False
+            self._started = True
+            return True
+
+    def _load(self):
+        with _LOAD_LOCK:
+            started_at = time.perf_counter()
+            try:
+                self._value = self._loader()
+                print(f"Loaded {self.name} in {time.perf_counter() - started_at:.2f}s")
+            except Exception as e:
+                self._error = e
+                print(f"Warning: {self.name} not available: {e}")
+            finally:
+                self.load_seconds = time.perf_counter() - started_at
+                self._ready.set()
+
+    def start(self):
+        """Start loading in a background thread (no-op if loading already started)."""
+        if self._claim():
+            threading.Thread(target=self._load, name=f"load-{self.name}", daemon=True).start()
+
+    def get(self):
+        """Return the loaded resource, blocking until it is ready."""
+        if self._claim():
+            self._load()
+        self._ready.wait()
+        if self._error is not None:
+            raise ResourceUnavailable(f"{self.name} is not available: {self._error}") from self._error
+        return self._value
+
+    async def wait(self):
+        """Await the loaded resource without blocking the event loop."""
+        self.start()
+        if not self._ready.is_set():
+            await asyncio.get_running_loop().run_in_executor(None, self._ready.wait)
+        return self.get()
+
+    @property
+    def status(self):
+        if not self._started:
+            return "not_started"
+        if not self._ready.is_set():
+            return "loading"
+        return "failed" if self._error is not None else "ready"
+
+    @property
+    def available(self):
+        """True once the resource has loaded successfully."""
+        return self.status == "ready"
+
+    def describe(self):
+        return {
+            "status": self.status,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "error": str(self._error) if self._error is not None else None
+        }
+
+    def __getattr__(self, attr):
+        # Only reached for attributes not defined on the handle itself
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.get(), attr)
+
+
+# Registry of the process-wide heavy resources
+RESOURCES = {}
+
+
+def register_resource(name, loader):
+    """Create and register a LazyResource under a stable name."""
+    resource = LazyResource(name, loader)
+    RESOURCES[name] = resource
+    return resource
+
+
+def _load_in_order(resources):
+    for resource in resources:
+        if resource._claim():
+            resource._load()
+
+
+def start_background_loading():
+    """Load every registered resource, in registration order, on a background thread."""
+    threading.Thread(
+        target=_load_in_order, args=(list(RESOURCES.values()),), name="load-resources", daemon=True
+    ).start()
+
+
+def resource_status():
+    """Per-resource status and load timings, for health and diagnostics endpoints."""
+    return {name: resource.describe() for name, resource in RESOURCES.items()}
@@ -2,21 +2,48 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import numpy as np
-import matplotlib.pyplot as plt
-from PIL import Image
-import cv2
-import io
 import base64
-from torchvision import transforms 
 from copy import deepcopy
-import json
 from pathlib import Path
 import os
-
-# Define disease labels
-disease_labels = ['Atelectasis', 'Consolidation', 'Infiltration', 'Pneumothorax', 
-                 'Edema', 'Emphysema', 'Fibrosis', 'Effusion', 'Pneumonia', 
-                 'Pleural_Thickening', 'Cardiomegaly', 'Nodule', 'Mass', 'Hernia']
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from utils.image_ingest import DecodedImage
+from utils.diagnosis import (
+    INFERENCE_PRECISION, DEFAULT_MODEL_PATH, is_torchscript_archive, resolve_model_path, model_version,
+    predictions_from_probabilities, upsample_cam, preprocess_array, denormalize_array, gradcam_from_grids, gradcam_top5_from_grids, attention_from_map,
+    format_diagnosis_results
+)
+from utils.lazy_resources import register_resource
+from utils.inference_backends import CLASSIFIER_BACKEND_PATH, create_backend
+from utils.telemetry import stage_timer
+
+# Thresholding, overlays and figure rendering live in utils.diagnosis, which does not
+# import torch; this module runs the classifier, GradCAM and the attention map
+
+# Inference numerics: fp32 or bf16 autocast, NCHW (contiguous) or NHWC (channels_last) tensors
+INFERENCE_MEMORY_FORMAT = os.getenv("INFERENCE_MEMORY_FORMAT", "contiguous")
+PRECISIONS = {'fp32': None, 'bf16': torch.bfloat16}
+MEMORY_FORMATS = {'contiguous': torch.contiguous_format, 'channels_last': torch.channels_last}
+if INFERENCE_PRECISION not in PRECISIONS:
+    raise ValueError(f"INFERENCE_PRECISION must be one of {sorted(PRECISIONS)}")
+if INFERENCE_MEMORY_FORMAT not in MEMORY_FORMATS:
+    raise ValueError(f"INFERENCE_MEMORY_FORMAT must be one of {sorted(MEMORY_FORMATS)}")
+
+def apply_memory_format(model, memory_format=None):
+    """Convert an eager model's weights to the inference memory format (in place)"""
+    return model.to(memory_format=MEMORY_FORMATS[memory_format or INFERENCE_MEMORY_FORMAT])
+
+def prepare_input(img_tensor, device, memory_format=None):
+    """Move an image batch to the device in the inference memory format"""
+    return img_tensor.to(device, memory_format=MEMORY_FORMATS[memory_format or INFERENCE_MEMORY_FORMAT])
+
+def inference_autocast(device, precision=None):
+    """Autocast context for the inference precision (a no-op for fp32)"""
+    dtype = PRECISIONS[precision or INFERENCE_PRECISION]
+    return torch.autocast(device_type=torch.device(device).type, dtype=dtype or torch.bfloat16, enabled=dtype is not None)
 
 # Model Configuration class
 class ModelConfig:
@@ -112,51 +139,23 @@ class MemoryBank(nn.Module):
 
     def retrieve(self, query, k=None):
         k = k if k is not None else ModelConfig.RETRIEVAL_K
-        valid_memory = self.memory
-        if valid_memory.size(0) == 0:
+        if self.bank_size == 0:
             return torch.zeros_like(query)
         
         norm_query = F.normalize(query, dim=1)
-        norm_memory = F.normalize(valid_memory, dim=1)
+        norm_memory = F.normalize(self.memory, dim=1)
         similarity = torch.matmul(norm_query, norm_memory.T)
         
-        # Create a mask for entries where similarity != 1
-        mask = similarity != 1.0
-        
-        k = min(k, valid_memory.size(0))
+        # Entries with similarity == 1 are excluded from retrieval
+        similarity = similarity.masked_fill(similarity == 1.0, float('-inf'))
         
-        # Initialize containers for results
-        batch_size = query.size(0)
-        result = torch.zeros_like(query)
+        # Top-k over the whole batch at once; excluded entries that still land in the
+        # top-k (fewer than k valid memories) get zero weight
+        weights, indices = similarity.topk(min(k, self.bank_size), dim=1)
+        weights = torch.where(torch.isinf(weights), torch.zeros_like(weights), weights)
         
-        for i in range(batch_size):
-            # Get indices where similarity is not 1 for this query
-            valid_indices = torch.where(mask[i])[0]
-            
-            if len(valid_indices) == 0:
-                # If all memories have similarity=1, just return zeros
-                continue
-            
-            # Get similarities only for valid indices
-            valid_similarities = similarity[i, valid_indices]
-            
-            # Get top-k among valid similarities
-            k_valid = min(k, valid_similarities.size(0))
-            weights, rel_indices = valid_similarities.topk(k_valid)
-            
-            # Convert relative indices to absolute indices
-            abs_indices = valid_indices[rel_indices]
-            
-            # Get features for these indices
-            retrieved = valid_memory[abs_indices]
-            
-            # Apply weights
-            weights = weights.unsqueeze(1).expand_as(retrieved)
-            weighted_features = (retrieved * weights).sum(dim=0)
-            
-            result[i] = weighted_features
-            
-        return result
+        retrieved = self.memory[indices]  # [batch_size, k, feature_dim]
+        return (retrieved * weights.unsqueeze(-1)).sum(dim=1)
 
 # Main Model
 class ChestXrayModel(nn.Module):
@@ -220,21 +219,25 @@ class ChestXrayModel(nn.Module):
         )
         self.model_name = model_name
 
-    def forward(self, x):
+    def forward_features(self, x):
+        """Final block activations (the GradCAM target) and pooled momentum features"""
         # Extract features
         backbone_features = self.backbone(x)
         main_features = self.final_block(backbone_features)
         with torch.no_grad():
             momentum_features = self.momentum_final_block(backbone_features)
 
+        # Momentum features
+        momentum_pooled = F.adaptive_avg_pool2d(momentum_features, (1, 1)).flatten(1)
+        return main_features, momentum_pooled
+
+    def forward_head(self, main_features, momentum_pooled):
+        """Logits from forward_features outputs; GradCAM only needs to backpropagate through this"""
         # Spatial attention and ROI extraction
         attention_map = self.spatial_attention(main_features)
         roi_features = main_features * attention_map
         roi_pooled = F.adaptive_avg_pool2d(roi_features, (1, 1)).flatten(1)
 
-        # Momentum features
-        momentum_pooled = F.adaptive_avg_pool2d(momentum_features, (1, 1)).flatten(1)
-
         # Combine ROI and momentum features (simple addition)
         fused_features = roi_pooled + momentum_pooled
 
@@ -248,7 +251,10 @@ class ChestXrayModel(nn.Module):
         enhanced_features = fused_features + memory_features
 
         # Classification
-        out = self.classifier(enhanced_features)
+        return self.classifier(enhanced_features)
+
+    def forward(self, x):
+        out = self.forward_head(*self.forward_features(x))
 
         # Update momentum encoder during training
         if self.training:
@@ -298,46 +304,100 @@ class GradCAMExtractor:
         for hook in self.hooks:
             hook.remove()
             
-    def generate_cam(self, input_tensor, class_idx=None):
-        """
-        Generate GradCAM heatmap
+    def generate_cam_grid(self, input_tensor, class_idx=None):
         """
-        self.model.eval()
-        self.register_hooks()
-        
-        output = self.model(input_tensor)
-        
-        if class_idx is None:
-            class_idx = output.argmax(dim=1).item()
+        Generate the GradCAM heatmap at the target layer resolution (7x7 for 224 inputs)
         
-        self.model.zero_grad()
-        if output.shape[1] > 1:  # Multi-class case
-            class_score = output[0, class_idx]
-        else:  # Single class case
-            class_score = output[0]
+        The grid is rectified and scaled to [0, 1] by its maximum but not upsampled,
+        so upsample_cam reproduces exactly the heatmap returned by generate_cam.
+        """
+        with stage_timer("gradcam"):
+            self.model.eval()
+            self.register_hooks()
             
-        class_score.backward(retain_graph=True)
-        
-        gradients = self.gradients[0].cpu().data.numpy()
-        activations = self.activations[0].cpu().data.numpy()
-        
-        weights = np.mean(gradients, axis=(1, 2))
-        
-        cam = np.zeros(activations.shape[1:], dtype=np.float32)
-        for i, w in enumerate(weights):
-            cam += w * activations[i]
+            device = next(self.model.parameters()).device
+            with inference_autocast(device):
+                output = self.model(prepare_input(input_tensor, device))
+            
+            if class_idx is None:
+                class_idx = output.argmax(dim=1).item()
+            
+            self.model.zero_grad()
+            if output.shape[1] > 1:  # Multi-class case
+                class_score = output[0, class_idx]
+            else:  # Single class case
+                class_score = output[0]
+                
+            class_score.backward(retain_graph=True)
+            
+            gradients = self.gradients[0].float().cpu().data.numpy()
+            activations = self.activations[0].float().cpu().data.numpy()
+            cam = cam_from_gradients(gradients, activations)
+            
+            self.remove_hooks()
         
-        cam = np.maximum(cam, 0)
-        cam = cv2.resize(cam, (224, 224))
-        cam = cam - np.min(cam)
-        cam = cam / np.max(cam) if np.max(cam) > 0 else cam
+        return cam, output.float().sigmoid()
+    
+    def generate_cam(self, input_tensor, class_idx=None):
+        """
+        Generate GradCAM heatmap
+        """
+        cam_grid, output = self.generate_cam_grid(input_tensor, class_idx=class_idx)
+        return upsample_cam(cam_grid), output
+
+def cam_from_gradients(gradients, activations):
+    """
+    GradCAM grid from one image's target-layer gradients and activations
+    
+    Args:
+        gradients: Numpy array of shape (C, H, W)
+        activations: Numpy array of shape (C, H, W)
         
-        self.remove_hooks()
+    Returns:
+        Rectified (H, W) grid scaled to [0, 1] by its maximum
+    """
+    weights = np.mean(gradients, axis=(1, 2))
+    
+    cam = np.zeros(activations.shape[1:], dtype=np.float32)
+    for i, w in enumerate(weights):
+        cam += w * activations[i]
+    
+    cam = np.maximum(cam, 0)
+    return cam / np.max(cam) if np.max(cam) > 0 else cam
+
+def cam_grids_from_features(model, features, momentum_pooled, class_indices, device='cuda' if torch.cuda.is_available() else 'cpu'):
+    """
+    GradCAM grids for several classes from cached forward_features outputs
+    
+    Runs the model head once and backpropagates each class score to the final block
+    activations, which gives the same gradients as hook-based GradCAM on the full model
+    without re-running the backbone.
+    
+    Args:
+        model: The ChestXrayModel instance
+        features: Final block activations (1, C, H, W)
+        momentum_pooled: Pooled momentum features (1, C)
+        class_indices: Classes to explain
+        device: Device to run on
         
-        return cam, output.sigmoid()
+    Returns:
+        Dictionary mapping class index to its (H, W) CAM grid
+    """
+    features = features.detach().to(device).requires_grad_(True)
+    with stage_timer("forward"), torch.enable_grad(), inference_autocast(device):
+        output = model.forward_head(features, momentum_pooled.to(device))
+    
+    activations = features[0].detach().float().cpu().numpy()
+    grids = {}
+    for n, class_idx in enumerate(class_indices):
+        with stage_timer("gradcam"):
+            gradients, = torch.autograd.grad(output[0, class_idx], features, retain_graph=n < len(class_indices) - 1)
+            grids[class_idx] = cam_from_gradients(gradients[0].float().cpu().numpy(), activations)
+    return grids
 
 # Helper functions for model inference and visualization
-def load_model(model_path=None, num_classes=14, device='cuda' if torch.cuda.is_available() else 'cpu'):
+def load_model(model_path=None, num_classes=14, device='cuda' if torch.cuda.is_available() else 'cpu',
+               require_weights=False):
     """
     Load the ChestXrayModel with pretrained weights
     Enhanced to handle FastAI learner format and standalone format
@@ -346,10 +406,20 @@ def load_model(model_path=None, num_classes=14, device='cuda' if torch.cuda.is_a
         model_path: Path to the model weights
         num_classes: Number of disease classes (default: 14)
         device: Device to load the model on
+        require_weights: Raise instead of falling back to random initialization when
+            the weights are missing or cannot be loaded
         
     Returns:
         Loaded model instance
     """
+    if model_path and is_torchscript_archive(model_path):
+        # Serialized TorchScript (e.g. the INT8 model from utils/quantization.py): classification only
+        # (bulk scoring); get_model rejects it for diagnosis, see resolve_model_path
+        print(f"Loading TorchScript model from: {model_path}")
+        model = torch.jit.load(model_path, map_location=device)
+        model.eval()
+        return model
+    
     print(f"Loading model for {num_classes} classes on {device}")
     model = ChestXrayModel(num_classes=num_classes, model_name='efficientnet_b0')
     
@@ -407,15 +477,251 @@ def load_model(model_path=None, num_classes=14, device='cuda' if torch.cuda.is_a
             print(f"✅ Model weights loaded successfully from {model_path}")
             
         except Exception as e:
+            if require_weights:
+                raise RuntimeError(f"Could not load model weights from {model_path}: {e}") from e
             print(f"❌ Error loading model weights: {e}")
             print("🔄 Using model with random initialization instead")
     else:
+        if require_weights:
+            raise FileNotFoundError(f"Model weights not found: {model_path}")
         print("No model weights loaded. Using model with random initialization.")
     
-    model = model.to(device)
+    model = apply_memory_format(model.to(device))
     model.eval()
     return model
 
+# Loaded models and their classification backends, keyed by (model_path, device), so
+# weights are read once per process. Request-named weights beyond MODEL_CACHE_SIZE are
+# evicted least recently used first; the default weights stay loaded
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", 2))
+_MODEL_CACHE = OrderedDict()
+_BACKEND_CACHE = {}
+_MODEL_CACHE_LOCK = threading.Lock()
+
+# One lock per key, so a slow load (or backend export) of one set of weights does not
+# block requests for others; concurrent requests for the same weights load them once
+_LOAD_LOCKS = {}
+
+def _load_lock(key):
+    with _MODEL_CACHE_LOCK:
+        return _LOAD_LOCKS.setdefault(key, threading.Lock())
+
+def _cached(cache, key):
+    with _MODEL_CACHE_LOCK:
+        if key in _MODEL_CACHE:
+            _MODEL_CACHE.move_to_end(key)
+        return cache.get(key)
+
+def _cache_model(key, model):
+    with _MODEL_CACHE_LOCK:
+        _MODEL_CACHE[key] = model
+        evictable = [cached_key for cached_key in _MODEL_CACHE if cached_key[0] != DEFAULT_MODEL_PATH]
+        for evicted_key in evictable[:max(0, len(evictable) - MODEL_CACHE_SIZE)]:
+            del _MODEL_CACHE[evicted_key]
+            _BACKEND_CACHE.pop(evicted_key, None)
+            _LOAD_LOCKS.pop(evicted_key, None)
+
+def get_model(model_path=None, device='cuda' if torch.cuda.is_available() else 'cpu'):
+    """
+    Return the loaded ChestXrayModel for a weights path, loading and testing it on first use
+    
+    Args:
+        model_path: Path to the model weights (defaults to the MODEL_PATH environment variable);
+            other paths must be files inside MODEL_DIRS
+        device: Device to load the model on
+        
+    Returns:
+        Loaded model instance, or None if the inference self-test failed
+        
+    Raises:
+        ValueError: If model_path is not allowed (see resolve_model_path)
+    """
+    key = (resolve_model_path(model_path), str(device))
+    model = _cached(_MODEL_CACHE, key)
+    if model is None:
+        with _load_lock(key):
+            model = _cached(_MODEL_CACHE, key)
+            if model is None:
+                model = load_model(key[0], device=device)
+                if not test_model_inference(model, device):
+                    return None
+                _cache_model(key, model)
+    return model
+
+def get_backend(model_path=None, device='cuda' if torch.cuda.is_available() else 'cpu'):
+    """
+    Return the classification backend (CLASSIFIER_BACKEND) for a weights path
+    
+    Args:
+        model_path: Path to the model weights (defaults to the MODEL_PATH environment variable)
+        device: Device to run inference on
+        
+    Returns:
+        Callable returning logits for an image batch, or None if the model failed its self-test
+    """
+    model = get_model(model_path, device=device)
+    if model is None:
+        return None
+    
+    key = (resolve_model_path(model_path), str(device))
+    backend = _cached(_BACKEND_CACHE, key)
+    if backend is None:
+        with _load_lock(key):
+            backend = _cached(_BACKEND_CACHE, key)
+            if backend is None:
+                # A pre-exported artifact only matches the default weights
+                exported_path = CLASSIFIER_BACKEND_PATH if key[0] == DEFAULT_MODEL_PATH else None
+                backend = create_backend(model, device=device, path=exported_path)
+                with _MODEL_CACHE_LOCK:
+                    if key in _MODEL_CACHE:
+                        _BACKEND_CACHE[key] = backend
+    return backend
+
+# GradCAM and the attention map register hooks on the shared model, and any forward pass
+# through it while they are registered would fire them, so each model serves one
+# diagnosis at a time
+_MODEL_LOCKS = weakref.WeakKeyDictionary()
+_MODEL_LOCKS_LOCK = threading.Lock()
+
+def model_lock(model):
+    """Lock serializing hook-based inference (prediction, GradCAM, attention) on one model"""
+    with _MODEL_LOCKS_LOCK:
+        return _MODEL_LOCKS.setdefault(model, threading.Lock())
+
+class ImageActivations:
+    """
+    Threshold-independent inference outputs for one image
+    
+    Holds the classifier probabilities and, once a heatmap is needed, the final block
+    activations, from which CAM grids for any class and the attention map are derived
+    without running the backbone again. CAM grids are kept per class, so a new
+    threshold only computes the explanations that are missing.
+    """
+    def __init__(self, probabilities):
+        self.probabilities = probabilities
+        self.features = None
+        self.momentum_pooled = None
+        self.cam_grids = {}
+        self.attention_map = None
+        self._lock = threading.Lock()
+    
+    def _ensure_features(self, model, img_tensor, device):
+        if self.features is None:
+            with stage_timer("forward"), torch.no_grad(), inference_autocast(device):
+                features, momentum_pooled = model.forward_features(prepare_input(img_tensor, device))
+            self.features, self.momentum_pooled = features.float(), momentum_pooled.float()
+    
+    def heatmaps(self, model, img_tensor, class_indices, device='cuda' if torch.cuda.is_available() else 'cpu'):
+        """
+        CAM grids for class_indices and the 7x7 attention map, computing only what is missing
+        
+        Returns:
+            Tuple of (dictionary mapping class index to CAM grid, attention map)
+        """
+        with self._lock:
+            missing = [idx for idx in dict.fromkeys(class_indices) if idx not in self.cam_grids]
+            if missing or self.attention_map is None:
+                self._ensure_features(model, img_tensor, device)
+            if missing:
+                self.cam_grids.update(cam_grids_from_features(model, self.features, self.momentum_pooled, missing, device))
+            if self.attention_map is None:
+                with stage_timer("attention"), torch.no_grad():
+                    self.attention_map = model.spatial_attention(self.features.to(device))[0, 0].float().cpu().numpy()
+            return {idx: self.cam_grids[idx] for idx in class_indices}, self.attention_map
+
+class ActivationStore:
+    """LRU of ImageActivations keyed by image digest, model version and device"""
+    def __init__(self, ttl_seconds=1800.0, max_entries=64):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, activations = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return activations
+    
+    def put(self, key, activations):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, activations)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+# Per-image probabilities and activations, so re-requests with another threshold (or
+# for heatmaps of other classes) do not touch the backbone
+ACTIVATION_STORE = ActivationStore(
+    ttl_seconds=float(os.getenv("ACTIVATION_STORE_TTL", 1800)),
+    max_entries=int(os.getenv("ACTIVATION_STORE_SIZE", 64))
+)
+
+def image_activations(model, backend, image_data, img_tensor, model_path=None, device='cuda' if torch.cuda.is_available() else 'cpu'):
+    """
+    Probabilities (and cached activations) for an image, from ACTIVATION_STORE when available
+    
+    Only DecodedImage inputs have a digest and are stored; other inputs get a fresh entry.
+    
+    Args:
+        model: The ChestXrayModel instance
+        backend: Classification backend from get_backend
+        image_data: The image being diagnosed
+        img_tensor: Its preprocessed tensor
+        model_path: Path to the model weights
+        device: Device to run on
+        
+    Returns:
+        ImageActivations for the image
+    """
+    key = None
+    if isinstance(image_data, DecodedImage) and image_data.digest:
+        key = (image_data.digest, model_version(model_path), str(device))
+        activations = ACTIVATION_STORE.get(key)
+        if activations is not None:
+            return activations
+    
+    activations = ImageActivations(predict_probabilities(backend, img_tensor, device)[0])
+    if key is not None:
+        ACTIVATION_STORE.put(key, activations)
+    return activations
+
+def heatmap_grids(model, img_tensor, class_indices, activations=None, device='cuda' if torch.cuda.is_available() else 'cpu'):
+    """
+    CAM grids by class index and the attention map for one image
+    
+    Uses the cached activations when available, and hook-based GradCAM on the full
+    model otherwise.
+    
+    Returns:
+        Tuple of (dictionary mapping class index to CAM grid, attention map)
+    """
+    if activations is not None and hasattr(model, 'forward_features'):
+        return activations.heatmaps(model, img_tensor, class_indices, device)
+    gradcam = GradCAMExtractor(model)
+    cam_grids = {
+        idx: gradcam.generate_cam_grid(img_tensor.to(device), class_idx=idx)[0]
+        for idx in dict.fromkeys(class_indices)
+    }
+    return cam_grids, extract_attention_map(model, img_tensor, device)
+
+def _load_default_model():
+    model = get_model()
+    if model is None:
+        raise RuntimeError("Model inference self-test failed")
+    # Build the classification backend (trace/export/compile) as part of startup
+    get_backend()
+    return model
+
+# The default classifier is loaded in the background at API startup, or on first use
+CLASSIFIER_MODEL = register_resource("chest_xray_classifier", _load_default_model)
+
 def test_model_inference(model, device='cuda' if torch.cuda.is_available() else 'cpu'):
     """Test that the loaded model can perform inference"""
     print("Testing model inference...")
@@ -442,38 +748,36 @@ def preprocess_image(image_data):
     Preprocess an image for the model
     
     Args:
-        image_data: PIL image or path to image
+        image_data: PIL image, path to image, encoded image bytes or DecodedImage
         
     Returns:
         Preprocessed image tensor
     """
-    if isinstance(image_data, str):
-        # If image_data is a path
-        image = Image.open(image_data).convert('RGB')
-    elif isinstance(image_data, Image.Image):
-        # If image_data is already a PIL Image
-        image = image_data.convert('RGB')
-    else:
-        raise ValueError("Unsupported image_data type. Expected PIL Image or path string.")
-    
-    # Define preprocessing transforms
-    preprocess = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
-    
-    # Apply preprocessing
-    img_tensor = preprocess(image)
+    # A DecodedImage's input is derived once and shared (the tensor views its array)
+    return torch.from_numpy(preprocess_array(image_data))
+
+def predict_probabilities(model, img_batch, device='cuda' if torch.cuda.is_available() else 'cpu'):
+    """
+    Sigmoid probabilities for a preprocessed image batch
     
-    return img_tensor.unsqueeze(0)  # Add batch dimension
+    Args:
+        model: The ChestXrayModel instance or an inference backend from get_backend
+        img_batch: Preprocessed image tensor of shape (N, 3, 224, 224)
+        device: Device to run inference on
+        
+    Returns:
+        Numpy array of shape (N, num_classes)
+    """
+    with stage_timer("forward"), torch.no_grad(), inference_autocast(device):
+        outputs = model(prepare_input(img_batch, device))
+    return torch.sigmoid(outputs.float()).cpu().numpy()
 
 def predict(model, img_tensor, threshold=0.4, device='cuda' if torch.cuda.is_available() else 'cpu'):
     """
     Run inference on an image
     
     Args:
-        model: The ChestXrayModel instance
+        model: The ChestXrayModel instance or an inference backend from get_backend
         img_tensor: Preprocessed image tensor
         threshold: Confidence threshold for positive detection
         device: Device to run inference on
@@ -481,199 +785,65 @@ def predict(model, img_tensor, threshold=0.4, device='cuda' if torch.cuda.is_ava
     Returns:
         Dictionary with predictions and confidence scores
     """
-    img_tensor = img_tensor.to(device)
-    
-    with torch.no_grad():
-        outputs = model(img_tensor)
-        probs = torch.sigmoid(outputs)
-    
-    probs = probs.cpu().numpy()[0]
-    
-    # Get predictions above threshold
-    positives = probs >= threshold
-    
-    results = []
-    for i, (prob, is_positive) in enumerate(zip(probs, positives)):
-        if is_positive:
-            results.append({
-                'disease': disease_labels[i],
-                'confidence': float(prob),
-                'index': i
-            })
-    
-    # Also get top 5 diseases regardless of threshold for comprehensive analysis
-    top_5_indices = np.argsort(probs)[-5:][::-1]
-    top_5_diseases = []
-    for idx in top_5_indices:
-        top_5_diseases.append({
-            'disease': disease_labels[idx],
-            'confidence': float(probs[idx]),
-            'index': int(idx)
-        })
-    
-    # Sort by confidence
-    results = sorted(results, key=lambda x: x['confidence'], reverse=True)
-    
-    return {
-        'raw_probabilities': probs.tolist(),
-        'predicted_diseases': results,
-        'top_5_diseases': top_5_diseases
-    }
+    return predictions_from_probabilities(predict_probabilities(model, img_tensor, device)[0], threshold)
+
+def denormalize_image(img_tensor):
+    """Undo ImageNet normalization of a (1, 3, H, W) input, as an (H, W, 3) array in [0, 1]"""
+    return denormalize_array(img_tensor.cpu().numpy()[0])
 
-def generate_gradcam_all(model, img_tensor, prediction_results, output_dir=None, device='cuda' if torch.cuda.is_available() else 'cpu'):
+def generate_gradcam_all(model, img_tensor, prediction_results, output_dir=None, device='cuda' if torch.cuda.is_available() else 'cpu', cam_grids=None):
     """
     Generate GradCAM visualizations for all detected diseases
     
     Args:
-        model: The ChestXrayModel instance
+        model: The ChestXrayModel instance (unused when cam_grids is given)
         img_tensor: Preprocessed image tensor
         prediction_results: Results from the predict function
         output_dir: Directory to save the visualization images
         device: Device to run on
+        cam_grids: Optional precomputed CAM grids keyed by class index (e.g. from the
+            inference service); the model is then not run
         
     Returns:
         Dictionary mapping disease names to GradCAM visualizations
     """
-    img_tensor = img_tensor.to(device)
-    gradcam = GradCAMExtractor(model)
-    
-    # Original image for overlay
-    img_np = img_tensor.cpu().numpy()[0].transpose(1, 2, 0)
-    # Denormalize the image for proper visualization
-    mean = np.array([0.485, 0.456, 0.406])
-    std = np.array([0.229, 0.224, 0.225])
-    img_np = img_np * std + mean
-    img_np = np.clip(img_np, 0, 1)
-    
-    gradcam_results = {}
-    
-    for result in prediction_results['predicted_diseases']:
-        disease = result['disease']
-        class_idx = result['index']
-        
-        # Generate GradCAM for this class
-        cam, _ = gradcam.generate_cam(img_tensor, class_idx=class_idx)
-        
-        # Colorize the heatmap
-        heatmap = cv2.applyColorMap(np.uint8(255 * cam), cv2.COLORMAP_JET)
-        heatmap = cv2.cvtColor(heatmap, cv2.COLOR_BGR2RGB)
-        heatmap = heatmap / 255.0
-        
-        # Overlay on the original image
-        overlay = 0.6 * img_np + 0.4 * heatmap
-        
-        # Save visualization if output_dir is provided
-        if output_dir:
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # Create a figure with original and GradCAM
-            fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
-            
-            # Original image
-            ax1.imshow(img_np)
-            ax1.set_title('Original X-ray')
-            ax1.axis('off')
-            
-            # GradCAM overlay
-            ax2.imshow(overlay)
-            ax2.set_title(f'{disease} GradCAM\n(Confidence: {result["confidence"]:.3f})')
-            ax2.axis('off')
-            
-            plt.tight_layout()
-            gradcam_path = f"{output_dir}/{disease}_gradcam_analysis.png"
-            plt.savefig(gradcam_path, bbox_inches='tight', dpi=150)
-            plt.close()
-            
-            print(f"Saved GradCAM visualization: {gradcam_path}")
-        
-        # Save result
-        gradcam_results[disease] = {
-            'heatmap': cam.tolist(),
-            'overlay': overlay.tolist(),
-            'confidence': result['confidence']
+    if cam_grids is None:
+        img_tensor = img_tensor.to(device)
+        gradcam = GradCAMExtractor(model)
+        cam_grids = {
+            result['index']: gradcam.generate_cam_grid(img_tensor, class_idx=result['index'])[0]
+            for result in prediction_results['predicted_diseases']
         }
     
-    return gradcam_results
+    return gradcam_from_grids(denormalize_image(img_tensor), prediction_results, cam_grids, output_dir)
 
-def generate_gradcam_top5(model, img_tensor, top_5_diseases, output_dir=None, device='cuda' if torch.cuda.is_available() else 'cpu'):
+def generate_gradcam_top5(model, img_tensor, top_5_diseases, output_dir=None, device='cuda' if torch.cuda.is_available() else 'cpu', render_pool=None, cam_grids=None):
     """
     Generate GradCAM visualizations for top 5 diseases
     
     Args:
-        model: The ChestXrayModel instance
+        model: The ChestXrayModel instance (unused when cam_grids is given)
         img_tensor: Preprocessed image tensor
         top_5_diseases: List of top 5 diseases from predict function
         output_dir: Directory to save the visualization images
         device: Device to run on
+        render_pool: Optional executor; when given, each figure is rendered on it and
+            the entry gets a 'figure' Future resolving to the PNG bytes
+        cam_grids: Optional precomputed CAM grids keyed by class index; the model is
+            then not run
         
     Returns:
         Dictionary mapping disease names to GradCAM visualizations
     """
-    img_tensor = img_tensor.to(device)
-    gradcam = GradCAMExtractor(model)
-    
-    # Original image for overlay
-    img_np = img_tensor.cpu().numpy()[0].transpose(1, 2, 0)
-    # Denormalize the image for proper visualization
-    mean = np.array([0.485, 0.456, 0.406])
-    std = np.array([0.229, 0.224, 0.225])
-    img_np = img_np * std + mean
-    img_np = np.clip(img_np, 0, 1)
+    if cam_grids is None:
+        img_tensor = img_tensor.to(device)
+        gradcam = GradCAMExtractor(model)
+        cam_grids = {}
+        for i, disease_info in enumerate(top_5_diseases):
+            print(f"Generating GradCAM for top {i+1} disease: {disease_info['disease']} (confidence: {disease_info['confidence']:.3f})")
+            cam_grids[disease_info['index']], _ = gradcam.generate_cam_grid(img_tensor, class_idx=disease_info['index'])
     
-    gradcam_results = {}
-    
-    for i, disease_info in enumerate(top_5_diseases):
-        disease = disease_info['disease']
-        class_idx = disease_info['index']
-        confidence = disease_info['confidence']
-        
-        print(f"Generating GradCAM for top {i+1} disease: {disease} (confidence: {confidence:.3f})")
-        
-        # Generate GradCAM for this class
-        cam, _ = gradcam.generate_cam(img_tensor, class_idx=class_idx)
-        
-        # Colorize the heatmap
-        heatmap = cv2.applyColorMap(np.uint8(255 * cam), cv2.COLORMAP_JET)
-        heatmap = cv2.cvtColor(heatmap, cv2.COLOR_BGR2RGB)
-        heatmap = heatmap / 255.0
-        
-        # Overlay on the original image
-        overlay = 0.6 * img_np + 0.4 * heatmap
-        
-        # Save visualization if output_dir is provided
-        if output_dir:
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # Create a figure with original and GradCAM
-            fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
-            
-            # Original image
-            ax1.imshow(img_np)
-            ax1.set_title('Original X-ray')
-            ax1.axis('off')
-            
-            # GradCAM overlay
-            ax2.imshow(overlay)
-            ax2.set_title(f'{disease} GradCAM\n(Top {i+1} - Confidence: {confidence:.3f})')
-            ax2.axis('off')
-            
-            plt.tight_layout()
-            gradcam_path = f"{output_dir}/top{i+1}_{disease}_gradcam.png"
-            plt.savefig(gradcam_path, bbox_inches='tight', dpi=150)
-            plt.close()
-            
-            print(f"Saved GradCAM visualization: {gradcam_path}")
-        
-        # Save result
-        gradcam_results[f"top{i+1}_{disease}"] = {
-            'disease': disease,
-            'rank': i + 1,
-            'heatmap': cam.tolist(),
-            'overlay': overlay.tolist(),
-            'confidence': confidence
-        }
-    
-    return gradcam_results
+    return gradcam_top5_from_grids(denormalize_image(img_tensor), top_5_diseases, cam_grids, output_dir, render_pool)
 
 def extract_attention_map(model, img_tensor, device='cuda' if torch.cuda.is_available() else 'cpu'):
     """
@@ -687,18 +857,18 @@ def extract_attention_map(model, img_tensor, device='cuda' if torch.cuda.is_avai
     Returns:
         The attention map as a numpy array (original 7x7 size)
     """
-    img_tensor = img_tensor.to(device)
+    img_tensor = prepare_input(img_tensor, device)
     
     # Register a hook to get the attention map
     attention_maps = []
     
     def hook_fn(module, input, output):
-        attention_maps.append(output.detach().cpu().numpy())
+        attention_maps.append(output.detach().float().cpu().numpy())
     
     hook = model.spatial_attention.register_forward_hook(hook_fn)
     
     # Forward pass
-    with torch.no_grad():
+    with stage_timer("attention"), torch.no_grad(), inference_autocast(device):
         _ = model(img_tensor)
     
     # Remove the hook
@@ -710,420 +880,74 @@ def extract_attention_map(model, img_tensor, device='cuda' if torch.cuda.is_avai
     # Don't resize - keep original 7x7 dimensions
     return attention_map
 
-def visualize_attention_map(model, img_tensor, output_dir=None, device='cuda' if torch.cuda.is_available() else 'cpu'):
+def visualize_attention_map(model, img_tensor, output_dir=None, device='cuda' if torch.cuda.is_available() else 'cpu', render_pool=None, attention_map=None):
     """
     Visualize the attention map (7x7 grid without overlay)
     
     Args:
-        model: The ChestXrayModel instance
+        model: The ChestXrayModel instance (unused when attention_map is given)
         img_tensor: Preprocessed image tensor
         output_dir: Directory to save the visualization
         device: Device to run on
+        render_pool: Optional executor; when given, the figure is rendered on it and
+            the result gets a 'figure' Future resolving to the PNG bytes
+        attention_map: Optional precomputed 7x7 attention map; the model is then not run
         
     Returns:
         Dictionary with attention map visualization
     """
     # Get the attention map (7x7)
-    attention_map = extract_attention_map(model, img_tensor, device)
-    
-    # Original image for reference (denormalized)
-    img_np = img_tensor.cpu().numpy()[0].transpose(1, 2, 0)
-    mean = np.array([0.485, 0.456, 0.406])
-    std = np.array([0.229, 0.224, 0.225])
-    img_np = img_np * std + mean
-    img_np = np.clip(img_np, 0, 1)
-    
-    # Save visualization if output_dir is provided
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Create figure with two subplots only (no overlay)
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
-        
-        # Original image
-        ax1.imshow(img_np)
-        ax1.set_title('Original X-ray')
-        ax1.axis('off')
-        
-        # Attention map (7x7 grid)
-        im2 = ax2.imshow(attention_map, cmap='jet', interpolation='nearest')
-        ax2.set_title('Model Attention Map (7x7)')
-        ax2.axis('off')
-        
-        # Add colorbar
-        plt.colorbar(im2, ax=ax2, fraction=0.046, pad=0.04)
-        
-        # Add grid lines to show 7x7 structure
-        ax2.set_xticks(np.arange(-0.5, 7, 1), minor=True)
-        ax2.set_yticks(np.arange(-0.5, 7, 1), minor=True)
-        ax2.grid(which='minor', color='white', linestyle='-', linewidth=0.5, alpha=0.7)
-        
-        plt.tight_layout()
-        attention_path = f"{output_dir}/attention_analysis.png"
-        plt.savefig(attention_path, bbox_inches='tight', dpi=150)
-        plt.close()
-        
-        print(f"Saved attention visualization: {attention_path}")
-    
-    return {
-        'attention_map': attention_map.tolist()
-    }
-
-async def get_pubmed_for_disease(disease_name, perform_rag_func, vector_store):
-    """
-    Get PubMed information for a specific disease
-    
-    Args:
-        disease_name: Name of the disease to search for
-        perform_rag_func: The perform_rag function
-        vector_store: Vector store instance
-        
-    Returns:
-        Tuple of (context, sources) from PubMed
-    """
-    try:
-        query = f"human chest X-ray {disease_name} radiographic signs location anatomy patient"
-        context, sources = await perform_rag_func(
-            query, 
-            vector_store, 
-            use_web=False, 
-            use_pubmed=True
-        )
-        return context, sources
-    except Exception as e:
-        print(f"Error getting PubMed for {disease_name}: {e}")
-        return None, None
-
-def analyze_individual_disease_with_pubmed(gemini_client, disease_name, confidence, gradcam_overlay, original_image_pil, pubmed_context=None, pubmed_sources=None):
-    """
-    Get concise individual analysis for a specific disease with PubMed citations
+    if attention_map is None:
+        attention_map = extract_attention_map(model, img_tensor, device)
     
-    Args:
-        gemini_client: Initialized Gemini client
-        disease_name: Name of the disease
-        confidence: Confidence score
-        gradcam_overlay: GradCAM overlay image as numpy array
-        original_image_pil: Original PIL image
-        pubmed_context: PubMed context for this disease
-        pubmed_sources: PubMed sources for this disease
-        
-    Returns:
-        Concise analysis with PubMed citations
-    """
-    # Format citations
-    citations = ""
-    if pubmed_sources:
-        for i, source in enumerate(pubmed_sources[:2]):  # Use top 2 sources
-            pmid = source.get('link', '').split('/')[-1] if source.get('link') else 'N/A'
-            citations += f"[{i+1}] {source.get('title', 'N/A')} (PMID: {pmid})\n"
-    
-    prompt = f"""You are a radiologist. Provide a CONCISE analysis of {disease_name} for this human chest X-ray.
-
-**Disease**: {disease_name}
-**PubMed Evidence:**
-{pubmed_context if pubmed_context else "No PubMed information available"}
-
-**References:**
-{citations if citations else "No references available"}
-
-**Required Analysis (Keep VERY brief):**
-
-1. **Location & Signs** (1-2 sentences):
-   - Where does {disease_name} typically appear on human chest X-ray?
-   - What are the key radiographic signs in humans? Cite evidence [number]
-
-2. **GradCAM Assessment** (1-2 sentences):
-   - Does the highlighted area match the expected anatomical location from literature?
-   - Is the model focusing on the correct region for {disease_name}?
-
-3. **Quick Assessment** (1 sentence):
-   - Based on PubMed evidence, is this finding consistent with {disease_name} in humans?
-
-**Guidelines:**
-- Maximum 5 sentences total
-- Always cite PubMed sources using [number]
-- Focus only on human pathology and anatomical accuracy
-- Do not include any animal disease references"""
-
-    try:
-        # Create visualization image
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
-        
-        # Original image
-        ax1.imshow(original_image_pil)
-        ax1.set_title('Original X-ray')
-        ax1.axis('off')
-        
-        # GradCAM overlay
-        ax2.imshow(gradcam_overlay)
-        ax2.set_title(f'{disease_name} GradCAM')
-        ax2.axis('off')
-        
-        plt.tight_layout()
-        
-        # Convert to bytes
-        img_buffer = io.BytesIO()
-        plt.savefig(img_buffer, format='PNG', bbox_inches='tight', dpi=150)
-        img_buffer.seek(0)
-        img_bytes = img_buffer.getvalue()
-        plt.close()
-        
-        # Create multimodal prompt
-        prompt_parts = [
-            prompt,
-            {
-                "mime_type": "image/png",
-                "data": img_bytes
-            }
-        ]
-        
-        analysis = gemini_client.model.generate_content(prompt_parts)
-        return analysis.text
-        
-    except Exception as e:
-        return f"Error getting analysis for {disease_name}: {str(e)}"
+    return attention_from_map(denormalize_image(img_tensor), attention_map, output_dir, render_pool)
 
-def analyze_individual_disease_with_gemini(gemini_client, disease_name, confidence, gradcam_overlay, original_image_pil):
+def classify_image(image_data, model_path=None, threshold=0.4, device='cuda' if torch.cuda.is_available() else 'cpu'):
     """
-    Get individual analysis for a specific disease from Gemini
+    Classification only (step 4 of diagnose_and_visualize), without GradCAM or attention
     
     Args:
-        gemini_client: Initialized Gemini client
-        disease_name: Name of the disease
-        confidence: Confidence score
-        gradcam_overlay: GradCAM overlay image as numpy array
-        original_image_pil: Original PIL image
-        
-    Returns:
-        Gemini's analysis for this specific disease
-    """
-    prompt = f"""You are an expert radiologist. Analyze this human chest X-ray specifically for {disease_name}.
-
-**Disease**: {disease_name} (Human pathology only)
-**AI Confidence**: {confidence:.3f}
-
-**Please provide a focused analysis for {disease_name} including:**
-
-1. **Clinical Description**: What is {disease_name} and how does it typically present on human chest X-rays?
-
-2. **GradCAM Interpretation**: Looking at the highlighted regions in the GradCAM visualization:
-   - Are the highlighted areas anatomically consistent with {disease_name} in humans?
-   - Do the focus areas match typical radiographic patterns for this condition in human patients?
-   - Any concerning or unexpected areas of attention?
-
-3. **Confidence Assessment**: Based on the visualization and confidence score ({confidence:.3f}):
-   - Does this confidence level seem appropriate for human diagnosis?
-   - What factors support or contradict this diagnosis in humans?
-
-4. **Clinical Recommendations**: For this specific finding in human patients:
-   - What additional views or imaging might be helpful?
-   - What clinical correlation would be important?
-
-Keep your response focused specifically on {disease_name} in human patients only. Do not reference veterinary or animal pathology."""
-
-    try:
-        # Create visualization image
-        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
-        
-        # Original image
-        ax1.imshow(original_image_pil)
-        ax1.set_title('Original X-ray')
-        ax1.axis('off')
-        
-        # GradCAM overlay
-        ax2.imshow(gradcam_overlay)
-        ax2.set_title(f'{disease_name} GradCAM\n(Confidence: {confidence:.3f})')
-        ax2.axis('off')
-        
-        plt.tight_layout()
-        
-        # Convert to bytes
-        img_buffer = io.BytesIO()
-        plt.savefig(img_buffer, format='PNG', bbox_inches='tight', dpi=150)
-        img_buffer.seek(0)
-        img_bytes = img_buffer.getvalue()
-        plt.close()
-        
-        # Create multimodal prompt
-        prompt_parts = [
-            prompt,
-            {
-                "mime_type": "image/png",
-                "data": img_bytes
-            }
-        ]
-        
-        analysis = gemini_client.model.generate_content(prompt_parts)
-        return analysis.text
-        
-    except Exception as e:
-        return f"Error getting individual analysis for {disease_name}: {str(e)}"
-
-def get_concise_conclusion_from_gemini(gemini_client, top_5_diseases, individual_analyses, original_image_pil):
-    """
-    Get concise conclusion and overall assessment from Gemini
-    
-    Args:
-        gemini_client: Initialized Gemini client
-        top_5_diseases: List of top 5 diseases with confidence scores
-        individual_analyses: Dictionary of individual disease analyses
-        original_image_pil: Original PIL image
-        
-    Returns:
-        Concise conclusion from Gemini
-    """
-    diseases_summary = ""
-    for i, disease in enumerate(top_5_diseases[:3]):  # Only top 3
-        diseases_summary += f"{i+1}. {disease['disease']}: {disease['confidence']:.3f}\n"
-    
-    prompt = f"""You are a radiologist providing a CONCISE conclusion for this human chest X-ray.
-
-**AI Results (Top 3):**
-{diseases_summary}
-
-**Provide a BRIEF conclusion (maximum 6 sentences):**
-
-1. **Primary Finding** (1-2 sentences):
-   - What is the most significant finding on this human X-ray?
-
-2. **Clinical Significance** (1-2 sentences): 
-   - What does this mean for the human patient?
-
-3. **Immediate Recommendations** (1-2 sentences):
-   - What should be done next for this patient?
-
-**Guidelines:**
-- Maximum 6 sentences total
-- Focus only on the most important findings in humans
-- Be concise and actionable for human healthcare
-- Do not reference animal or veterinary conditions"""
-
-    try:
-        # Convert original image to bytes
-        img_buffer = io.BytesIO()
-        original_image_pil.save(img_buffer, format='JPEG')
-        img_buffer.seek(0)
-        img_bytes = img_buffer.getvalue()
-        
-        prompt_parts = [
-            prompt,
-            {
-                "mime_type": "image/jpeg",
-                "data": img_bytes
-            }
-        ]
-        
-        conclusion = gemini_client.model.generate_content(prompt_parts)
-        return conclusion.text
-        
-    except Exception as e:
-        return f"Error getting concise conclusion: {str(e)}"
-
-def get_comprehensive_conclusion_from_gemini(gemini_client, top_5_diseases, individual_analyses, original_image_pil):
-    """
-    Get comprehensive conclusion and overall assessment from Gemini
-    
-    Args:
-        gemini_client: Initialized Gemini client
-        top_5_diseases: List of top 5 diseases with confidence scores
-        individual_analyses: Dictionary of individual disease analyses
-        original_image_pil: Original PIL image
+        image_data: PIL image, path to image or DecodedImage
+        model_path: Path to the model weights
+        threshold: Confidence threshold for positive detection
+        device: Device to run on
         
     Returns:
-        Comprehensive conclusion from Gemini
+        Dictionary with predictions and confidence scores (as returned by predict)
     """
-    diseases_summary = ""
-    for i, disease in enumerate(top_5_diseases):
-        diseases_summary += f"{i+1}. {disease['disease']}: {disease['confidence']:.3f}\n"
-    
-    individual_summary = ""
-    for disease_key, analysis in individual_analyses.items():
-        disease_name = disease_key.split('_', 1)[1]  # Remove 'top1_' prefix
-        individual_summary += f"\n**Analysis for {disease_name}:**\n{analysis[:500]}...\n"
+    model = get_model(model_path, device=device)
+    if model is None:
+        raise RuntimeError("Model inference test failed")
     
-    prompt = f"""You are a senior radiologist providing a comprehensive conclusion for this human chest X-ray analysis.
-
-**AI Model Results - Top 5 Predictions:**
-{diseases_summary}
-
-**Individual Disease Analyses Summary:**
-{individual_summary}
-
-**Please provide a COMPREHENSIVE CONCLUSION including:**
-
-1. **Overall Radiological Impression**:
-   - Primary findings and their significance in human patients
-   - Most likely diagnoses based on the complete analysis
-   - Confidence in the overall assessment for human pathology
-
-2. **Clinical Synthesis**:
-   - How do the individual findings relate to each other in humans?
-   - Are there any patterns or combinations that suggest specific human conditions?
-   - What is the most coherent clinical picture for this patient?
-
-3. **Risk Stratification**:
-   - Which findings require immediate attention for the patient?
-   - Which findings need follow-up monitoring in humans?
-   - Any incidental findings of note in human healthcare?
-
-4. **Recommendations**:
-   - Next steps for human patient management
-   - Additional imaging or studies needed for humans
-   - Clinical correlation required for this patient
-   - Timeline for follow-up in human healthcare
-
-5. **Limitations and Caveats**:
-   - Limitations of AI analysis for human diagnosis
-   - Factors that might affect interpretation in humans
-   - Importance of clinical correlation with patient history
-
-6. **Final Assessment**:
-   - Summary statement of key findings in this human patient
-   - Overall clinical significance for human health
-   - Recommended action priority level for patient care
-
-Provide a professional, structured conclusion that synthesizes all the individual analyses into a coherent radiological report for human healthcare only. Do not reference veterinary or animal pathology."""
-
-    try:
-        # Convert original image to bytes
-        img_buffer = io.BytesIO()
-        original_image_pil.save(img_buffer, format='JPEG')
-        img_buffer.seek(0)
-        img_bytes = img_buffer.getvalue()
-        
-        prompt_parts = [
-            prompt,
-            {
-                "mime_type": "image/jpeg",
-                "data": img_bytes
-            }
-        ]
-        
-        conclusion = gemini_client.model.generate_content(prompt_parts)
-        return conclusion.text
-        
-    except Exception as e:
-        return f"Error getting comprehensive conclusion: {str(e)}"
+    img_tensor = preprocess_image(image_data)
+    with model_lock(model):
+        activations = image_activations(model, get_backend(model_path, device=device), image_data, img_tensor, model_path, device)
+    return predictions_from_probabilities(activations.probabilities, threshold)
 
-def diagnose_and_visualize(image_data, model_path=None, output_dir=None, threshold=0.4, device='cuda' if torch.cuda.is_available() else 'cpu'):
+def diagnose_and_visualize(image_data, model_path=None, output_dir=None, threshold=0.4, device='cuda' if torch.cuda.is_available() else 'cpu', render_pool=None, prediction_results=None, gradcam_top_n=5):
     """
     End-to-end pipeline to diagnose an image and generate visualizations
     
     Args:
-        image_data: PIL image or path to image
+        image_data: PIL image, path to image or DecodedImage
         model_path: Path to the model weights
         output_dir: Directory to save visualizations
         threshold: Confidence threshold for positive detection
         device: Device to run on
+        render_pool: Optional executor for the top-5 GradCAM and attention figures. The
+            function then returns as soon as the raw CAMs exist, with a 'renders' entry
+            mapping each top-5 key and 'attention' to a Future of PNG bytes
+        prediction_results: Result of classify_image for this image, if already computed;
+            prediction is then skipped
+        gradcam_top_n: Number of top-5 diseases that get a GradCAM overlay and figure
         
     Returns:
         Dictionary with diagnosis and visualization results
     """
-    # 1. Load model with enhanced compatibility
-    model = load_model(model_path, device=device)
+    # 1-2. Load (once per process) and self-test the model
+    model = get_model(model_path, device=device)
     
-    # 2. Test model inference
-    if not test_model_inference(model, device):
+    if model is None:
         return {
             'diagnosis': {'raw_probabilities': [], 'predicted_diseases': [], 'top_5_diseases': []},
             'gradcam': {},
@@ -1135,297 +959,27 @@ def diagnose_and_visualize(image_data, model_path=None, output_dir=None, thresho
     # 3. Preprocess image
     img_tensor = preprocess_image(image_data)
     
-    # 4. Run prediction
-    prediction_results = predict(model, img_tensor, threshold, device)
+    backend = get_backend(model_path, device=device)
+    with model_lock(model):
+        # 4. Run prediction on the configured backend (GradCAM below stays on the eager model);
+        # probabilities and activations of a recently seen image come from ACTIVATION_STORE
+        activations = image_activations(model, backend, image_data, img_tensor, model_path, device)
+        if prediction_results is None:
+            prediction_results = predictions_from_probabilities(activations.probabilities, threshold)
+        
+        # CAM grids for every class shown below, computed once from the cached activations
+        top_heatmaps = prediction_results['top_5_diseases'][:gradcam_top_n]
+        class_indices = [d['index'] for d in prediction_results['predicted_diseases'] + top_heatmaps]
+        cam_grids, attention_map = heatmap_grids(model, img_tensor, class_indices, activations, device)
     
     # 5. Generate GradCAM for predicted classes above threshold
-    gradcam_results = generate_gradcam_all(model, img_tensor, prediction_results, output_dir, device)
+    gradcam_results = generate_gradcam_all(model, img_tensor, prediction_results, output_dir, device, cam_grids=cam_grids)
     
     # 6. Generate GradCAM for top 5 diseases
-    gradcam_top5_results = generate_gradcam_top5(model, img_tensor, prediction_results['top_5_diseases'], output_dir, device)
+    gradcam_top5_results = generate_gradcam_top5(model, img_tensor, top_heatmaps, output_dir, device, render_pool=render_pool, cam_grids=cam_grids)
     
     # 7. Generate attention map
-    attention_results = visualize_attention_map(model, img_tensor, output_dir, device)
+    attention_results = visualize_attention_map(model, img_tensor, output_dir, device, render_pool=render_pool, attention_map=attention_map)
     
     # 8. Format results
-    results = {
-        'diagnosis': prediction_results,
-        'gradcam': gradcam_results,
-        'gradcam_top5': gradcam_top5_results,
-        'attention': attention_results
-    }
-    
-    # Save results as JSON if output_dir is provided
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-        with open(f"{output_dir}/diagnosis_results.json", 'w') as f:
-            json.dump(results, f, indent=4)
-    
-    return results
-
-def prepare_gemini_analysis_from_results(original_image_pil, diagnosis_results, output_dir=None):
-    """
-    Prepare comprehensive analysis for Gemini based on diagnosis results
-    
-    Args:
-        original_image_pil: PIL Image of the original chest X-ray
-        diagnosis_results: Results from diagnose_and_visualize
-        output_dir: Optional directory to save visualization images
-        
-    Returns:
-        Dictionary with prompt and image data for Gemini
-    """
-    # Create analysis prompt
-    predicted_diseases = diagnosis_results['diagnosis']['predicted_diseases']
-    
-    prompt = f"""You are an expert radiologist analyzing a human chest X-ray. I have performed AI-assisted analysis and will provide:
-
-1. The original human chest X-ray image
-2. AI model predictions with confidence scores for human pathology
-3. GradCAM visualizations showing model attention for each predicted disease
-4. Overall attention map showing general areas of focus
-
-**AI Model Predictions (Human Pathology Only):**
-"""
-    
-    if predicted_diseases:
-        for disease in predicted_diseases:
-            prompt += f"- {disease['disease']}: {disease['confidence']:.3f} confidence\n"
-    else:
-        prompt += "- No diseases detected above threshold\n"
-    
-    prompt += """
-**Please provide a comprehensive radiological analysis for human healthcare including:**
-
-1. **Clinical Assessment**: For each predicted disease in humans, explain:
-   - What the condition represents clinically in human patients
-   - Typical radiographic findings in humans
-   - How the GradCAM visualization aligns with expected findings in human chest X-rays
-
-2. **GradCAM Analysis**: Interpret the highlighted regions in each GradCAM:
-   - Are the highlighted areas anatomically relevant for human pathology?
-   - Do they correspond to typical locations for each condition in humans?
-   - Any concerning or unexpected focus areas for human diagnosis?
-
-3. **Attention Map Analysis**: 
-   - Overall pattern of model attention across the human chest image
-   - Whether attention aligns with clinically relevant human anatomical structures
-   - Any areas of high attention that weren't flagged for specific human diseases
-
-4. **Clinical Correlation**:
-   - Overall interpretation of findings for human patient care
-   - Confidence in AI predictions based on visualization analysis for humans
-   - Recommended follow-up or additional imaging needed for human patients
-   - Any limitations or caveats specific to human diagnosis
-
-5. **Quality Assessment**:
-   - Image quality and technical factors affecting human diagnosis
-   - Any artifacts or limitations affecting interpretation for patient care
-
-Please structure your response clearly and provide specific observations about the visualizations relevant to human healthcare only. Do not reference animal or veterinary pathology."""
-
-    # Prepare image data for multimodal input
-    images_for_analysis = []
-    
-    # Convert PIL image to bytes for Gemini
-    img_byte_arr = io.BytesIO()
-    original_image_pil.save(img_byte_arr, format='JPEG')
-    original_image_bytes = img_byte_arr.getvalue()
-    
-    images_for_analysis.append({
-        "description": "Original Chest X-ray",
-        "data": original_image_bytes,
-        "mime_type": "image/jpeg"
-    })
-    
-    # Create visualization images for Gemini if output_dir is provided
-    if output_dir:
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Save and add GradCAM images
-        for disease_name, gradcam_data in diagnosis_results['gradcam'].items():
-            fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
-            
-            # Original image
-            img_np = np.array(original_image_pil.convert('RGB'))
-            ax1.imshow(img_np, cmap='gray')
-            ax1.set_title('Original X-ray')
-            ax1.axis('off')
-            
-            # GradCAM overlay
-            overlay = np.array(gradcam_data['overlay'])
-            ax2.imshow(overlay)
-            ax2.set_title(f'{disease_name} GradCAM\n(Confidence: {gradcam_data["confidence"]:.3f})')
-            ax2.axis('off')
-            
-            plt.tight_layout()
-            gradcam_path = f"{output_dir}/{disease_name}_gradcam_analysis.png"
-            plt.savefig(gradcam_path, bbox_inches='tight', dpi=150)
-            plt.close()
-            
-            # Add to images for analysis
-            with open(gradcam_path, 'rb') as f:
-                gradcam_bytes = f.read()
-            images_for_analysis.append({
-                "description": f"GradCAM visualization for {disease_name}",
-                "data": gradcam_bytes,
-                "mime_type": "image/png"
-            })
-        
-        # Save and add attention map
-        attention_data = diagnosis_results['attention']
-        fig, (ax1, ax2, ax3) = plt.subplots(1, 3, figsize=(15, 5))
-        
-        # Original
-        img_np = np.array(original_image_pil.convert('RGB'))
-        ax1.imshow(img_np, cmap='gray')
-        ax1.set_title('Original X-ray')
-        ax1.axis('off')
-        
-        # Attention map
-        attention_map = np.array(attention_data['attention_map'])
-        im2 = ax2.imshow(attention_map, cmap='jet')
-        ax2.set_title('Model Attention Map')
-        ax2.axis('off')
-        plt.colorbar(im2, ax=ax2, fraction=0.046, pad=0.04)
-        
-        # Overlay
-        overlay = np.array(attention_data['overlay'])
-        ax3.imshow(overlay)
-        ax3.set_title('Attention Overlay')
-        ax3.axis('off')
-        
-        plt.tight_layout()
-        attention_path = f"{output_dir}/attention_analysis.png"
-        plt.savefig(attention_path, bbox_inches='tight', dpi=150)
-        plt.close()
-        
-        # Add to images for analysis
-        with open(attention_path, 'rb') as f:
-            attention_bytes = f.read()
-        images_for_analysis.append({
-            "description": "Model attention map and overlay",
-            "data": attention_bytes,
-            "mime_type": "image/png"
-        })
-    
-    return {
-        "prompt": prompt,
-        "images": images_for_analysis
-    }
-
-def analyze_with_gemini_and_pubmed(gemini_client, original_image_pil, diagnosis_results, pubmed_context=None, pubmed_sources=None):
-    """
-    Generate concise analysis with PubMed citations for diagnosis results
-    
-    Args:
-        gemini_client: Initialized Gemini client
-        original_image_pil: PIL Image of the original chest X-ray
-        diagnosis_results: Results from diagnose_and_visualize
-        pubmed_context: Context retrieved from PubMed search
-        pubmed_sources: PubMed sources with citation information
-        
-    Returns:
-        Concise analysis with scientific citations
-    """
-    top_5_diseases = diagnosis_results['diagnosis']['top_5_diseases']
-    
-    # Create disease summary
-    diseases_summary = ""
-    for i, disease in enumerate(top_5_diseases[:3]):  # Focus on top 3
-        diseases_summary += f"{i+1}. {disease['disease']}: {disease['confidence']:.3f}\n"
-    
-    # Format PubMed citations
-    citations = ""
-    if pubmed_sources:
-        for i, source in enumerate(pubmed_sources[:3]):  # Use top 3 relevant sources
-            pmid = source.get('link', '').split('/')[-1] if source.get('link') else 'N/A'
-            citations += f"[{i+1}] {source.get('title', 'N/A')} (PMID: {pmid})\n"
-    
-    prompt = f"""You are a professional radiologist. Provide a concise analysis of the AI diagnosis results with scientific evidence from PubMed for human healthcare.
-
-**AI Results (Top 3 Human Pathologies):**
-{diseases_summary}
-
-**PubMed Context (Human Studies Only):**
-{pubmed_context if pubmed_context else "No PubMed information available"}
-
-**References:**
-{citations if citations else "No references available"}
-
-**Analysis Requirements:**
-
-1. **Clinical Assessment** (2-3 sentences):
-   - Comment on the detected pathologies in human patients
-   - Clinical significance of the findings for human health
-
-2. **Scientific Evidence** (2-3 sentences):
-   - Based on PubMed information, explain why the model produced these results for humans
-   - Cite specific evidence using [number] from human studies only
-
-3. **Recommendations** (1-2 sentences):
-   - Next steps required for human patient care
-   - Follow-up or additional testing needed for humans
-
-**Guidelines:** 
-- Keep responses concise, maximum 3 sentences per section
-- Always cite PubMed sources using [number] from human studies only
-- Do not evaluate whether confidence scores are high or low
-- Focus exclusively on human pathology and healthcare
-- Do not reference animal or veterinary studies"""
-
-    try:
-        # Convert image to bytes
-        img_buffer = io.BytesIO()
-        original_image_pil.save(img_buffer, format='JPEG')
-        img_buffer.seek(0)
-        img_bytes = img_buffer.getvalue()
-        
-        prompt_parts = [
-            prompt,
-            {
-                "mime_type": "image/jpeg",
-                "data": img_bytes
-            }
-        ]
-        
-        analysis = gemini_client.model.generate_content(prompt_parts)
-        return analysis.text
-        
-    except Exception as e:
-        return f"Error getting analysis with PubMed citations: {str(e)}"
-
-def analyze_with_gemini(gemini_client, original_image_pil, diagnosis_results, output_dir=None):
-    """
-    Complete pipeline to analyze chest X-ray with Gemini
-    
-    Args:
-        gemini_client: Initialized Gemini client
-        original_image_pil: PIL Image of the original chest X-ray
-        diagnosis_results: Results from diagnose_and_visualize
-        output_dir: Optional directory to save visualizations
-        
-    Returns:
-        Gemini's comprehensive analysis
-    """
-    # Prepare analysis data
-    analysis_data = prepare_gemini_analysis_from_results(
-        original_image_pil, diagnosis_results, output_dir
-    )
-    
-    # Create multimodal prompt for Gemini
-    prompt_parts = [analysis_data["prompt"]]
-    
-    # Add images to prompt
-    for img_info in analysis_data["images"]:
-        prompt_parts.append({
-            "mime_type": img_info["mime_type"],
-            "data": img_info["data"]
-        })
-    
-    # Get Gemini's analysis
-    try:
-        analysis = gemini_client.model.generate_content(prompt_parts)
-        return analysis.text
-    except Exception as e:
-        return f"Error getting Gemini analysis: {str(e)}"
+    return format_diagnosis_results(prediction_results, gradcam_results, gradcam_top5_results, attention_results, output_dir, render_pool)
@@ -0,0 +1,155 @@
+# utils/pipeline.py
+
+import asyncio
+import time
+
+
+class Stage:
+    """One step of a pipeline: an async function of its dependencies' results."""
+    def __init__(self, name, fn, deps=(), optional=False):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.optional = optional
+        self.started_at = None
+        self.finished_at = None
+        # None, "planned" (declared with Pipeline.skip) or "deadline"
+        self.skipped = None
+
+
+class Pipeline:
+    """
+    A dependency graph of async stages, run with maximal overlap.
+
+    Each stage starts as soon as every stage it depends on has finished, and is called
+    with their results as positional arguments in the declared order. The first failing
+    stage cancels the rest and its exception propagates from run().
+
+    Optional stages are bounded by the deadline (a time.perf_counter() value): one that
+    would start after it is skipped, one still running at it is cancelled, and either
+    way its result is None. Stages declared with skip() never run and also yield None,
+    so dependents are wired the same whichever stages a request leaves out.
+    """
+    def __init__(self, name, deadline=None):
+        self.name = name
+        self.deadline = deadline
+        self.stages = {}
+        self.results = {}
+        self._started_at = None
+        self._finished_at = None
+
+    def stage(self, name, fn, deps=(), optional=False):
+        """Add a stage; dependencies must already be declared, so the graph stays acyclic."""
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage: {name}")
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dep}")
+        self.stages[name] = Stage(name, fn, deps, optional)
+        return name
+
+    def skip(self, name):
+        """Declare a stage that is left out of this run; dependents receive None for it."""
+        self.stage(name, None)
+        self.stages[name].skipped = "planned"
+        return name
+
+    @property
+    def skipped(self):
+        """Names of the stages that were left out or cut off by the deadline."""
+        return [stage.name for stage in self.stages.values() if stage.skipped]
+
+    @property
+    def cut_off(self):
+        """True if the deadline cut off at least one stage (the run took as long as the deadline allowed)."""
+        return any(stage.skipped == "deadline" for stage in self.stages.values())
+
+    async def _run_stage(self, stage, tasks):
+        if stage.skipped:
+            self.results[stage.name] = None
+            return None
+        dep_results = [await tasks[dep] for dep in stage.deps]
+        stage.started_at = time.perf_counter()
+        try:
+            if stage.optional and self.deadline is not None:
+                remaining = self.deadline - stage.started_at
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                result = await asyncio.wait_for(stage.fn(*dep_results), remaining)
+            else:
+                result = await stage.fn(*dep_results)
+        except asyncio.TimeoutError:
+            if not stage.optional:
+                raise
+            stage.skipped = "deadline"
+            result = None
+        finally:
+            stage.finished_at = time.perf_counter()
+        self.results[stage.name] = result
+        return result
+
+    async def run(self):
+        """Run every stage and return a dictionary of stage name -> result."""
+        self._started_at = time.perf_counter()
+        tasks = {}
+        # Stages were declared after their dependencies, so tasks exist before they are awaited
+        for stage in self.stages.values():
+            tasks[stage.name] = asyncio.create_task(self._run_stage(stage, tasks), name=f"{self.name}:{stage.name}")
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            self._finished_at = time.perf_counter()
+        return self.results
+
+    def critical_path(self):
+        """Stages on the longest dependency chain, from the first stage to the last to finish."""
+        finished = [stage for stage in self.stages.values() if stage.finished_at is not None]
+        if not finished:
+            return []
+        path = [max(finished, key=lambda stage: stage.finished_at)]
+        while True:
+            # The dependency that finished last is the one the stage was waiting for;
+            # skipped dependencies never ran, so they cannot have held it up
+            deps = [self.stages[dep] for dep in path[-1].deps if self.stages[dep].finished_at is not None]
+            if not deps:
+                break
+            path.append(max(deps, key=lambda stage: stage.finished_at))
+        return [stage.name for stage in reversed(path)]
+
+    def report(self):
+        """
+        Per-stage timings relative to the pipeline start and the critical path.
+
+        Returns:
+            Dictionary with total_ms, critical_path (stage names), critical_path_ms (each
+            critical stage's own duration), skipped (stage names) and stages (start_ms,
+            end_ms, duration_ms; status "skipped" for stages left out or cut off)
+        """
+        def ms(seconds):
+            return round(seconds * 1000, 1)
+
+        stages = {}
+        for stage in self.stages.values():
+            if stage.started_at is None:
+                stages[stage.name] = {"status": "skipped" if stage.skipped else "not_run"}
+                continue
+            stages[stage.name] = {
+                "start_ms": ms(stage.started_at - self._started_at),
+                "end_ms": ms((stage.finished_at or self._finished_at) - self._started_at),
+                "duration_ms": ms((stage.finished_at or self._finished_at) - stage.started_at)
+            }
+            if stage.skipped:
+                stages[stage.name]["status"] = "skipped"
+        critical_path = self.critical_path()
+        return {
+            "total_ms": ms(((self._finished_at or time.perf_counter()) - self._started_at)) if self._started_at else None,
+            "critical_path": critical_path,
+            "critical_path_ms": {name: stages[name]["duration_ms"] for name in critical_path},
+            "skipped": self.skipped,
+            "stages": stages
+        }
@@ -0,0 +1,246 @@
+# utils/profiling.py
+
+import hmac
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+# Requests carrying this token in the X-Profile header are profiled; unset disables profiling
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "clinisearch-profiles"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 5))
+PROFILE_RETENTION = int(os.getenv("PROFILE_RETENTION", 20))
+
+# Files written for each profiled request (the torch ones only where torch is loaded)
+ARTIFACTS = {
+    "trace.json": "application/json",       # torch.profiler Chrome trace (chrome://tracing, Perfetto)
+    "operators.txt": "text/plain",          # operator table sorted by self CPU time
+    "speedscope.json": "application/json",  # Python stacks of every thread in the process (speedscope.app)
+}
+
+# Leaf frames of threads that are idle (waiting for work), left out of the samples
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+}
+
+# One profiled request at a time: torch.profiler sessions are process-wide
+_profile_lock = threading.Lock()
+
+
+def profiling_enabled():
+    return bool(PROFILING_TOKEN)
+
+
+def authorized(token):
+    """True if token matches PROFILING_TOKEN (constant-time comparison)."""
+    return profiling_enabled() and token is not None and hmac.compare_digest(token.encode(), PROFILING_TOKEN.encode())
+
+
+def artifact_path(request_id, artifact):
+    """Path of a profile artifact, or None for unknown artifacts and malformed request IDs."""
+    if artifact not in ARTIFACTS:
+        return None
+    try:
+        request_id = uuid.UUID(request_id).hex
+    except ValueError:
+        return None
+    return os.path.join(PROFILE_DIR, request_id, artifact)
+
+
+class StackSampler:
+    """
+    Samples the Python stack of every thread (sys._current_frames) at a fixed interval.
+
+    Covers what the torch profiler does not see: figure rendering, JSON encoding, the
+    event loop and threads blocked on I/O such as Gemini and MCP calls. Sampling is
+    process-wide: executor threads are shared, so stacks of requests running
+    concurrently with the profiled one are recorded too.
+    """
+    def __init__(self, interval_ms=PROFILE_SAMPLE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self.frames = []
+        self._frame_index = {}
+        self._samples = {}  # thread id -> list of (timestamp, stack of frame indices)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.stopped_at = time.perf_counter()
+
+    def _frame_id(self, code, line):
+        key = (code.co_filename, code.co_name, line)
+        index = self._frame_index.get(key)
+        if index is None:
+            index = self._frame_index[key] = len(self.frames)
+            self.frames.append({"name": code.co_name, "file": code.co_filename, "line": line})
+        return index
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+                if leaf in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._frame_id(frame.f_code, frame.f_lineno))
+                    frame = frame.f_back
+                stack.reverse()
+                self._samples.setdefault(thread_id, []).append((now, stack))
+
+    def speedscope(self, name):
+        """Speedscope file (https://www.speedscope.app/file-format-schema.json), one sampled profile per thread."""
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        profiles = []
+        for thread_id, samples in self._samples.items():
+            weights = []
+            previous = self.started_at
+            for timestamp, _ in samples:
+                weights.append(round((timestamp - previous) * 1000, 3))
+                previous = timestamp
+            profiles.append({
+                "type": "sampled",
+                "name": thread_names.get(thread_id, f"thread {thread_id}"),
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round((self.stopped_at - self.started_at) * 1000, 3),
+                "samples": [stack for _, stack in samples],
+                "weights": weights
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            # Say so in the viewer: the samples are not limited to the profiled request
+            "name": f"{name} (process-wide: all threads of pid {os.getpid()})",
+            "exporter": "clinisearch",
+            "shared": {"frames": self.frames},
+            "profiles": profiles
+        }
+
+
+def _torch_profiler():
+    """CPU torch.profiler session that also records ops run on executor threads, or None without torch.profiler."""
+    try:
+        from torch.profiler import ProfilerActivity, profile
+    except ImportError as e:
+        print(f"Warning: torch profiler not available ({e}), recording Python stacks only")
+        return None
+
+    try:
+        from torch._C._profiler import _ExperimentalConfig
+        return profile(
+            activities=[ProfilerActivity.CPU],
+            record_shapes=True,
+            experimental_config=_ExperimentalConfig(profile_all_threads=True)
+        )
+    except (ImportError, TypeError):
+        # Older torch: only ops on the thread that started the profiler are recorded
+        return profile(activities=[ProfilerActivity.CPU], record_shapes=True)
+
+
+class RequestProfile:
+    """torch.profiler plus StackSampler around one request; save() writes its ARTIFACTS."""
+    def __init__(self, name):
+        self.name = name
+        self.request_id = uuid.uuid4().hex
+        self.sampler = StackSampler()
+        # Profiling must not pull torch into an API process that runs models out of process
+        self.torch_profiler = _torch_profiler() if "torch" in sys.modules else None
+
+    def start(self):
+        if self.torch_profiler is not None:
+            self.torch_profiler.__enter__()
+        self.sampler.start()
+
+    def stop(self):
+        self.sampler.stop()
+        if self.torch_profiler is not None:
+            self.torch_profiler.__exit__(None, None, None)
+
+    def save(self):
+        """Write the artifacts to PROFILE_DIR/<request_id>/ and drop the oldest profiles beyond PROFILE_RETENTION."""
+        directory = os.path.join(PROFILE_DIR, self.request_id)
+        partial = directory + ".partial"
+        os.makedirs(partial, exist_ok=True)
+        if self.torch_profiler is not None:
+            self.torch_profiler.export_chrome_trace(os.path.join(partial, "trace.json"))
+            with open(os.path.join(partial, "operators.txt"), "w") as f:
+                f.write(self.torch_profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=50))
+        with open(os.path.join(partial, "speedscope.json"), "w") as f:
+            json.dump(self.sampler.speedscope(self.name), f)
+        # Artifacts become visible together
+        os.rename(partial, directory)
+
+        profiles = sorted(
+            (entry for entry in os.scandir(PROFILE_DIR) if entry.is_dir() and not entry.name.endswith(".partial")),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in profiles[:-PROFILE_RETENTION]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles requests sent with an X-Profile header equal to PROFILING_TOKEN.
+
+    The response carries X-Profile-Id; the artifacts are then served by
+    GET /profiles/{request_id}/{artifact}. Only one request is profiled at a time;
+    others sent with the header meanwhile get "X-Profile-Status: busy".
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # Fetching artifacts (GET /profiles/...) sends the same header but is never profiled
+        if scope["type"] != "http" or scope["path"].startswith("/profiles/"):
+            await self.app(scope, receive, send)
+            return
+        token = dict(scope["headers"]).get(b"x-profile")
+        if token is None or not authorized(token.decode("latin-1")):
+            await self.app(scope, receive, send)
+            return
+        if not _profile_lock.acquire(blocking=False):
+            await self.app(scope, receive, self._with_headers(send, [(b"x-profile-status", b"busy")]))
+            return
+
+        from utils.executors import run_io
+
+        try:
+            profile = RequestProfile(f"{scope['method']} {scope['path']}")
+            profile.start()
+            try:
+                await self.app(scope, receive, self._with_headers(send, [
+                    (b"x-profile-id", profile.request_id.encode()),
+                    (b"x-profile-status", b"recorded")
+                ]))
+            finally:
+                profile.stop()
+            await run_io(profile.save)
+            print(f"Profiled {profile.name} as {profile.request_id}")
+        finally:
+            _profile_lock.release()
+
+    @staticmethod
+    def _with_headers(send, extra_headers):
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": list(message.get("headers", [])) + extra_headers}
+            await send(message)
+        return send_with_headers
@@ -0,0 +1,234 @@
+# utils/quantization.py
+"""
+INT8 static post-training quantization of the chest X-ray classifier.
+
+Calibrates FX graph-mode quantization (x86 qconfig) on local NIH Chest X-ray 14
+images, then compares the INT8 model with fp32 on a disjoint evaluation set: per-label
+AUROC for every entry in disease_labels, probability drift and latency. The quantized
+model is saved as a frozen TorchScript archive only if no label's AUROC drops by more
+than --max-auroc-drop.
+
+The archive is a classification-only model: load_model recognizes it, and the API
+serves it with CLASSIFIER_BACKEND=torchscript CLASSIFIER_BACKEND_PATH=<archive> while
+MODEL_PATH keeps pointing at the fp32 weights used for GradCAM.
+
+Usage:
+    python -m utils.quantization --dataset-path /data/nih_chestxray_14 --output models/chest_xray_model_int8.pt
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+from utils.diagnosis import disease_labels
+from utils.model_inference import DEFAULT_MODEL_PATH, load_model, preprocess_image, predict_probabilities
+from utils.test_data_loader import load_labeled_samples, parse_ground_truth_labels
+
+QUANTIZED_ENGINE = 'x86'
+
+
+def label_matrix(samples):
+    """Multi-hot ground truth of shape (N, len(disease_labels))."""
+    labels = np.zeros((len(samples), len(disease_labels)), dtype=np.int64)
+    for row, sample in enumerate(samples):
+        for label in parse_ground_truth_labels(sample['ground_truth']):
+            if label in disease_labels:
+                labels[row, disease_labels.index(label)] = 1
+    return labels
+
+
+def iter_image_batches(samples, batch_size=16):
+    """Preprocessed image batches for a list of samples."""
+    for start in range(0, len(samples), batch_size):
+        yield torch.cat([preprocess_image(sample['image_path']) for sample in samples[start:start + batch_size]])
+
+
+def auroc(y_true, scores):
+    """
+    Area under the ROC curve (Mann-Whitney U with average ranks for ties)
+
+    Returns:
+        AUROC, or None if y_true has only one class
+    """
+    positives = int(y_true.sum())
+    negatives = len(y_true) - positives
+    if positives == 0 or negatives == 0:
+        return None
+
+    order = np.argsort(scores, kind='mergesort')
+    sorted_scores = scores[order]
+    ranks = np.empty(len(scores), dtype=np.float64)
+    start = 0
+    while start < len(scores):
+        end = start
+        while end + 1 < len(scores) and sorted_scores[end + 1] == sorted_scores[start]:
+            end += 1
+        ranks[order[start:end + 1]] = (start + end) / 2 + 1
+        start = end + 1
+
+    rank_sum = ranks[y_true == 1].sum()
+    return float((rank_sum - positives * (positives + 1) / 2) / (positives * negatives))
+
+
+def quantize_model(model, calibration_samples, batch_size=16):
+    """
+    Static INT8 quantization with FX graph mode
+
+    Args:
+        model: Eval-mode fp32 ChestXrayModel on CPU
+        calibration_samples: Samples whose images drive the observers
+        batch_size: Calibration batch size
+
+    Returns:
+        Converted (quantized) GraphModule
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    torch.backends.quantized.engine = QUANTIZED_ENGINE
+    # The memory bank is a similarity lookup over stored features; keep it in float
+    qconfig_mapping = get_default_qconfig_mapping(QUANTIZED_ENGINE).set_module_name('memory_bank', None)
+    prepared = prepare_fx(model, qconfig_mapping, (torch.randn(1, 3, 224, 224),))
+
+    with torch.no_grad():
+        for batch in iter_image_batches(calibration_samples, batch_size):
+            prepared(batch)
+    return convert_fx(prepared)
+
+
+def to_torchscript(quantized_model):
+    """Trace and freeze the quantized model for serving."""
+    with torch.no_grad():
+        traced = torch.jit.trace(quantized_model, torch.randn(1, 3, 224, 224))
+    return torch.jit.freeze(traced)
+
+
+def median_latency_ms(model, batch, repeats=10):
+    with torch.no_grad():
+        model(batch)  # Warm-up
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(batch)
+            timings.append(time.perf_counter() - start)
+    return 1000 * float(np.median(timings))
+
+
+def comparison_report(fp32_model, int8_model, eval_samples, batch_size=16, latency_batch_sizes=(1, 16)):
+    """
+    Compare fp32 and INT8 models on held-out samples
+
+    Args:
+        fp32_model: Eval-mode fp32 model
+        int8_model: Quantized (TorchScript) model
+        eval_samples: Samples not used for calibration
+        batch_size: Evaluation batch size
+        latency_batch_sizes: Batch sizes to time
+
+    Returns:
+        Dictionary with per-label AUROC, probability drift and latency
+    """
+    fp32_probs, int8_probs = [], []
+    for batch in iter_image_batches(eval_samples, batch_size):
+        fp32_probs.append(predict_probabilities(fp32_model, batch, device='cpu'))
+        int8_probs.append(predict_probabilities(int8_model, batch, device='cpu'))
+    fp32_probs = np.concatenate(fp32_probs)
+    int8_probs = np.concatenate(int8_probs)
+    labels = label_matrix(eval_samples)
+
+    per_label = []
+    for index, disease in enumerate(disease_labels):
+        fp32_auroc = auroc(labels[:, index], fp32_probs[:, index])
+        int8_auroc = auroc(labels[:, index], int8_probs[:, index])
+        per_label.append({
+            'disease': disease,
+            'positives': int(labels[:, index].sum()),
+            'auroc_fp32': fp32_auroc,
+            'auroc_int8': int8_auroc,
+            'auroc_drop': fp32_auroc - int8_auroc if fp32_auroc is not None else None
+        })
+
+    sample_batch = next(iter_image_batches(eval_samples[:max(latency_batch_sizes)], max(latency_batch_sizes)))
+    latency = {}
+    for size in latency_batch_sizes:
+        batch = sample_batch[:size]
+        if len(batch) < size:
+            continue
+        latency[size] = {
+            'fp32_ms': median_latency_ms(fp32_model, batch),
+            'int8_ms': median_latency_ms(int8_model, batch)
+        }
+
+    drops = [row['auroc_drop'] for row in per_label if row['auroc_drop'] is not None]
+    return {
+        'eval_samples': len(eval_samples),
+        'per_label': per_label,
+        'max_auroc_drop': max(drops) if drops else None,
+        'max_abs_prob_diff': float(np.abs(fp32_probs - int8_probs).max()),
+        'latency': latency
+    }
+
+
+def print_report(report):
+    def fmt(value):
+        return f"{value:.4f}" if value is not None else "   n/a"
+
+    print(f"\n{'disease':<20} {'pos':>5} {'AUROC fp32':>11} {'AUROC int8':>11} {'drop':>8}")
+    for row in report['per_label']:
+        print(f"{row['disease']:<20} {row['positives']:>5} {fmt(row['auroc_fp32']):>11} "
+              f"{fmt(row['auroc_int8']):>11} {fmt(row['auroc_drop']):>8}")
+    print(f"\nEvaluation images: {report['eval_samples']}")
+    print(f"Max AUROC drop: {fmt(report['max_auroc_drop'])}")
+    print(f"Max |probability difference|: {report['max_abs_prob_diff']:.4f}")
+    for size, timing in report['latency'].items():
+        print(f"Batch {size}: fp32 {timing['fp32_ms']:.1f} ms, int8 {timing['int8_ms']:.1f} ms "
+              f"({timing['fp32_ms'] / timing['int8_ms']:.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset-path', required=True, help='Path to the nih_chestxray_14 folder')
+    parser.add_argument('--model-path', default=DEFAULT_MODEL_PATH)
+    parser.add_argument('--output', required=True, help='Where to save the quantized TorchScript model')
+    parser.add_argument('--calibration-samples', type=int, default=256)
+    parser.add_argument('--eval-samples', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--max-auroc-drop', type=float, default=0.01)
+    parser.add_argument('--report', help='Also write the comparison report to this JSON file')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    samples = load_labeled_samples(args.dataset_path, args.calibration_samples + args.eval_samples, seed=args.seed)
+    if len(samples) <= args.calibration_samples:
+        raise SystemExit(f"Found {len(samples)} local images; need more than {args.calibration_samples} for calibration and evaluation")
+    calibration_samples = samples[:args.calibration_samples]
+    eval_samples = samples[args.calibration_samples:]
+
+    fp32_model = load_model(args.model_path, device='cpu')
+    print(f"Calibrating on {len(calibration_samples)} images...")
+    # prepare_fx rewrites the module it is given, so quantize a fresh copy
+    int8_model = to_torchscript(quantize_model(load_model(args.model_path, device='cpu'), calibration_samples, args.batch_size))
+
+    print(f"Evaluating on {len(eval_samples)} images...")
+    report = comparison_report(fp32_model, int8_model, eval_samples, args.batch_size)
+    report['max_auroc_drop_allowed'] = args.max_auroc_drop
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if report['max_auroc_drop'] is not None and report['max_auroc_drop'] > args.max_auroc_drop:
+        print(f"FAILED: AUROC drop exceeds {args.max_auroc_drop}; quantized model not saved")
+        raise SystemExit(1)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    torch.jit.save(int8_model, args.output)
+    print(f"Saved quantized model to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
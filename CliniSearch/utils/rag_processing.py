@@ -2,14 +2,25 @@
 
 import httpx
 import asyncio
-from sentence_transformers import SentenceTransformer
+import threading
 import numpy as np
 import faiss
 import fitz  # PyMuPDF
 from typing import List, Dict, Tuple
+from utils.lazy_resources import register_resource
+from utils.executors import run_cpu
+from utils.telemetry import stage_timer
 
-# --- Configuration (remains the same) ---
-EMBEDDING_MODEL = SentenceTransformer('all-MiniLM-L6-v2')
+# --- Configuration ---
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_DIMENSION = 384  # Output size of all-MiniLM-L6-v2, known without loading the model
+
+def _load_embedding_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL_NAME)
+
+# Loaded in the background at API startup, or on first use
+EMBEDDING_MODEL = register_resource("sentence_transformer", _load_embedding_model)
 WEB_SEARCH_MCP_URL = "http://localhost:8001/execute"
 PUBMED_MCP_URL = "http://localhost:8002/execute"
 
@@ -17,6 +28,11 @@ PUBMED_MCP_URL = "http://localhost:8002/execute"
 # --- Tool Interaction (remains the same) ---
 async def query_mcp_server(url: str, query: str) -> Dict:
     """Queries an MCP server asynchronously."""
+    stage = "pubmed" if url == PUBMED_MCP_URL else "web_search"
+    with stage_timer(stage):
+        return await _post_mcp_query(url, query)
+
+async def _post_mcp_query(url: str, query: str) -> Dict:
     async with httpx.AsyncClient() as client:
         try:
             response = await client.post(url, json={"query": query}, timeout=30.0)
@@ -57,21 +73,30 @@ def parse_pdf(file_bytes: bytes, filename: str) -> List[Dict]:
         return []
 
 class VectorStore:
-    def __init__(self, dimension):
+    def __init__(self, dimension, embedder=None):
         self.dimension = dimension
+        # Anything with SentenceTransformer's encode (e.g. the inference service's RemoteEmbedder)
+        self.embedder = EMBEDDING_MODEL if embedder is None else embedder
         self.index = faiss.IndexFlatL2(dimension)
         self.documents = []
+        # Uploads and searches run concurrently on the CPU executor: index rows and
+        # self.documents must change together, and faiss add/search must not overlap
+        self._lock = threading.Lock()
     def add_documents(self, docs: List[Dict]):
         contents = [doc['content'] for doc in docs]
         if not contents: return
-        embeddings = EMBEDDING_MODEL.encode(contents, convert_to_tensor=False)
-        self.index.add(np.array(embeddings).astype('float32'))
-        self.documents.extend(docs)
+        with stage_timer("embed"):
+            embeddings = self.embedder.encode(contents, convert_to_tensor=False)
+        with self._lock:
+            self.index.add(np.array(embeddings).astype('float32'))
+            self.documents.extend(docs)
     def search(self, query: str, k=3) -> List[Dict]:
         if self.index.ntotal == 0: return []
-        query_embedding = EMBEDDING_MODEL.encode([query], convert_to_tensor=False)
-        distances, indices = self.index.search(np.array(query_embedding).astype('float32'), k=min(k, self.index.ntotal))
-        return [self.documents[i] for i in indices[0] if i != -1]
+        with stage_timer("vector_search"):
+            query_embedding = self.embedder.encode([query], convert_to_tensor=False)
+            with self._lock:
+                distances, indices = self.index.search(np.array(query_embedding).astype('float32'), k=min(k, self.index.ntotal))
+                return [self.documents[i] for i in indices[0] if i != -1]
 
 
 # --- Main RAG Orchestration (MODIFIED AND CORRECTED) ---
@@ -125,7 +150,7 @@ async def perform_rag(query: str, vector_store: VectorStore, use_web=True, use_p
     # query the documents they have uploaded.
     if not use_web and not use_pubmed:
         print("Querying uploaded documents only...")
-        semantic_results = vector_store.search(query, k=5) # Get more results if it's the only source
+        semantic_results = await run_cpu(vector_store.search, query, k=5) # Get more results if it's the only source
         if semantic_results:
             context += "--- Context from Uploaded Documents ---\n"
             for res in semantic_results:
@@ -0,0 +1,216 @@
+# utils/response_cache.py
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from utils.executors import run_io
+
+
+def cache_key(**parts):
+    """Stable SHA-256 key over named request parameters (image digest, threshold, versions, ...)."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class MemoryTier:
+    """LRU of encoded responses bounded by entry count and total bytes, with a TTL."""
+    def __init__(self, ttl_seconds, max_entries, max_bytes):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, expires_at=None):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (expires_at or time.time() + self.ttl_seconds, value)
+            self.total_bytes += len(value)
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= len(entry[1])
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteTier:
+    """On-disk tier in one SQLite file, bounded by total bytes (least recently used first) and TTL."""
+    def __init__(self, path, ttl_seconds, max_bytes):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None, None
+            if row[1] < now:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None, None
+            self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0], row[1]
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now + self.ttl_seconds, now)
+            )
+            self._db.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                # Drop least recently used entries until the tier fits again
+                for evict_key, size in self._db.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed_at"
+                ).fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (evict_key,))
+                    total -= size
+            self._db.execute("COMMIT")
+
+    def describe(self):
+        with self._lock:
+            entries, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"path": self.path, "entries": entries, "bytes": total, "max_bytes": self.max_bytes}
+
+
+class ResponseCache:
+    """
+    Two-tier cache of encoded responses with single-flight computation.
+
+    Lookups check the in-memory LRU, then the optional SQLite tier (hits there are
+    promoted to memory). Concurrent requests for the same key share one computation:
+    the first computes, the others await its result.
+    """
+    def __init__(self, ttl_seconds=3600, max_entries=64, max_bytes=256 * 1024 * 1024,
+                 disk_path=None, disk_max_bytes=1024 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.memory = MemoryTier(ttl_seconds, max_entries, max_bytes)
+        self.disk = SqliteTier(disk_path, ttl_seconds, disk_max_bytes) if disk_path else None
+        self._inflight = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "shared": 0, "misses": 0, "bypassed": 0}
+
+    async def get(self, key):
+        """Cached value for key, or None."""
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+        if self.disk is not None:
+            value, expires_at = await run_io(self.disk.get, key)
+            if value is not None:
+                self.stats["disk_hits"] += 1
+                self.memory.put(key, value, expires_at)
+                return value
+        return None
+
+    async def put(self, key, value):
+        self.memory.put(key, value)
+        if self.disk is not None:
+            await run_io(self.disk.put, key, value)
+
+    async def get_or_compute(self, key, compute, bypass=False, share=True):
+        """
+        Return the cached value for key, computing it once if missing.
+
+        Args:
+            key: Cache key (see cache_key)
+            compute: Async function returning (value bytes, cacheable)
+            bypass: Skip the lookup and compute a fresh value (which is stored again)
+            share: Join an identical in-flight computation and let later requests join
+                this one; False computes privately (e.g. under a request deadline)
+
+        Returns:
+            (value, status) with status "HIT", "SHARED" (joined an identical in-flight
+            request), "MISS" or "BYPASS"
+        """
+        if not bypass:
+            value = await self.get(key)
+            if value is not None:
+                return value, "HIT"
+        if share and key in self._inflight:
+            # An identical request is computing right now; its result is at least as fresh
+            self.stats["shared"] += 1
+            return await asyncio.shield(self._inflight[key]), "SHARED"
+
+        self.stats["bypassed" if bypass else "misses"] += 1
+        if not share:
+            value, cacheable = await compute()
+            if cacheable:
+                await self.put(key, value)
+            return value, "BYPASS" if bypass else "MISS"
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value, cacheable = await compute()
+            if cacheable:
+                await self.put(key, value)
+            future.set_result(value)
+            return value, "BYPASS" if bypass else "MISS"
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception retrieved when no other request was waiting for it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def describe(self):
+        return {
+            "ttl_seconds": self.ttl_seconds,
+            "memory": {
+                "entries": len(self.memory),
+                "bytes": self.memory.total_bytes,
+                "max_entries": self.memory.max_entries,
+                "max_bytes": self.memory.max_bytes
+            },
+            "disk": self.disk.describe() if self.disk is not None else None,
+            "in_flight": len(self._inflight),
+            "stats": dict(self.stats)
+        }
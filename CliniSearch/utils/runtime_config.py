@@ -0,0 +1,140 @@
+# utils/runtime_config.py
+
+import os
+import sys
+import tempfile
+
+# Applied settings, filled in by configure_runtime
+RUNTIME_SETTINGS = {}
+
+# Held open for the life of the process to keep this worker's affinity slot
+_slot_file = None
+
+
+def available_cores():
+    """CPU ids this process may run on (respects cgroup/taskset restrictions)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _claim_worker_slot(num_slots):
+    """
+    Claim the first free worker slot with an exclusive flock on a per-slot file.
+
+    Every uvicorn worker runs the same startup code with no worker index, so slots are
+    handed out first-come first-served; a lock is released when its worker exits.
+    """
+    global _slot_file
+    import fcntl
+
+    slot_dir = os.path.join(tempfile.gettempdir(), "clinisearch-cpu-slots")
+    os.makedirs(slot_dir, exist_ok=True)
+    for slot in range(num_slots):
+        slot_file = open(os.path.join(slot_dir, f"slot-{slot}.lock"), "w")
+        try:
+            fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            slot_file.close()
+            continue
+        _slot_file = slot_file
+        return slot
+    return None
+
+
+def configure_runtime(torch_threads=True):
+    """
+    Size torch, faiss and OpenCV thread pools to this worker's share of the CPU.
+
+    With API_WORKERS (or WEB_CONCURRENCY) worker processes on one machine, every library
+    would otherwise start one thread per core in every worker. The per-worker budget is
+    CORES_PER_WORKER, or the available cores divided by the worker count. With
+    CPU_AFFINITY=true each worker is also pinned to its own slice of cores.
+
+    Args:
+        torch_threads: Also size torch's pools; False in processes that never import torch
+
+    Returns:
+        Dictionary of the applied settings (also kept in RUNTIME_SETTINGS)
+    """
+    cores = available_cores()
+    workers = max(1, int(os.getenv("API_WORKERS", os.getenv("WEB_CONCURRENCY", 1))))
+    budget = int(os.getenv("CORES_PER_WORKER", 0)) or max(1, len(cores) // workers)
+    interop_threads = int(os.getenv("TORCH_INTEROP_THREADS", 1))
+
+    settings = {
+        "pid": os.getpid(),
+        "available_cores": len(cores),
+        "workers": workers,
+        "cores_per_worker": budget,
+        "affinity": None,
+        "errors": []
+    }
+
+    if os.getenv("CPU_AFFINITY", "false").lower() == "true" and hasattr(os, "sched_setaffinity"):
+        slot = _claim_worker_slot(max(workers, len(cores) // budget))
+        if slot is None:
+            settings["errors"].append("cpu_affinity: no free worker slot")
+        else:
+            start = (slot * budget) % len(cores)
+            pinned = [cores[(start + offset) % len(cores)] for offset in range(budget)]
+            os.sched_setaffinity(0, pinned)
+            settings["affinity"] = {"slot": slot, "cores": pinned}
+
+    # Libraries that read their thread count when first loaded
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ.setdefault(variable, str(budget))
+
+    if torch_threads:
+        import torch
+        torch.set_num_threads(budget)
+        try:
+            # Forked workers inherit the parent's inter-op pool, which can no longer be resized
+            if torch.get_num_interop_threads() != interop_threads:
+                torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as e:
+            # Only possible before any inter-op parallel work has started
+            settings["errors"].append(f"torch_interop_threads: {e}")
+        settings["torch_threads"] = torch.get_num_threads()
+        settings["torch_interop_threads"] = torch.get_num_interop_threads()
+
+    try:
+        import faiss
+        faiss.omp_set_num_threads(budget)
+        settings["faiss_threads"] = faiss.omp_get_max_threads()
+    except ImportError:
+        settings["faiss_threads"] = None
+
+    try:
+        import cv2
+        cv2.setNumThreads(budget)
+        settings["cv2_threads"] = cv2.getNumThreads()
+    except ImportError:
+        settings["cv2_threads"] = None
+
+    RUNTIME_SETTINGS.clear()
+    RUNTIME_SETTINGS.update(settings)
+    print(f"Runtime: {workers} worker(s), {budget} core(s) per worker"
+          + (f", pinned to {settings['affinity']['cores']}" if settings["affinity"] else ""))
+    return settings
+
+
+def runtime_diagnostics():
+    """Applied settings alongside the values the libraries currently report."""
+    current = {"cpu_affinity": available_cores()}
+    # Only reported where torch is already loaded; diagnostics must not import it
+    if "torch" in sys.modules:
+        torch = sys.modules["torch"]
+        current["torch_threads"] = torch.get_num_threads()
+        current["torch_interop_threads"] = torch.get_num_interop_threads()
+    try:
+        import faiss
+        current["faiss_threads"] = faiss.omp_get_max_threads()
+    except ImportError:
+        pass
+    try:
+        import cv2
+        current["cv2_threads"] = cv2.getNumThreads()
+    except ImportError:
+        pass
+    return {"configured": dict(RUNTIME_SETTINGS), "current": current}
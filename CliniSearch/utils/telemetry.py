@@ -0,0 +1,192 @@
+# utils/telemetry.py
+
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import prometheus_client
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    prometheus_client = None
+    PROMETHEUS_AVAILABLE = False
+
+# Stable stage names: dashboards and alerts are built on these, so rename with care
+STAGES = (
+    "decode",             # image bytes -> reduced-resolution pixels
+    "preprocess",         # pixels -> normalized model input
+    "forward",            # classifier forward pass (probabilities or final-block activations)
+    "gradcam",            # one GradCAM grid (one class)
+    "attention",          # spatial attention map
+    "render",             # one matplotlib figure rendered to PNG
+    "xray_detect",        # BiomedCLIP X-ray probability
+    "inference_service",  # round trip to the out-of-process inference service
+    "pubmed",             # one PubMed MCP call
+    "web_search",         # one web search MCP call
+    "gemini",             # one Gemini call
+    "embed",              # sentence-transformer embeddings of uploaded chunks
+    "vector_search",      # query embedding and FAISS search
+    "encode",             # response serialization
+)
+
+# Stage durations range from sub-millisecond tensor work to minute-long Gemini calls
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+if PROMETHEUS_AVAILABLE:
+    STAGE_DURATION = prometheus_client.Histogram(
+        "clinisearch_stage_duration_seconds",
+        "Duration of one pipeline stage call",
+        ["endpoint", "stage"],
+        buckets=DURATION_BUCKETS
+    )
+    REQUEST_DURATION = prometheus_client.Histogram(
+        "clinisearch_request_duration_seconds",
+        "Duration of an HTTP request until its response started",
+        ["endpoint", "method", "status"],
+        buckets=DURATION_BUCKETS
+    )
+    # Bulkhead admission (utils/executors.py): alert on a growing queue and on shed requests
+    BULKHEAD_WAITING = prometheus_client.Gauge(
+        "clinisearch_bulkhead_waiting",
+        "Requests waiting for a bulkhead slot",
+        ["bulkhead"],
+        multiprocess_mode="livesum"
+    )
+    BULKHEAD_REJECTED = prometheus_client.Counter(
+        "clinisearch_bulkhead_rejected",
+        "Requests rejected by a bulkhead (queue_full: 429, wait_exceeded: 503)",
+        ["bulkhead", "reason"]
+    )
+    BULKHEAD_WAIT = prometheus_client.Histogram(
+        "clinisearch_bulkhead_wait_seconds",
+        "Time an admitted request waited for a bulkhead slot",
+        ["bulkhead"],
+        buckets=DURATION_BUCKETS
+    )
+
+# Stage timings of the request being served. Tasks and executor calls (run_in_executor)
+# copy the context, so they record into the same collector
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Stage durations recorded while serving one request."""
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples.append((stage, seconds))
+
+    def totals(self):
+        """Dictionary of stage -> (summed seconds, calls), in order of first completion."""
+        totals = {}
+        with self._lock:
+            for stage, seconds in self.samples:
+                total, calls = totals.get(stage, (0.0, 0))
+                totals[stage] = (total + seconds, calls + 1)
+        return totals
+
+    def server_timing(self):
+        """Server-Timing header value: one entry per stage (summed over calls) plus the total."""
+        entries = []
+        for stage, (seconds, calls) in self.totals().items():
+            entry = f"{stage};dur={seconds * 1000:.1f}"
+            if calls > 1:
+                entry += f';desc="{calls} calls"'
+            entries.append(entry)
+        entries.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time a block as one call of stage (one of STAGES) for Server-Timing and /metrics."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started_at
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add(stage, seconds)
+        elif PROMETHEUS_AVAILABLE:
+            # Outside a request (startup, background loading, inference service process)
+            STAGE_DURATION.labels(endpoint="none", stage=stage).observe(seconds)
+
+
+def _route_path(app, scope):
+    """Route template of a request (e.g. /profiles/{request_id}/{artifact}), keeping label values bounded."""
+    from starlette.routing import Match
+
+    for route in getattr(app, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", scope["path"])
+    return "unmatched"
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware that collects per-stage timings for each HTTP request.
+
+    Stage timings are added to the response as a Server-Timing header and observed in
+    the Prometheus histograms labelled with the route template.
+    """
+    def __init__(self, app, route_app=None):
+        self.app = app
+        # Application whose routes name the endpoint label (the FastAPI app)
+        self.route_app = route_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _request_timings.set(timings)
+        status = {"code": 500, "started_after": None}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                status["started_after"] = time.perf_counter() - timings.started_at
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            if PROMETHEUS_AVAILABLE:
+                endpoint = _route_path(self.route_app, scope) if self.route_app is not None else scope["path"]
+                for stage, seconds in list(timings.samples):
+                    STAGE_DURATION.labels(endpoint=endpoint, stage=stage).observe(seconds)
+                duration = status["started_after"]
+                if duration is None:
+                    duration = time.perf_counter() - timings.started_at
+                REQUEST_DURATION.labels(endpoint=endpoint, method=scope["method"], status=str(status["code"])).observe(duration)
+
+
+def metrics_payload():
+    """
+    Prometheus exposition of this process's metrics, or of all workers when
+    PROMETHEUS_MULTIPROC_DIR is set (prometheus_client multiprocess mode).
+
+    Returns:
+        Tuple of (body bytes, content type); raises RuntimeError without prometheus_client
+    """
+    if not PROMETHEUS_AVAILABLE:
+        raise RuntimeError("prometheus_client is not installed")
+    registry = prometheus_client.REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
@@ -185,4 +185,54 @@ def compare_predictions_with_ground_truth(predicted_diseases, ground_truth_str):
         'false_positives': false_positives,
         'ground_truth': ground_truth_labels,
         'predicted': predicted_labels
-    }
\ No newline at end of file
+    }
+
+def index_image_paths(dataset_path):
+    """
+    Map image file names to their full paths across all image folders
+    
+    Args:
+        dataset_path: Path to nih_chestxray_14 folder
+        
+    Returns:
+        Dictionary of image name -> full path
+    """
+    image_paths = {}
+    for i in range(1, 13):  # images_001 to images_012
+        images_folder = os.path.join(dataset_path, f"images_{i:03d}", "images")
+        if os.path.exists(images_folder):
+            for image_name in os.listdir(images_folder):
+                image_paths[image_name] = os.path.join(images_folder, image_name)
+    return image_paths
+
+def load_labeled_samples(dataset_path, num_samples=None, seed=0):
+    """
+    Load a reproducible random set of locally available images with their labels
+    
+    Args:
+        dataset_path: Path to nih_chestxray_14 folder
+        num_samples: Number of samples to return (default: all available images)
+        seed: Random seed for the sample order
+        
+    Returns:
+        List of dictionaries with image_name, image_path and ground_truth
+    """
+    csv_path = os.path.join(dataset_path, "Data_Entry_2017.csv")
+    if not os.path.exists(csv_path):
+        return []
+    
+    df = pd.read_csv(csv_path, usecols=['Image Index', 'Finding Labels'])
+    image_paths = index_image_paths(dataset_path)
+    df = df[df['Image Index'].isin(image_paths)]
+    df = df.sample(frac=1.0, random_state=seed)
+    if num_samples is not None:
+        df = df.head(num_samples)
+    
+    return [
+        {
+            'image_name': row['Image Index'],
+            'image_path': image_paths[row['Image Index']],
+            'ground_truth': row['Finding Labels']
+        }
+        for _, row in df.iterrows()
+    ]
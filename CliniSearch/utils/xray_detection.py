@@ -0,0 +1,187 @@
+# utils/xray_detection.py
+
+import json
+import os
+import threading
+
+from utils.image_ingest import DecodedImage
+from utils.telemetry import stage_timer
+
+# torch is imported inside the functions that run a tower, so API workers that only
+# forward detections to the inference service can import this module without it
+BIOMEDCLIP_MODEL_ID = "hf-hub:microsoft/BiomedCLIP-PubMedBERT_256-vit_base_patch16_224"
+BIOMEDCLIP_CONTEXT_LENGTH = 256
+
+# Exported vision tower (see utils/biomedclip_export.py); when set, PubMedBERT is never loaded
+BIOMEDCLIP_VISION_PATH = os.getenv("BIOMEDCLIP_VISION_PATH")
+
+# Zero-shot prompts; the X-ray probability is the summed softmax mass of the positive labels
+XRAY_LABELS_POS = ["a chest X-ray radiograph", "a bone X-ray radiograph", "a dental X-ray radiograph"]
+XRAY_LABELS_NEG = [
+    "a CT scan", "an MRI scan", "an ultrasound image",
+    "a natural photograph", "a document scan", "a drawing or illustration"
+]
+
+
+def load_xray_detector():
+    """Load the exported vision tower if BIOMEDCLIP_VISION_PATH is set, else the full open_clip model."""
+    if BIOMEDCLIP_VISION_PATH:
+        try:
+            return load_exported_detector(BIOMEDCLIP_VISION_PATH)
+        except Exception as e:
+            print(f"Warning: exported BiomedCLIP vision tower not usable ({e}), falling back to open_clip")
+    return load_open_clip_detector()
+
+
+def load_open_clip_detector():
+    """Load BiomedCLIP from the Hugging Face hub and wrap it in an XrayDetector."""
+    from open_clip import create_model_from_pretrained, get_tokenizer
+
+    model, preprocess = create_model_from_pretrained(BIOMEDCLIP_MODEL_ID)
+    tokenizer = get_tokenizer(BIOMEDCLIP_MODEL_ID)
+    model.eval()
+    return XrayDetector(model, preprocess, tokenizer)
+
+
+def sidecar_path(vision_path):
+    """Metadata file written next to an exported vision tower."""
+    return os.path.splitext(vision_path)[0] + ".json"
+
+
+class OnnxVisionTower:
+    """BiomedCLIP image encoder exported to ONNX, run with ONNX Runtime on CPU."""
+    def __init__(self, path):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def encode_image(self, image_batch, normalize=True):
+        import torch
+        # The exported graph already L2-normalizes its output
+        features = self.session.run(None, {self.input_name: image_batch.numpy()})[0]
+        return torch.from_numpy(features)
+
+
+class TorchScriptVisionTower:
+    """BiomedCLIP image encoder saved as a (possibly INT8 dynamically quantized) TorchScript module."""
+    def __init__(self, path):
+        import torch
+        self.module = torch.jit.load(path, map_location="cpu").eval()
+
+    def encode_image(self, image_batch, normalize=True):
+        import torch
+        # The traced module already L2-normalizes its output
+        with torch.no_grad():
+            return self.module(image_batch)
+
+
+VISION_RUNTIMES = {"onnx": OnnxVisionTower, "torchscript": TorchScriptVisionTower}
+
+
+def load_exported_detector(vision_path):
+    """
+    Build an XrayDetector from an exported vision tower and its sidecar metadata.
+
+    The sidecar holds the label prompts, their text features and the logit scale, so
+    neither the text tower nor the tokenizer is needed at serving time.
+    """
+    import torch
+    from open_clip.transform import PreprocessCfg, image_transform_v2
+
+    with open(sidecar_path(vision_path)) as f:
+        metadata = json.load(f)
+
+    vision_model = VISION_RUNTIMES[metadata["format"]](vision_path)
+    preprocess = image_transform_v2(PreprocessCfg(**metadata["preprocess"]), is_train=False)
+    return XrayDetector(
+        vision_model, preprocess, tokenizer=None,
+        labels_pos=metadata["labels_pos"], labels_neg=metadata["labels_neg"],
+        text_features=torch.tensor(metadata["text_features"], dtype=torch.float32),
+        logit_scale=torch.tensor(metadata["logit_scale"], dtype=torch.float32)
+    )
+
+
+class XrayDetector:
+    """
+    BiomedCLIP zero-shot X-ray detector.
+
+    The label prompts never change between requests, so their normalized text features
+    and the logit scale are computed once (and again only when set_labels receives a
+    different label set). Each detection then runs the vision tower plus one matmul.
+
+    With tokenizer=None the model only needs encode_image (an exported vision tower) and
+    the precomputed text_features / logit_scale must be passed in.
+    """
+    def __init__(self, model, preprocess, tokenizer, labels_pos=XRAY_LABELS_POS, labels_neg=XRAY_LABELS_NEG,
+                 text_features=None, logit_scale=None):
+        self.model = model
+        self.preprocess = preprocess
+        self.tokenizer = tokenizer
+        self.labels = None
+        self._lock = threading.Lock()
+        if text_features is not None:
+            self._set_features(labels_pos, labels_neg, text_features, logit_scale)
+        else:
+            self.set_labels(labels_pos, labels_neg)
+
+    def _set_features(self, labels_pos, labels_neg, text_features, logit_scale):
+        with self._lock:
+            self.labels = tuple(labels_pos) + tuple(labels_neg)
+            self.num_positive = len(labels_pos)
+            self.text_features = text_features
+            self.logit_scale = logit_scale
+
+    def set_labels(self, labels_pos, labels_neg):
+        """Encode the label prompts with the text tower if the label set changed."""
+        labels = tuple(labels_pos) + tuple(labels_neg)
+        if labels == self.labels:
+            return
+        if self.tokenizer is None:
+            raise RuntimeError("Exported BiomedCLIP vision tower has no text tower; re-export it to change the labels")
+
+        import torch
+        with torch.no_grad():
+            tokens = self.tokenizer(list(labels), context_length=BIOMEDCLIP_CONTEXT_LENGTH)
+            text_features = self.model.encode_text(tokens, normalize=True)
+            logit_scale = self.model.logit_scale.exp()
+
+        self._set_features(labels_pos, labels_neg, text_features, logit_scale)
+
+    def image_input(self, image):
+        """BiomedCLIP input tensor (1, 3, 224, 224) for a PIL image or DecodedImage."""
+        def build(pil_image):
+            with stage_timer("preprocess"):
+                return self.preprocess(pil_image.convert("RGB")).unsqueeze(0)
+        if isinstance(image, DecodedImage):
+            return image.derive("biomedclip", lambda: build(image.to_pil()))
+        return build(image)
+
+    def label_probabilities(self, image_batch):
+        """Softmax over the label set for a preprocessed image batch, shape (N, num_labels)."""
+        import torch
+        with self._lock:
+            text_features, logit_scale = self.text_features, self.logit_scale
+
+        with stage_timer("xray_detect"), torch.no_grad():
+            image_features = self.model.encode_image(image_batch, normalize=True)
+            return (logit_scale * image_features @ text_features.T).softmax(dim=-1)
+
+    def xray_probabilities(self, image_batch):
+        """X-ray probability for each image in a preprocessed batch."""
+        probs = self.label_probabilities(image_batch)
+        return probs[:, :self.num_positive].sum(dim=-1).tolist()
+
+    def xray_probability(self, image):
+        """Probability that a single image is an X-ray."""
+        return self.xray_probabilities(self.image_input(image))[0]
+
+    def batch_xray_probabilities(self, image_inputs, batch_size=16):
+        """X-ray probabilities for many preprocessed (1, 3, 224, 224) inputs, run through the vision tower in batches."""
+        import torch
+        probabilities = []
+        for start in range(0, len(image_inputs), batch_size):
+            probabilities.extend(self.xray_probabilities(torch.cat(image_inputs[start:start + batch_size])))
+        return probabilities